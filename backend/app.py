@@ -1,36 +1,412 @@
-from flask import Flask, render_template, request, jsonify, send_file
-from flask_socketio import SocketIO, emit
-import speedtest
+from flask import Flask, Response, render_template, request, jsonify, send_file
+from flask_socketio import SocketIO, emit, join_room
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import time
 import threading
 from datetime import datetime
-from statistics import mean, stdev
 import json
-import tempfile
+import hmac
+import io
 import os
+import re
+import sys
+import uuid
+from urllib.parse import quote, urlencode
+
+from cancellation import CancelToken, TestCancelled
+from convergence import ConvergencePolicy
+from export_jobs import ExportService
+from ingest import IngestError, decode_body, parse_batch
+from latency import LatencySampler, latency_stats, latency_url
+from local_server import create_speedtest
+from metrics import LATENCY_BUCKETS, LabelLimiter, timed
+from monitor import (PROBE_BYTES, DataBudget, DegradationDetector, FullTestSchedule,
+                     OutageTracker, transfer_cap)
+from reports import MIMETYPES
+from result_store import MAX_BUCKETS, ResultStore
+from scheduler import QueueFull, TestScheduler
+from server_catalog import ServerCatalog, fetch_servers
+from server_probe import ServerProber
+from session_events import SessionEvents, session_room
+from session_pool import SessionPool, WarmSession
+from session_registry import create_registry, worker_id
+from streaming_stats import MetricAccumulator, StabilityAccumulator
+from throughput import TransferSampler, stop_transfers
+from throughput_engine import ThroughputEngine
+from tracing import NULL_TRACE, Tracer
+from wire_format import CompactCodec
 
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# With several workers behind a load balancer, set SOCKETIO_MESSAGE_QUEUE
+# (e.g. redis://host:6379/0) so a test's events reach its client's socket
+# whichever worker runs the test
+socketio = SocketIO(app, cors_allowed_origins="*",
+                    message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
+
+# Prometheus metrics, served at /metrics
+metrics = CollectorRegistry()
+phase_seconds = Histogram(
+    'speedtest_phase_seconds', 'Wall-clock time of each completed speed test phase', ['phase'],
+    buckets=LATENCY_BUCKETS, registry=metrics)
+server_list_seconds = Histogram(
+    'speedtest_server_list_fetch_seconds', 'Time to fetch the upstream server list',
+    buckets=LATENCY_BUCKETS, registry=metrics)
+server_list_failures = Counter(
+    'speedtest_server_list_fetch_failures', 'Failed upstream server list fetches', registry=metrics)
+export_seconds = Histogram(
+    'speedtest_export_render_seconds', 'Time from submission to a rendered report', ['format', 'outcome'],
+    buckets=LATENCY_BUCKETS, registry=metrics)
+tests_finished = Counter(
+    'speedtest_tests', 'Speed tests run, by type and outcome', ['test_type', 'outcome'], registry=metrics)
+events_sent = Counter(
+    'speedtest_socketio_events', 'Socket.IO frames sent to session rooms', ['event'], registry=metrics)
+ingested_results = Counter(
+    'speedtest_ingested_results', 'Agent results received, by outcome', ['outcome'], registry=metrics)
+# Per-server distributions; servers past the first METRICS_MAX_SERVERS share the label 'other'
+server_label = LabelLimiter(int(os.environ.get('METRICS_MAX_SERVERS', 20)))
+throughput_mbps = Histogram(
+    'speedtest_throughput_mbps', 'Measured throughput per test', ['direction', 'server'],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000), registry=metrics)
+rtt_ms = Histogram(
+    'speedtest_rtt_ms', 'Round-trip time of latency samples and monitoring probes', ['server'],
+    buckets=(1, 2.5, 5, 10, 20, 40, 80, 160, 320, 640, 1280, 2560), registry=metrics)
+
+# Per-test timing traces, kept for tests that asked for one ('trace' in
+# start_test), for every test with TRACE_ALL, or for tests slower than
+# TRACE_SLOW_SECONDS
+tracer = Tracer(
+    capacity=int(os.environ.get('TRACE_CAPACITY', 50)),
+    max_events=int(os.environ.get('TRACE_MAX_EVENTS', 20000)),
+    trace_all=os.environ.get('TRACE_ALL') == '1',
+    slow_threshold=float(os.environ.get('TRACE_SLOW_SECONDS', 0)) or None
+)
+
+def on_event_sent(event, session_id, seconds):
+    """Count every Socket.IO frame and trace it for traced sessions"""
+    events_sent.labels(event).inc()
+    end = time.perf_counter()
+    tracer.active(session_id).complete(f'emit {event}', 'socketio', end - seconds, end)
+
+# Test events go to the session's room only; fast progress frames are coalesced
+session_events = SessionEvents(
+    socketio,
+    max_rate=float(os.environ.get('PROGRESS_MAX_RATE', 5)),
+    on_send=on_event_sent
+)
 
 # Global variables to manage test state
-active_tests = {}
-
-def calculate_jitter(ping_results):
-    """Calculate jitter from ping results"""
-    if len(ping_results) < 2:
-        return 0
-    differences = []
-    for i in range(1, len(ping_results)):
-        differences.append(abs(ping_results[i] - ping_results[i-1]))
-    return mean(differences) if differences else 0
-
-def run_single_speed_test(session_id, preferred_server_id=None):
+active_tests = {}  # session_id -> CancelToken of its queued or running test in this worker
+client_sessions = {}  # Socket.IO sid -> session_ids it started
+
+# Which worker runs each session's test, shared between workers so stop_test
+# and restarts reach a test started through another worker. memory:// for a
+# single process, sqlite:///path.db for workers on one host, redis://... across hosts
+WORKER_ID = worker_id()
+REGISTRY_POLL_INTERVAL = float(os.environ.get('REGISTRY_POLL_INTERVAL', 1))
+session_registry = create_registry(
+    os.environ.get('SESSION_REGISTRY_URL'),
+    ttl=float(os.environ.get('SESSION_REGISTRY_TTL', 30))
+)
+
+# Optional local speedtest-protocol server (local_server.py) to test against
+# instead of speedtest.net, e.g. in CI or on a LAN
+SPEEDTEST_SERVER_URL = os.environ.get('SPEEDTEST_SERVER_URL')
+
+def new_speedtest(**kwargs):
+    """Create a Speedtest client for speedtest.net or the configured local server"""
+    return create_speedtest(SPEEDTEST_SERVER_URL, secure=True, **kwargs)
+
+def fetch_server_list():
+    """Upstream server list fetch, timed for /metrics"""
+    try:
+        with timed(server_list_seconds):
+            return fetch_servers(new_speedtest)
+    except Exception:
+        server_list_failures.inc()
+        raise
+
+# Shared server list; the on-disk snapshot lets restarts skip the upstream fetch
+server_catalog = ServerCatalog(
+    # A local server's list is one fetch away and shouldn't replace the real snapshot
+    snapshot_path=None if SPEEDTEST_SERVER_URL else os.environ.get(
+        'SERVER_CATALOG_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server_catalog.json')
+    ),
+    ttl=int(os.environ.get('SERVER_CATALOG_TTL', 3600)),
+    fetch=fetch_server_list
+)
+
+# Every single and continuous-iteration result, for history queries
+result_store = ResultStore(os.environ.get(
+    'RESULTS_DB_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.db')
+))
+
+# Bulk ingestion of agent results (speed.py --agent); set INGEST_TOKEN to
+# require "Authorization: Bearer <token>" on uploads
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN')
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_BYTES', 32 * 1024 * 1024))
+INGEST_MAX_RESULTS = int(os.environ.get('INGEST_MAX_RESULTS', 10000))
+
+# Report rendering runs in worker processes with a content-hash keyed cache
+EXPORT_TIMEOUT = float(os.environ.get('EXPORT_TIMEOUT', 60))
+export_service = ExportService(
+    workers=int(os.environ.get('EXPORT_WORKERS', 2)),
+    max_cache_bytes=int(os.environ.get('EXPORT_CACHE_BYTES', 64 * 1024 * 1024)),
+    on_rendered=lambda export_format, seconds, failed: export_seconds.labels(
+        export_format, 'failed' if failed else 'ok').observe(seconds)
+)
+
+# Number of timed round trips in the ping phase
+PING_SAMPLES = int(os.environ.get('PING_SAMPLES', 10))
+
+# Best-server selection: how many of the closest servers to race, and for how long
+PROBE_CANDIDATES = int(os.environ.get('PROBE_CANDIDATES', 5))
+server_prober = ServerProber(
+    samples=int(os.environ.get('PROBE_SAMPLES', 3)),
+    deadline=float(os.environ.get('PROBE_DEADLINE', 0.5)),
+    estimator=os.environ.get('PROBE_ESTIMATOR', 'median')
+)
+
+# Warm Speedtest sessions (config, selected server, latency connection) reused
+# across tests, so continuous iterations skip setup
+session_pool = SessionPool(
+    ttl=int(os.environ.get('SESSION_POOL_TTL', 600)),
+    max_idle=int(os.environ.get('SESSION_POOL_SIZE', 2))
+)
+
+# Transfer measurement: speedtest-cli's ('speedtest') or the adaptive
+# multi-stream engine ('native'), which keeps up with multi-gigabit links
+THROUGHPUT_ENGINE = os.environ.get('THROUGHPUT_ENGINE', 'speedtest')
+NATIVE_ENGINE_OPTIONS = {
+    'duration': float(os.environ.get('NATIVE_TEST_DURATION', 10)),
+    'min_streams': int(os.environ.get('NATIVE_MIN_STREAMS', 2)),
+    'max_streams': int(os.environ.get('NATIVE_MAX_STREAMS', 16)),
+}
+
+# Transfer phases end once throughput is known to within CONVERGENCE_TOLERANCE
+# (0 disables that), subject to duration and byte caps
+convergence_policy = ConvergencePolicy(
+    tolerance=float(os.environ.get('CONVERGENCE_TOLERANCE', 0.05)),
+    min_duration=float(os.environ.get('CONVERGENCE_MIN_DURATION', 3)),
+    max_duration=float(os.environ.get('CONVERGENCE_MAX_DURATION', 15)),
+    max_bytes=int(os.environ.get('TRANSFER_MAX_BYTES', 0)) or None
+)
+
+# Monitoring runs: a latency probe every MONITOR_PROBE_INTERVAL seconds, full
+# tests every MONITOR_FULL_TEST_INTERVAL seconds (0: only when probes degrade),
+# and a per-run data budget in bytes (0: unlimited)
+MONITOR_PROBE_INTERVAL = float(os.environ.get('MONITOR_PROBE_INTERVAL', 1))
+if MONITOR_PROBE_INTERVAL <= 0:
+    raise ValueError(f'MONITOR_PROBE_INTERVAL must be positive, got {MONITOR_PROBE_INTERVAL}')
+MONITOR_FULL_TEST_INTERVAL = float(os.environ.get('MONITOR_FULL_TEST_INTERVAL', 900))
+MONITOR_FULL_TEST_MIN_GAP = float(os.environ.get('MONITOR_FULL_TEST_MIN_GAP', 120))
+MONITOR_DATA_BUDGET = int(os.environ.get('MONITOR_DATA_BUDGET', 500 * 1000 * 1000))
+# Below this much spare budget a full test isn't worth starting
+MONITOR_MIN_TEST_BYTES = int(os.environ.get('MONITOR_MIN_TEST_BYTES', 20 * 1000 * 1000))
+
+def measure_transfer(st, server_info, direction, on_sample, cancel_token, max_bytes=None,
+                     trace=NULL_TRACE):
+    """Measure one direction with the configured engine.
+
+    Returns (Mbps, engine details or None, convergence summary)
+    """
+    convergence = convergence_policy.tracker(max_bytes)
+    if THROUGHPUT_ENGINE == 'native':
+        engine = ThroughputEngine(server_info['url'], direction, on_sample=on_sample,
+                                  stop_event=cancel_token.event, convergence=convergence,
+                                  **NATIVE_ENGINE_OPTIONS)
+        try:
+            details = engine.run()
+        finally:
+            for stream in engine.streams:
+                trace.complete(f'{direction} stream {stream.index}', direction, stream.started,
+                               stream.ended or time.monotonic(), clock='monotonic',
+                               tid=stream.ident, thread_name=stream.name, bytes=stream.bytes,
+                               requests=stream.requests, errors=stream.errors)
+        # The per-interval series already went out as progress frames
+        details.pop('samples')
+        return details['mbps'], details, convergence.summary()
+    # Stream measured throughput while the transfer threads are running
+    sampler = TransferSampler(st, direction, on_sample, convergence=convergence)
+    try:
+        with sampler:
+            transfer = st.download if direction == 'download' else st.upload
+            mbps = transfer(callback=sampler.callback) / 1_000_000
+    finally:
+        if trace.enabled:
+            for worker, start, end, transferred in sampler.worker_spans():
+                trace.complete(f'{direction} request', direction, start, end,
+                               tid=worker.ident, thread_name=worker.name, bytes=transferred)
+    return mbps, None, convergence.summary()
+
+def emit_queue_position(session_id, position, eta):
+    """Tell a waiting client where it is in the test queue"""
+    session_events.emit('test_progress', {
+        'type': 'queued',
+        'position': position,
+        'eta': eta,
+        'message': f'Waiting for a free test slot (position {position}, ~{round(eta)}s)...',
+        'session_id': session_id
+    })
+
+# Admission control so concurrent tests don't share (and skew) the uplink
+test_scheduler = TestScheduler(
+    max_concurrent=int(os.environ.get('MAX_CONCURRENT_TESTS', 2)),
+    max_per_server=int(os.environ.get('MAX_TESTS_PER_SERVER', 1)),
+    max_queue=int(os.environ.get('MAX_QUEUED_TESTS', 20)),
+    on_queued=emit_queue_position
+)
+
+class StateCollector:
+    """Reads gauges and counters kept by other components when /metrics is scraped"""
+
+    def collect(self):
+        yield GaugeMetricFamily('speedtest_active_tests',
+                                'Sessions with a queued or running test in this worker', value=len(active_tests))
+        try:
+            yield GaugeMetricFamily('speedtest_registry_tests',
+                                    'Sessions with a queued or running test in any worker',
+                                    value=session_registry.count())
+        except Exception as e:
+            # An unreachable shared registry shouldn't fail the whole scrape
+            print(f"Session registry unavailable: {e}")
+        scheduled = GaugeMetricFamily('speedtest_scheduler_tests', 'Tests holding or waiting for a slot',
+                                      labels=['state'])
+        for state, count in test_scheduler.stats().items():
+            scheduled.add_metric([state], count)
+        yield scheduled
+        events = session_events.stats()
+        yield GaugeMetricFamily('speedtest_event_sessions', 'Sessions with coalescing state',
+                                value=events['sessions'])
+        yield CounterMetricFamily('speedtest_socketio_events_coalesced',
+                                  'Progress frames replaced by a newer one before being sent',
+                                  value=events['coalesced'])
+        pool = session_pool.stats()
+        yield GaugeMetricFamily('speedtest_session_pool_idle', 'Warm Speedtest sessions ready for reuse',
+                                value=pool['idle'])
+        lookups = CounterMetricFamily('speedtest_session_pool_lookups', 'Warm session lookups by result',
+                                      labels=['result'])
+        for result, count in pool.items():
+            if result != 'idle':
+                lookups.add_metric([result], count)
+        yield lookups
+        exports = export_service.stats()
+        cache = CounterMetricFamily('speedtest_export_cache_lookups', 'Report cache lookups by result',
+                                    labels=['result'])
+        cache.add_metric(['hit'], exports['hits'])
+        cache.add_metric(['miss'], exports['misses'])
+        yield cache
+
+metrics.register(StateCollector())
+
+def stability_spill_path(session_id):
+    """Where to append a continuous run's raw results, if spilling is enabled"""
+    spill_dir = os.environ.get('STABILITY_SPILL_DIR')
+    if not spill_dir:
+        return None
+    os.makedirs(spill_dir, exist_ok=True)
+    safe_id = re.sub(r'[^A-Za-z0-9_.-]', '_', session_id)
+    return os.path.join(spill_dir, f'{safe_id}.jsonl')
+
+def select_server(st, preferred_server_id, session_id):
+    """Pick the preferred or best server for ``st`` and return its details"""
+    # Emit server selection status
+    session_events.emit('test_progress', {
+        'type': 'status',
+        'message': 'Selecting best server...',
+        'session_id': session_id
+    })
+    
+    # Get server list and select the best one or preferred one
+    if preferred_server_id:
+        # Use specific server if provided
+        server = server_catalog.get(preferred_server_id)
+        if server is None:
+            # Not in the catalog snapshot; ask upstream for it directly
+            servers = st.get_servers([preferred_server_id])
+            server = next(s for d in servers for s in servers[d])
+        st.get_best_server([server])
+        server_info = st.results.server
+    else:
+        # Get best server automatically - prioritize closest servers
+        candidates = server_catalog.closest(PROBE_CANDIDATES)
+        
+        # Probe the closest servers concurrently and pick the lowest RTT
+        trace = tracer.active(session_id)
+
+        def trace_probe(server, start, rtt):
+            trace.complete(f"probe {server.get('id')}", 'server_selection', start,
+                           time.perf_counter(), host=server.get('host'), rtt=rtt)
+
+        ranked = server_prober.rank(candidates, on_probe=trace_probe if trace.enabled else None)
+        best_server = ranked[0] if ranked else None
+        
+        if best_server:
+            st.get_best_server([best_server])
+            server_info = best_server
+        else:
+            # Fallback to original method
+            server_info = st.get_best_server()
+    return server_info
+
+def run_single_speed_test(session_id, preferred_server_id=None, cancel_token=None, test_type='single',
+                          max_transfer_bytes=None):
     """Runs a single speed test and yields real-time results."""
+    cancel_token = cancel_token or CancelToken()
+    # Whatever has been measured so far, so a stopped test can still report it
+    server_info = {}
+    latency = {}
+    avg_ping = jitter = download_result = upload_result = 0
+    completed_phases = []
+    transfer_details = {}
+    convergence = {}
+    session = None
+    unregister_stop = None
+    trace = tracer.begin(session_id, test_type)
+
+    def build_result(**extra):
+        result = {
+            'type': 'final',
+            'ping': round(avg_ping, 2),
+            'jitter': round(jitter, 2),
+            'latency': latency,
+            'download': round(download_result, 2),
+            'upload': round(upload_result, 2),
+            'server': server_info,
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'session_id': session_id
+        }
+        if any(transfer_details.values()):
+            # Per-stream and aggregate byte counters from the native engine
+            result['transfer'] = transfer_details
+        if convergence:
+            # Why each transfer phase stopped and how tight its estimate was
+            result['convergence'] = convergence
+        result.update(extra)
+        return result
+
     try:
-        st = speedtest.Speedtest(secure=True)
+        cancel_token.check()
+        # The token's event doubles as speedtest-cli's shutdown event
+        pool_key = str(preferred_server_id or 'auto')
+        session = session_pool.acquire(pool_key, cancel_token.event)
+        if session is not None:
+            st = session.st
+        else:
+            # The constructor fetches the client configuration
+            with timed(phase_seconds.labels('config')), trace.span('config'):
+                st = new_speedtest(shutdown_event=cancel_token.event)
+
+        def stop_own_transfers():
+            # A released warm session may already be rebound to another test
+            if st._shutdown_event is cancel_token.event:
+                stop_transfers(st)
+
+        unregister_stop = cancel_token.on_cancel(stop_own_transfers)
         
-        # Get client configuration first
-        config = st.get_config()
+        config = st.config
         client_info = {
             'ip': config['client']['ip'],
             'isp': config['client']['isp'],
@@ -38,70 +414,23 @@ def run_single_speed_test(session_id, preferred_server_id=None):
         }
         
         # Emit client information
-        socketio.emit('test_progress', {
+        session_events.emit('test_progress', {
             'type': 'client_info',
             'client': client_info,
             'session_id': session_id
         })
         
-        # Emit server selection status
-        socketio.emit('test_progress', {
-            'type': 'status',
-            'message': 'Selecting best server...',
-            'session_id': session_id
-        })
-        
-        # Get server list and select the best one or preferred one
-        if preferred_server_id:
-            # Use specific server if provided
-            servers = st.get_servers([preferred_server_id])
-            st.get_best_server(servers[preferred_server_id])
-            server_info = st.results.server
+        if session is not None:
+            # Still warm from a previous test against the same server
+            server_info = session.server
         else:
-            # Get best server automatically - prioritize closest servers
-            servers = st.get_servers()
-            all_servers = []
-            for distance_key in servers:
-                for server in servers[distance_key]:
-                    all_servers.append(server)
-            
-            # Sort by distance first, then by latency
-            all_servers.sort(key=lambda x: x['d'])
-            closest_servers = all_servers[:3]  # Get 3 closest servers
-            
-            # Test latency on closest servers and pick the best
-            best_latency = float('inf')
-            best_server = None
-            
-            for server in closest_servers:
-                try:
-                    # Quick latency test
-                    import socket
-                    import time
-                    host = server['host'].split(':')[0]
-                    port = int(server['host'].split(':')[1]) if ':' in server['host'] else 8080
-                    
-                    start_time = time.time()
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    sock.settimeout(2)
-                    result = sock.connect_ex((host, port))
-                    sock.close()
-                    latency = (time.time() - start_time) * 1000
-                    
-                    if result == 0 and latency < best_latency:
-                        best_latency = latency
-                        best_server = server
-                except:
-                    continue
-            
-            if best_server:
-                st.get_best_server([best_server])
-                server_info = best_server
-            else:
-                # Fallback to original method
-                server_info = st.get_best_server()
+            with timed(phase_seconds.labels('server_selection')), trace.span('server_selection'):
+                server_info = select_server(st, preferred_server_id, session_id)
+            session = WarmSession(pool_key, st, server_info)
         
-        socketio.emit('test_progress', {
+        cancel_token.check()
+        completed_phases.append('server_selection')
+        session_events.emit('test_progress', {
             'type': 'server_selected',
             'server': {
                 'id': server_info.get('id', 'Unknown'),
@@ -115,520 +444,750 @@ def run_single_speed_test(session_id, preferred_server_id=None):
         })
 
         # Ping test with multiple samples for jitter calculation
-        socketio.emit('test_progress', {
+        session_events.emit('test_progress', {
             'type': 'status',
             'message': 'Testing ping...',
             'session_id': session_id
         })
         
-        ping_results = []
-        for i in range(5):  # 5 ping samples for jitter calculation
-            ping = st.results.ping
-            ping_results.append(ping)
-            socketio.emit('test_progress', {
+        server = server_label(server_info.get('id'))
+
+        def emit_ping_sample(sample, rtt):
+            if rtt is None:
+                return
+            rtt_ms.labels(server).observe(rtt)
+            session_events.emit('test_progress', {
                 'type': 'ping_sample',
-                'ping': round(ping, 2),
-                'sample': i + 1,
+                'ping': round(rtt, 2),
+                'sample': sample,
                 'session_id': session_id
             })
-            time.sleep(0.1)
 
-        avg_ping = mean(ping_results)
-        jitter = calculate_jitter(ping_results)
+        # Timed latency.txt round trips over the session's kept-alive connection
+        with timed(phase_seconds.labels('ping')), trace.span('ping'):
+            samples = session.sampler.sample(
+                PING_SAMPLES, on_sample=emit_ping_sample, stop_event=cancel_token.event
+            )
+        for sample, (timestamp, rtt) in enumerate(samples, 1):
+            # A lost sample's span runs to the sampler's timeout
+            duration = rtt / 1000 if rtt is not None else session.sampler.timeout
+            trace.complete('ping sample', 'ping', timestamp, timestamp + duration, clock='wall',
+                           sample=sample, rtt=rtt)
+        latency = latency_stats(samples)
+        if 'mean' in latency:
+            avg_ping = latency['mean']
+            jitter = latency['jitter']
+        else:
+            # Every sample was lost; fall back to the server selection ping
+            avg_ping = st.results.ping
+            jitter = 0
+        cancel_token.check()
+        completed_phases.append('ping')
 
         # Download test with real-time updates
-        socketio.emit('test_progress', {
+        session_events.emit('test_progress', {
             'type': 'status',
             'message': 'Testing download speed...',
             'session_id': session_id
         })
         
-        # Run download test and simulate frequent updates
-        download_result = st.download() / 1_000_000
-        
-        # Send multiple data points during download phase for animated chart
-        for i in range(1, 21):  # 20 data points
-            progress = i / 20.0
-            speed_variation = download_result * (0.8 + 0.4 * progress)  # Simulate speed ramping up
-            socketio.emit('test_progress', {
+        def emit_download_sample(mbps, elapsed):
+            session_events.emit('test_progress', {
                 'type': 'download_progress',
-                'download': round(speed_variation, 2),
+                'download': round(mbps, 2),
+                'elapsed': round(elapsed, 2),
                 'session_id': session_id
             })
-            time.sleep(0.1)  # 100ms intervals for smooth animation
+
+        with timed(phase_seconds.labels('download')), trace.span('download'):
+            download_result, transfer_details['download'], convergence['download'] = measure_transfer(
+                st, server_info, 'download', emit_download_sample, cancel_token, max_transfer_bytes, trace
+            )
+        cancel_token.check()
+        throughput_mbps.labels('download', server).observe(download_result)
+        completed_phases.append('download')
         
         # Send final download result
-        socketio.emit('test_progress', {
+        session_events.emit('test_progress', {
             'type': 'download_complete',
             'download': round(download_result, 2),
             'session_id': session_id
         })
 
         # Upload test with real-time updates
-        socketio.emit('test_progress', {
+        session_events.emit('test_progress', {
             'type': 'status',
             'message': 'Testing upload speed...',
             'session_id': session_id
         })
         
-        upload_result = st.upload() / 1_000_000
-        
-        # Send multiple data points during upload phase for animated chart
-        for i in range(1, 21):  # 20 data points
-            progress = i / 20.0
-            speed_variation = upload_result * (0.7 + 0.5 * progress)  # Simulate speed ramping up
-            socketio.emit('test_progress', {
+        def emit_upload_sample(mbps, elapsed):
+            session_events.emit('test_progress', {
                 'type': 'upload_progress',
-                'upload': round(speed_variation, 2),
+                'upload': round(mbps, 2),
+                'elapsed': round(elapsed, 2),
                 'session_id': session_id
             })
-            time.sleep(0.1)  # 100ms intervals for smooth animation
+
+        with timed(phase_seconds.labels('upload')), trace.span('upload'):
+            upload_result, transfer_details['upload'], convergence['upload'] = measure_transfer(
+                st, server_info, 'upload', emit_upload_sample, cancel_token, max_transfer_bytes, trace
+            )
+        cancel_token.check()
+        throughput_mbps.labels('upload', server).observe(upload_result)
+        completed_phases.append('upload')
         
         # Send final upload result
-        socketio.emit('test_progress', {
+        session_events.emit('test_progress', {
             'type': 'upload_complete',
             'upload': round(upload_result, 2),
             'session_id': session_id
         })
 
         # Final results
-        final_result = {
-            'type': 'final',
-            'ping': round(avg_ping, 2),
-            'jitter': round(jitter, 2),
-            'download': round(download_result, 2),
-            'upload': round(upload_result, 2),
-            'server': server_info,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'session_id': session_id
-        }
+        final_result = build_result()
+        result_store.record(final_result, test_type)
         
-        socketio.emit('test_result', final_result)
+        session_events.emit('test_result', final_result)
+        # Before another test can lease the session
+        unregister_stop()
+        session_pool.release(session)
+        tests_finished.labels(test_type, 'completed').inc()
         return final_result
 
     except Exception as e:
+        if session is not None:
+            # Don't reuse a session that failed or whose transfers were aborted
+            session_pool.discard(session)
+        if isinstance(e, TestCancelled) or cancel_token.cancelled:
+            # Aborting a transfer can also surface as an I/O error. Report
+            # what finished before the stop; unfinished phases read as 0
+            partial_result = build_result(
+                partial=True,
+                cancel_reason=cancel_token.reason,
+                completed_phases=completed_phases
+            )
+            result_store.record(partial_result, test_type)
+            session_events.emit('test_result', partial_result)
+            tests_finished.labels(test_type, 'partial').inc()
+            return partial_result
         error_result = {
             'type': 'error',
             'message': str(e),
             'session_id': session_id
         }
-        socketio.emit('test_result', error_result)
+        session_events.emit('test_result', error_result)
+        tests_finished.labels(test_type, 'error').inc()
         return error_result
+    finally:
+        if unregister_stop is not None:
+            unregister_stop()
+        tracer.end(trace)
+
+def run_slotted_test(session_id, server_id, cancel_token, test_type, max_transfer_bytes=None):
+    """One test of a continuous or monitoring run, holding a scheduler slot only while it runs
 
-def run_continuous_speed_test(session_id, duration_minutes, preferred_server_id=None):
+    Returns None if the run was cancelled while waiting for the slot or the queue was full.
+    """
+    try:
+        with test_scheduler.slot(session_id, server_id, cancel_event=cancel_token.event) as granted:
+            if not granted:
+                return None
+            return run_single_speed_test(session_id, server_id, cancel_token, test_type,
+                                         max_transfer_bytes)
+    except QueueFull:
+        session_events.emit('test_progress', {
+            'type': 'status',
+            'message': 'Server is busy, skipping this test...',
+            'session_id': session_id
+        })
+        return None
+
+def run_continuous_speed_test(session_id, duration_minutes, preferred_server_id=None, cancel_token=None):
     """Run continuous speed test for stability analysis"""
+    cancel_token = cancel_token or CancelToken()
+    stats = None
+    trace = tracer.begin(session_id, 'continuous')
     try:
         duration_seconds = duration_minutes * 60
         start_time = time.time()
-        test_results = []
         test_count = 0
+        # O(1) per result, so multi-hour runs don't grow without bound
+        stats = StabilityAccumulator(spill_path=stability_spill_path(session_id))
         
-        socketio.emit('continuous_test_started', {
+        session_events.emit('continuous_test_started', {
             'session_id': session_id,
             'duration_minutes': duration_minutes,
             'message': f'Starting {duration_minutes}-minute stability test...'
         })
         
-        while time.time() - start_time < duration_seconds:
+        while time.time() - start_time < duration_seconds and not cancel_token.cancelled:
             test_count += 1
-            socketio.emit('test_progress', {
+            session_events.emit('test_progress', {
                 'type': 'status',
                 'message': f'Running test #{test_count}...',
                 'session_id': session_id,
                 'test_number': test_count
             })
             
-            result = run_single_speed_test(session_id, preferred_server_id)
-            if result['type'] != 'error':
-                test_results.append(result)
-                
-                # Calculate running statistics
-                pings = [r['ping'] for r in test_results]
-                downloads = [r['download'] for r in test_results]
-                uploads = [r['upload'] for r in test_results]
+            result = run_slotted_test(session_id, preferred_server_id, cancel_token, 'continuous')
+            if result is not None and result['type'] != 'error' and not result.get('partial'):
+                stats.add(result)
+                ping_stats = stats.summary('ping')
+                download_stats = stats.summary('download')
+                upload_stats = stats.summary('upload')
                 
                 running_stats = {
                     'type': 'running_stats',
-                    'test_count': len(test_results),
-                    'avg_ping': round(mean(pings), 2),
-                    'avg_download': round(mean(downloads), 2),
-                    'avg_upload': round(mean(uploads), 2),
-                    'min_download': round(min(downloads), 2),
-                    'max_download': round(max(downloads), 2),
-                    'min_upload': round(min(uploads), 2),
-                    'max_upload': round(max(uploads), 2),
+                    'test_count': stats.count,
+                    'avg_ping': ping_stats['avg'],
+                    'avg_download': download_stats['avg'],
+                    'avg_upload': upload_stats['avg'],
+                    'min_download': download_stats['min'],
+                    'max_download': download_stats['max'],
+                    'min_upload': upload_stats['min'],
+                    'max_upload': upload_stats['max'],
+                    'ping_stats': ping_stats,
+                    'download_stats': download_stats,
+                    'upload_stats': upload_stats,
                     'session_id': session_id,
                     'progress': round(((time.time() - start_time) / duration_seconds) * 100, 1)
                 }
                 
-                socketio.emit('running_stats', running_stats)
+                session_events.emit('running_stats', running_stats)
             
             # Wait a bit before next test (adjust as needed)
-            time.sleep(10)
+            with trace.span('pause'):
+                if cancel_token.sleep(10):
+                    break
         
         # Final stability analysis
-        if test_results:
-            pings = [r['ping'] for r in test_results]
-            downloads = [r['download'] for r in test_results]
-            uploads = [r['upload'] for r in test_results]
-            
-            # Calculate stability score based on variance
-            download_variance = stdev(downloads) if len(downloads) > 1 else 0
-            upload_variance = stdev(uploads) if len(uploads) > 1 else 0
-            ping_variance = stdev(pings) if len(pings) > 1 else 0
-            
-            # Stability score: lower variance = higher stability
-            stability_score = max(0, 100 - (download_variance + upload_variance + ping_variance))
+        if stats.count:
+            ping_stats = stats.summary('ping')
+            download_stats = stats.summary('download')
+            upload_stats = stats.summary('upload')
             
             stability_analysis = {
                 'type': 'continuous',
                 'test_type': 'continuous',
                 'session_id': session_id,
-                'test_count': len(test_results),
+                'test_count': stats.count,
                 'duration': duration_minutes,
-                'avg_ping': round(mean(pings), 2),
-                'min_ping': round(min(pings), 2),
-                'max_ping': round(max(pings), 2),
-                'avg_download': round(mean(downloads), 2),
-                'min_download': round(min(downloads), 2),
-                'max_download': round(max(downloads), 2),
-                'avg_upload': round(mean(uploads), 2),
-                'min_upload': round(min(uploads), 2),
-                'max_upload': round(max(uploads), 2),
-                'stability_score': round(stability_score, 1),
-                'ping_variance': round(ping_variance, 2),
-                'download_variance': round(download_variance, 2),
-                'upload_variance': round(upload_variance, 2),
-                'test_results': test_results
+                'avg_ping': ping_stats['avg'],
+                'min_ping': ping_stats['min'],
+                'max_ping': ping_stats['max'],
+                'avg_download': download_stats['avg'],
+                'min_download': download_stats['min'],
+                'max_download': download_stats['max'],
+                'avg_upload': upload_stats['avg'],
+                'min_upload': upload_stats['min'],
+                'max_upload': upload_stats['max'],
+                'stability_score': round(stats.stability_score(), 1),
+                'ping_variance': ping_stats['std'],
+                'download_variance': download_stats['std'],
+                'upload_variance': upload_stats['std'],
+                'ping_stats': ping_stats,
+                'download_stats': download_stats,
+                'upload_stats': upload_stats,
+                'partial': cancel_token.cancelled,
+                # Only the most recent results; the full series is in the spill file
+                'test_results': list(stats.recent),
+                'test_results_truncated': stats.count > len(stats.recent)
             }
             
-            socketio.emit('test_result', stability_analysis)
+            # Compact clients page through the stored results instead of test_results
+            result_store.flush(timeout=5)
+            session_events.emit('test_result', stability_analysis)
         
-        # Clean up
-        if session_id in active_tests:
-            del active_tests[session_id]
-            
     except Exception as e:
-        socketio.emit('test_result', {
+        session_events.emit('test_result', {
+            'type': 'error',
+            'message': str(e),
+            'session_id': session_id
+        })
+    finally:
+        if stats is not None:
+            stats.close()
+        tracer.end(trace)
+
+def probe_server(preferred_server_id=None):
+    """Server a monitoring run probes: the preferred one or the lowest-RTT nearby one"""
+    if preferred_server_id:
+        server = server_catalog.get(preferred_server_id)
+        if server is None:
+            raise ValueError(f'Unknown server: {preferred_server_id}')
+        return server
+    ranked = server_prober.rank(server_catalog.closest(PROBE_CANDIDATES))
+    if not ranked:
+        raise RuntimeError('No reachable test server to monitor')
+    return ranked[0]
+
+def full_test_bytes(result):
+    """Data a full test used: its transfers plus the ping phase"""
+    transferred = sum(phase.get('bytes', 0) for phase in result.get('convergence', {}).values())
+    return transferred + (PING_SAMPLES + 1) * PROBE_BYTES
+
+def run_monitoring_test(session_id, duration_minutes, preferred_server_id=None, data_budget=None,
+                        cancel_token=None):
+    """Monitor a connection with latency probes and occasional full tests, within a data budget"""
+    cancel_token = cancel_token or CancelToken()
+    sampler = None
+    stats = None
+    try:
+        duration_seconds = duration_minutes * 60
+        budget = DataBudget((int(data_budget) if data_budget is not None else MONITOR_DATA_BUDGET) or None)
+        outages = OutageTracker()
+        degradation = DegradationDetector()
+        schedule = FullTestSchedule(MONITOR_FULL_TEST_INTERVAL, MONITOR_FULL_TEST_MIN_GAP)
+        probe_rtts = MetricAccumulator()
+        probe_count = lost_probes = 0
+        full_tests = []  # (time, trigger, Mbps down, Mbps up, bytes)
+        stats = StabilityAccumulator(spill_path=stability_spill_path(session_id))
+
+        server_info = probe_server(preferred_server_id)
+        server = server_label(server_info.get('id'))
+        sampler = LatencySampler(latency_url(server_info['url']), keep_alive=True)
+        cancel_token.on_cancel(sampler.close)
+
+        session_events.emit('continuous_test_started', {
+            'session_id': session_id,
+            'duration_minutes': duration_minutes,
+            'mode': 'monitor',
+            'data_budget': budget.limit,
+            'message': f'Starting {duration_minutes}-minute connection monitoring...'
+        })
+
+        start_time = time.time()
+        deadline = start_time + duration_seconds
+        stop_reason = 'completed'
+        next_probe = start_time
+        while not cancel_token.cancelled:
+            now = time.time()
+            if now >= deadline:
+                break
+            if not budget.allows(PROBE_BYTES):
+                stop_reason = 'budget_exhausted'
+                break
+
+            rtt = sampler.probe()
+            budget.charge(PROBE_BYTES)
+            probe_count += 1
+            degraded = False
+            if rtt is None:
+                lost_probes += 1
+            else:
+                probe_rtts.add(rtt)
+                rtt_ms.labels(server).observe(rtt)
+                degraded = degradation.add(rtt)
+            outage_event = outages.add(now, rtt is not None)
+
+            session_events.emit('test_progress', {
+                'type': 'probe',
+                'ping': round(rtt, 2) if rtt is not None else None,
+                'reachable': rtt is not None,
+                'degraded': degraded,
+                'budget_spent': budget.spent,
+                'progress': round((now - start_time) / duration_seconds * 100, 1),
+                'session_id': session_id
+            })
+            if outage_event:
+                session_events.emit('test_progress', {
+                    'type': 'outage',
+                    'event': outage_event,
+                    'outage': outages.current or outages.outages[-1],
+                    'session_id': session_id
+                })
+
+            trigger = schedule.due(now, degraded, outage_event == 'outage_ended')
+            if trigger and rtt is not None:
+                # Keep enough budget for the probes still to come
+                probe_reserve = (deadline - now) / MONITOR_PROBE_INTERVAL * PROBE_BYTES
+                available = budget.available(probe_reserve)
+                if available is None or available >= MONITOR_MIN_TEST_BYTES:
+                    schedule.ran(now)
+                    session_events.emit('test_progress', {
+                        'type': 'status',
+                        'message': f'Running full test ({trigger})...',
+                        'trigger': trigger,
+                        'session_id': session_id
+                    })
+                    result = run_slotted_test(
+                        session_id, server_info['id'], cancel_token, 'monitor',
+                        max_transfer_bytes=transfer_cap(available)
+                    )
+                    used = full_test_bytes(result) if result is not None else 0
+                    budget.charge(used)
+                    if result is not None and result['type'] != 'error' and not result.get('partial'):
+                        stats.add(result)
+                        full_tests.append((now, trigger, result['download'], result['upload'], used))
+
+            # After a slow probe or a full test, carry on now rather than catching up
+            next_probe = max(next_probe + MONITOR_PROBE_INTERVAL, time.time())
+            if cancel_token.sleep(max(0.0, next_probe - time.time())):
+                break
+
+        end_time = time.time()
+        ping_stats = probe_rtts.summary()
+        download_stats = stats.summary('download')
+        upload_stats = stats.summary('upload')
+        result_store.flush(timeout=5)  # Backs full_tests for compact clients
+        session_events.emit('test_result', {
+            'type': 'monitor',
+            'test_type': 'monitor',
+            'session_id': session_id,
+            'duration': duration_minutes,
+            'elapsed_seconds': round(end_time - start_time, 1),
+            'server': server_info,
+            'probe_count': probe_count,
+            'lost_probes': lost_probes,
+            'loss_percent': round(lost_probes / probe_count * 100, 2) if probe_count else 0.0,
+            'avg_ping': ping_stats.get('avg', 0),
+            'min_ping': ping_stats.get('min', 0),
+            'max_ping': ping_stats.get('max', 0),
+            'ping_stats': ping_stats,
+            'outages': outages.summary(end_time),
+            'test_count': stats.count,
+            'avg_download': download_stats.get('avg', 0),
+            'avg_upload': upload_stats.get('avg', 0),
+            'download_stats': download_stats,
+            'upload_stats': upload_stats,
+            'stability_score': round(stats.stability_score(), 1) if stats.count else None,
+            'full_tests': [
+                {'time': ts, 'trigger': trigger, 'download': down, 'upload': up, 'bytes': used}
+                for ts, trigger, down, up, used in full_tests
+            ],
+            'data_budget': budget.summary(),
+            'stop_reason': cancel_token.reason if cancel_token.cancelled else stop_reason,
+            'partial': cancel_token.cancelled
+        })
+
+    except Exception as e:
+        session_events.emit('test_result', {
             'type': 'error',
             'message': str(e),
             'session_id': session_id
         })
+    finally:
+        if sampler is not None:
+            sampler.close()
+        if stats is not None:
+            stats.close()
+
+def run_tracked_test(session_id, cancel_token, target, *args):
+    """Run a scheduled test and drop it from active_tests and the registry when it ends"""
+    try:
+        target(*args, cancel_token=cancel_token)
+    finally:
+        session_registry.release(session_id, cancel_token.test_id)
+        if active_tests.get(session_id) is cancel_token:
+            del active_tests[session_id]
+            session_events.close(session_id)
+
+def cancel_local_test(session_id, reason='stopped', test_id=None):
+    """Stop a test queued or running in this worker (only ``test_id``, if given)"""
+    if test_id is not None and getattr(active_tests.get(session_id), 'test_id', None) != test_id:
+        return False  # Already over, or replaced by a newer test
+    dequeued = test_scheduler.cancel(session_id)
+    cancel_token = active_tests.pop(session_id, None) if dequeued else active_tests.get(session_id)
+    if cancel_token is None:
+        return dequeued
+    if dequeued:
+        # It never started, so run_tracked_test won't release it
+        session_registry.release(session_id, cancel_token.test_id)
+        session_events.close(session_id)
+    cancel_token.cancel(reason)
+    return True
+
+def cancel_test(session_id, reason='stopped'):
+    """Stop a queued or running test in any worker; returns True if there was one"""
+    if cancel_local_test(session_id, reason):
+        return True
+    # The owning worker picks the request up within REGISTRY_POLL_INTERVAL
+    return session_registry.request_cancel(session_id, reason)
+
+def watch_registry():
+    """Keep this worker's registry entries alive and apply other workers' cancel requests"""
+    last_heartbeat = 0
+    while True:
+        try:
+            if time.monotonic() - last_heartbeat >= session_registry.ttl / 3:
+                session_registry.heartbeat(WORKER_ID)
+                last_heartbeat = time.monotonic()
+            # The worker that took the stop_test has already told the client
+            for session_id, test_id, reason in session_registry.poll_cancels(WORKER_ID):
+                cancel_local_test(session_id, reason, test_id)
+        except Exception as e:
+            print(f"Session registry unavailable: {e}")
+        time.sleep(REGISTRY_POLL_INTERVAL)
+
+threading.Thread(target=watch_registry, name='session-registry', daemon=True).start()
 
 @socketio.on('start_test')
 def handle_start_test(data):
     """Handles the start test event from the client."""
     session_id = data.get('session_id', 'default')
-    test_type = data.get('test_type', 'single')  # 'single' or 'continuous'
-    duration = data.get('duration', 5)  # Duration in minutes for continuous test
+    test_type = data.get('test_type', 'single')  # 'single', 'continuous' or 'monitor'
+    duration = data.get('duration', 5)  # Duration in minutes for continuous and monitor tests
     preferred_server_id = data.get('server_id', None)  # Optional server selection
     
     print(f"Client requested a {test_type} speed test. Session: {session_id}")
     
-    if test_type == 'continuous':
-        # Run continuous test in a separate thread
-        thread = threading.Thread(
-            target=run_continuous_speed_test,
-            args=(session_id, duration, preferred_server_id)
-        )
-        active_tests[session_id] = thread
-        thread.start()
-    else:
-        # Run single test
-        run_single_speed_test(session_id, preferred_server_id)
+    # A session runs one test at a time; a new start replaces the old one
+    cancel_test(session_id, reason='replaced')
+    cancel_token = CancelToken(test_id=uuid.uuid4().hex)
+    active_tests[session_id] = cancel_token
+    session_registry.claim(session_id, cancel_token.test_id, WORKER_ID, test_type)
+    # 'compact': binary delta-encoded sample frames, large result lists by reference
+    session_events.set_codec(session_id, CompactCodec(
+        f"/api/sessions/{quote(session_id, safe='')}/results?since={round(time.time(), 3)}"
+    ) if data.get('encoding') == 'compact' else None)
+    client_sessions.setdefault(request.sid, set()).add(session_id)
+    join_room(session_room(session_id))
+    if data.get('trace'):
+        tracer.request(session_id)
+    try:
+        # Long runs take a scheduler slot per test rather than for their whole duration
+        if test_type == 'continuous':
+            threading.Thread(target=run_tracked_test, daemon=True, args=(
+                session_id, cancel_token, run_continuous_speed_test,
+                session_id, duration, preferred_server_id
+            )).start()
+        elif test_type == 'monitor':
+            threading.Thread(target=run_tracked_test, daemon=True, args=(
+                session_id, cancel_token, run_monitoring_test,
+                session_id, duration, preferred_server_id, data.get('data_budget')
+            )).start()
+        else:
+            test_scheduler.submit(
+                session_id, run_tracked_test,
+                args=(session_id, cancel_token, run_single_speed_test,
+                      session_id, preferred_server_id),
+                server_id=preferred_server_id
+            )
+    except QueueFull as e:
+        active_tests.pop(session_id, None)
+        session_registry.release(session_id, cancel_token.test_id)
+        session_events.emit('test_result', {
+            'type': 'error',
+            'message': f'Server is busy, please try again shortly. {e}',
+            'session_id': session_id
+        })
+        session_events.close(session_id)
 
 @socketio.on('stop_test')
 def handle_stop_test(data):
     """Stop an ongoing test"""
     session_id = data.get('session_id', 'default')
-    if session_id in active_tests:
-        # Note: This is a simple implementation. In production, you'd want proper thread management
-        del active_tests[session_id]
-        socketio.emit('test_stopped', {'session_id': session_id})
+    if cancel_test(session_id):
+        session_events.emit('test_stopped', {'session_id': session_id})
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    """Cancel everything a client started once its socket goes away"""
+    for session_id in client_sessions.pop(request.sid, set()):
+        cancel_test(session_id, reason='disconnected')
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for test phases, exports, queues and Socket.IO traffic"""
+    return Response(generate_latest(metrics), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/api/traces', methods=['GET'])
+def list_traces():
+    """Summaries of the kept per-test traces, most recent first"""
+    return jsonify({'success': True, 'traces': tracer.traces()})
+
+@app.route('/api/traces/<session_id>', methods=['GET'])
+def get_trace(session_id):
+    """A session's latest trace in Chrome trace-event format (chrome://tracing, Perfetto)"""
+    trace = tracer.get(session_id)
+    if trace is None:
+        return jsonify({'success': False, 'error': 'No trace for this session'}), 404
+    return jsonify(trace.to_chrome())
+
+# Largest page of servers one query may return
+SERVER_QUERY_MAX_LIMIT = int(os.environ.get('SERVER_QUERY_MAX_LIMIT', 100))
+
+def query_servers(params):
+    """A page of servers for query parameters (lat, lon, cc, sponsor, limit, cursor)"""
+    def number(name, low, high):
+        value = params.get(name)
+        if value in (None, ''):
+            return None
+        value = float(value)
+        if not low <= value <= high:
+            raise ValueError(f'{name} must be between {low} and {high}')
+        return value
+
+    lat, lon = number('lat', -90, 90), number('lon', -180, 180)
+    if (lat is None) != (lon is None):
+        raise ValueError('lat and lon must be given together')
+    limit = int(number('limit', 1, SERVER_QUERY_MAX_LIMIT) or 20)
+    servers, next_cursor = server_catalog.query(
+        lat, lon, params.get('cc') or None, params.get('sponsor') or None, limit,
+        params.get('cursor') or None
+    )
+    return {'servers': servers, 'next_cursor': next_cursor}
 
 @app.route('/api/servers', methods=['GET'])
 def get_available_servers():
-    """Get list of available test servers"""
+    """Servers closest to the client (or to lat/lon), optionally filtered by cc and sponsor"""
     try:
-        st = speedtest.Speedtest(secure=True)
-        servers = st.get_servers()
-        
-        # Format server list for frontend
-        server_list = []
-        for server_id, server_data in servers.items():
-            for server in server_data:
-                server_list.append({
-                    'id': server.get('id'),
-                    'name': server.get('sponsor', 'Unknown'),
-                    'location': f"{server.get('name', 'Unknown')}, {server.get('country', 'Unknown')}",
-                    'distance': round(server.get('d', 0), 2),
-                    'country': server.get('country', 'Unknown'),
-                    'cc': server.get('cc', 'XX'),
-                    'url': server.get('url', '')
-                })
-        
-        # Sort by distance
-        server_list.sort(key=lambda x: x['distance'])
-        
-        return jsonify({
-            'success': True,
-            'servers': server_list[:20]  # Return top 20 closest servers
-        })
+        return jsonify(dict(query_servers(request.args), success=True))
         
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @socketio.on('get_servers')
-def handle_get_servers():
-    """WebSocket handler to get available servers"""
+def handle_get_servers(data=None):
+    """WebSocket handler to get available servers, taking the same filters as /api/servers"""
     try:
-        st = speedtest.Speedtest(secure=True)
-        servers = st.get_servers()
-        
-        # Format server list for frontend
-        server_list = []
-        for server_id, server_data in servers.items():
-            for server in server_data:
-                server_list.append({
-                    'id': server.get('id'),
-                    'name': server.get('sponsor', 'Unknown'),
-                    'location': f"{server.get('name', 'Unknown')}, {server.get('country', 'Unknown')}",
-                    'distance': round(server.get('d', 0), 2),
-                    'country': server.get('country', 'Unknown'),
-                    'cc': server.get('cc', 'XX'),
-                    'url': server.get('url', '')
-                })
+        emit('servers_list', query_servers(data or {}))
         
-        # Sort by distance
-        server_list.sort(key=lambda x: x['distance'])
-        
-        socketio.emit('servers_list', {
-            'servers': server_list[:20]  # Return top 20 closest servers
-        })
+    except Exception as e:
+        emit('servers_error', {'error': str(e)})
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Stored results for a time range, optionally downsampled into buckets"""
+    try:
+        end = request.args.get('end', time.time(), type=float)
+        start = request.args.get('start', end - 24 * 3600, type=float)
+        history = result_store.history(
+            start, end,
+            session_id=request.args.get('session_id'),
+            server_id=request.args.get('server_id'),
+            bucket_seconds=request.args.get('bucket', type=int),
+            max_points=min(request.args.get('points', 0, type=int), MAX_BUCKETS),
+            limit=max(1, min(request.args.get('limit', 1000, type=int), 10000)),
+            include_partial=request.args.get('include_partial') == 'true'
+        )
+        return jsonify({'success': True, 'start': start, 'end': end, 'history': history})
         
     except Exception as e:
-        socketio.emit('servers_error', {'error': str(e)})
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/sessions/<session_id>/results', methods=['GET'])
+def get_session_results(session_id):
+    """A page of a session's stored results, linked from compact-encoded test results"""
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', 100, type=int)), 1000)
+    since = request.args.get('since', type=float)
+    test_type = request.args.get('test_type')
+    results, more = result_store.session_results(session_id, since, test_type, offset, limit)
+    page = {'success': True, 'offset': offset, 'results': results, 'next': None}
+    if more:
+        params = {'offset': offset + limit, 'limit': limit}
+        if since is not None:
+            params['since'] = since
+        if test_type:
+            params['test_type'] = test_type
+        page['next'] = f"{request.path}?{urlencode(params)}"
+    return jsonify(page)
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_results():
+    """Store a batch of agent results, deduplicated by agent, outbox and sequence number"""
+    if INGEST_TOKEN and not hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {INGEST_TOKEN}'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    if (request.content_length or 0) > INGEST_MAX_BYTES:
+        return jsonify({'success': False, 'error': 'Request too large'}), 413
+    try:
+        body = decode_body(request.get_data(cache=False),
+                           request.headers.get('Content-Encoding'), INGEST_MAX_BYTES)
+        agent_id, outbox_id, rows, rejected = parse_batch(body, INGEST_MAX_RESULTS)
+        inserted, duplicates = result_store.ingest(agent_id, rows, outbox_id)
+    except IngestError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    ingested_results.labels('inserted').inc(inserted)
+    ingested_results.labels('duplicate').inc(duplicates)
+    ingested_results.labels('rejected').inc(rejected)
+    return jsonify({
+        'success': True,
+        'agent_id': agent_id,
+        'inserted': inserted,
+        'duplicates': duplicates,
+        'rejected': rejected
+    })
+
+def read_export_request():
+    """Pull (format, results, stability data) out of an export request body"""
+    data = request.json
+    export_format = data.get('format', 'pdf')  # 'pdf' or 'docx'
+    results = data.get('results', {})
+    if not results and data.get('session_id'):
+        # Let clients export a stored result without sending it back
+        results = result_store.latest(data['session_id']) or {}
+    stability_data = data.get('stabilityData', [])
+    return export_format, results, stability_data
+
+def send_report(report, export_format):
+    """Stream rendered report bytes back as an attachment"""
+    return send_file(
+        io.BytesIO(report),
+        as_attachment=True,
+        download_name=f'speedtest_results.{export_format}',
+        mimetype=MIMETYPES[export_format]
+    )
 
 @app.route('/api/export', methods=['POST'])
 def export_results():
     """Export test results as PDF or DOCX"""
     try:
-        data = request.json
-        export_format = data.get('format', 'pdf')  # 'pdf' or 'docx'
-        results = data.get('results', {})
-        stability_data = data.get('stabilityData', [])
-        
-        if export_format == 'pdf':
-            file_path = create_pdf_report(results, stability_data)
-        elif export_format == 'docx':
-            file_path = create_docx_report(results, stability_data)
-        else:
+        export_format, results, stability_data = read_export_request()
+        if export_format not in MIMETYPES:
             return jsonify({'success': False, 'error': 'Invalid format'}), 400
-            
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=f'speedtest_results.{export_format}',
-            mimetype='application/pdf' if export_format == 'pdf' else 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
+        
+        report = export_service.render(export_format, results, stability_data, timeout=EXPORT_TIMEOUT)
+        return send_report(report, export_format)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def create_pdf_report(results, stability_data):
-    """Create a PDF report of the speed test results"""
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib import colors
-    from reportlab.lib.units import inch
-    from datetime import datetime
-    import matplotlib.pyplot as plt
-    import io
-    import base64
-    
-    # Create temporary file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    doc = SimpleDocTemplate(temp_file.name, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        textColor=colors.HexColor('#06B6D4')
-    )
-    story.append(Paragraph("Speed Test Results", title_style))
-    story.append(Spacer(1, 20))
-    
-    # Test information
-    test_info = [
-        ['Test Date:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
-        ['Test Type:', 'Stability Test' if results.get('type') == 'stability_final' else 'Quick Test'],
-    ]
-    
-    if results.get('type') == 'stability_final':
-        test_info.extend([
-            ['Duration:', f"{results.get('duration_minutes', 0)} minutes"],
-            ['Tests Completed:', str(results.get('total_tests', 0))],
-        ])
-    
-    info_table = Table(test_info, colWidths=[2*inch, 3*inch])
-    info_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('BACKGROUND', (1, 0), (1, -1), colors.beige),
-    ]))
-    story.append(info_table)
-    story.append(Spacer(1, 20))
-    
-    # Results table
-    if results.get('type') == 'stability_final':
-        # Stability test results
-        story.append(Paragraph("Connection Stability Analysis", styles['Heading2']))
-        
-        stats_data = [
-            ['Metric', 'Average', 'Minimum', 'Maximum', 'Std Dev'],
-            ['Download (Mbps)', 
-             str(results['download_stats']['avg']), 
-             str(results['download_stats']['min']), 
-             str(results['download_stats']['max']), 
-             str(results['download_stats']['std'])],
-            ['Upload (Mbps)', 
-             str(results['upload_stats']['avg']), 
-             str(results['upload_stats']['min']), 
-             str(results['upload_stats']['max']), 
-             str(results['upload_stats']['std'])],
-            ['Ping (ms)', 
-             str(results['ping_stats']['avg']), 
-             str(results['ping_stats']['min']), 
-             str(results['ping_stats']['max']), 
-             str(results['ping_stats']['std'])],
-        ]
-    else:
-        # Single test results
-        story.append(Paragraph("Speed Test Results", styles['Heading2']))
-        
-        stats_data = [
-            ['Metric', 'Value'],
-            ['Download Speed', f"{results.get('download', 0)} Mbps"],
-            ['Upload Speed', f"{results.get('upload', 0)} Mbps"],
-            ['Ping', f"{results.get('ping', 0)} ms"],
-            ['Jitter', f"{results.get('jitter', 0)} ms"],
-        ]
-    
-    results_table = Table(stats_data)
-    results_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    story.append(results_table)
-    
-    # Build PDF
-    doc.build(story)
-    return temp_file.name
-
-def create_docx_report(results, stability_data):
-    """Create a DOCX report of the speed test results"""
-    from docx import Document
-    from docx.shared import Inches, RGBColor
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from datetime import datetime
-    
-    # Create document
-    doc = Document()
-    
-    # Title
-    title = doc.add_heading('Speed Test Results', 0)
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    
-    # Test information
-    doc.add_heading('Test Information', level=1)
-    info_table = doc.add_table(rows=1, cols=2)
-    info_table.style = 'Table Grid'
-    
-    # Add test info rows
-    test_info = [
-        ('Test Date:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-        ('Test Type:', 'Stability Test' if results.get('type') == 'stability_final' else 'Quick Test'),
-    ]
-    
-    if results.get('type') == 'stability_final':
-        test_info.extend([
-            ('Duration:', f"{results.get('duration_minutes', 0)} minutes"),
-            ('Tests Completed:', str(results.get('total_tests', 0))),
-        ])
-    
-    for label, value in test_info:
-        row_cells = info_table.add_row().cells
-        row_cells[0].text = label
-        row_cells[1].text = value
-    
-    # Results
-    doc.add_heading('Results', level=1)
-    results_table = doc.add_table(rows=1, cols=2 if results.get('type') != 'stability_final' else 5)
-    results_table.style = 'Table Grid'
-    
-    if results.get('type') == 'stability_final':
-        # Headers
-        hdr_cells = results_table.rows[0].cells
-        hdr_cells[0].text = 'Metric'
-        hdr_cells[1].text = 'Average'
-        hdr_cells[2].text = 'Minimum'
-        hdr_cells[3].text = 'Maximum'
-        hdr_cells[4].text = 'Std Dev'
-        
-        # Data rows
-        metrics = [
-            ('Download (Mbps)', results['download_stats']),
-            ('Upload (Mbps)', results['upload_stats']),
-            ('Ping (ms)', results['ping_stats']),
-        ]
-        
-        for metric_name, stats in metrics:
-            row_cells = results_table.add_row().cells
-            row_cells[0].text = metric_name
-            row_cells[1].text = str(stats['avg'])
-            row_cells[2].text = str(stats['min'])
-            row_cells[3].text = str(stats['max'])
-            row_cells[4].text = str(stats['std'])
-    else:
-        # Headers
-        hdr_cells = results_table.rows[0].cells
-        hdr_cells[0].text = 'Metric'
-        hdr_cells[1].text = 'Value'
+@app.route('/api/export/jobs', methods=['POST'])
+def start_export_job():
+    """Start rendering a report without waiting; poll the returned job"""
+    try:
+        export_format, results, stability_data = read_export_request()
+        if export_format not in MIMETYPES:
+            return jsonify({'success': False, 'error': 'Invalid format'}), 400
         
-        # Data rows
-        metrics = [
-            ('Download Speed', f"{results.get('download', 0)} Mbps"),
-            ('Upload Speed', f"{results.get('upload', 0)} Mbps"),
-            ('Ping', f"{results.get('ping', 0)} ms"),
-            ('Jitter', f"{results.get('jitter', 0)} ms"),
-        ]
+        key, _ = export_service.submit(export_format, results, stability_data)
+        return jsonify({
+            'success': True,
+            'job_id': f'{key}.{export_format}',
+            'status': export_service.status(key)
+        }), 202
         
-        for metric_name, value in metrics:
-            row_cells = results_table.add_row().cells
-            row_cells[0].text = metric_name
-            row_cells[1].text = value
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/export/jobs/<job_id>', methods=['GET'])
+def get_export_job(job_id):
+    """Download a finished export job, or report that it is still running"""
+    key, _, export_format = job_id.partition('.')
+    if export_format not in MIMETYPES:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
     
-    # Save to temporary file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
-    doc.save(temp_file.name)
-    return temp_file.name
+    status = export_service.status(key)
+    if status == 'ready':
+        report = export_service.get(key)
+        if report is not None:
+            return send_report(report, export_format)
+        status = 'unknown'  # Evicted since the status check
+    if status == 'pending':
+        return jsonify({'success': True, 'job_id': job_id, 'status': status}), 202
+    if status == 'failed':
+        return jsonify({'success': False, 'job_id': job_id, 'status': status,
+                        'error': export_service.error(key)}), 500
+    return jsonify({'success': False, 'error': 'Unknown job'}), 404
 
 if __name__ == '__main__':
-    print("Starting Flask-SocketIO server...")
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    # Spawned export workers would re-run this module's top level; server.py
+    # is the entry point that keeps them from doing so
+    sys.exit("Start the backend with: python server.py")
@@ -0,0 +1,338 @@
+"""Reproducible backend benchmarks against the local speedtest-protocol server.
+
+Measures per-phase overhead of ``run_single_speed_test`` (cold and with a
+warm session), Socket.IO emit throughput and fan-out cost with N connected
+clients, the cost of coalescing progress frames, memory growth over a long
+continuous run, and report export latency. Results are written as JSON so runs on different commits can be
+compared:
+
+    python benchmarks.py --output before.json
+    python benchmarks.py --output after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from local_server import start_local_server
+
+BENCHMARKS = ('phases', 'fanout', 'memory', 'export')
+
+
+class EmitRecorder:
+    """Wraps ``SessionEvents.emit`` to timestamp frames and time the emits themselves.
+
+    Frames are recorded as the test hands them over, before coalescing;
+    ``emit_seconds`` covers coalescing, encoding and the Socket.IO send.
+    """
+
+    def __init__(self, session_events):
+        self.session_events = session_events
+        self.frames = []  # (perf_counter, event, data)
+        self.emit_seconds = 0.0
+
+    def __enter__(self):
+        emit = self.session_events.emit
+
+        def recorded(event, data=None, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return emit(event, data, *args, **kwargs)
+            finally:
+                self.emit_seconds += time.perf_counter() - start
+                self.frames.append((start, event, data))
+
+        self.session_events.emit = recorded
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        del self.session_events.emit
+        return False
+
+    def first(self, event, frame_type=None, message=None):
+        for ts, name, data in self.frames:
+            if name != event or not isinstance(data, dict):
+                continue
+            if frame_type is not None and data.get('type') != frame_type:
+                continue
+            if message is not None and data.get('message') != message:
+                continue
+            return ts
+        return None
+
+
+def phase_timings(recorder, start, end):
+    """Seconds spent in each test phase, from the progress frames it emitted."""
+    client_info = recorder.first('test_progress', 'client_info')
+    selected = recorder.first('test_progress', 'server_selected')
+    download_start = recorder.first('test_progress', 'status', 'Testing download speed...')
+    download_end = recorder.first('test_progress', 'download_complete')
+    upload_start = recorder.first('test_progress', 'status', 'Testing upload speed...')
+    upload_end = recorder.first('test_progress', 'upload_complete')
+    result = recorder.first('test_result') or end
+    phases = {
+        'config': client_info - start,
+        'server_selection': selected - client_info,
+        'ping': download_start - selected,
+        'download': download_end - download_start,
+        'upload': upload_end - upload_start,
+        'finalize': result - upload_end,
+        'emit': recorder.emit_seconds,
+        'total': end - start,
+    }
+    phases['overhead'] = phases['total'] - phases['download'] - phases['upload']
+    return phases
+
+
+def bench_phases(app, iterations):
+    """Per-phase seconds for a cold first test and the median of warm repeats."""
+    from cancellation import CancelToken
+
+    runs = []
+    for i in range(iterations):
+        with EmitRecorder(app.session_events) as recorder:
+            start = time.perf_counter()
+            result = app.run_single_speed_test('bench-phases', None, CancelToken(), 'continuous')
+            end = time.perf_counter()
+        if result.get('type') != 'final':
+            raise RuntimeError(f"Benchmark test failed: {result.get('message')}")
+        runs.append(phase_timings(recorder, start, end))
+
+    report = {'iterations': iterations, 'cold': runs[0]}
+    if len(runs) > 1:
+        report['warm_median'] = {
+            phase: statistics.median(run[phase] for run in runs[1:]) for phase in runs[0]
+        }
+    return report
+
+
+def join_session(app, client, session_id):
+    """Put a test client in a session's room, as ``start_test`` does for the real client."""
+    server = app.socketio.server
+    sid = server.manager.sid_from_eio_sid(client.eio_sid, '/')
+    server.enter_room(sid, app.session_room(session_id), namespace='/')
+
+
+def bench_fanout(app, client_counts, events):
+    """Emit throughput and per-delivery cost with N Socket.IO clients following one session.
+
+    Fan-out is measured with ``status`` frames, which ``session_events``
+    sends to the room as they come. Progress frames would mostly be
+    coalesced away (at most PROGRESS_MAX_RATE a second reach the room), so
+    their cost is reported on its own under ``coalescing``: time per frame
+    handed over, and how many were actually sent.
+    """
+    session_id = 'bench-fanout'
+    status = {
+        'type': 'status',
+        'message': 'Testing download speed...',
+        'session_id': session_id
+    }
+    report = {}
+    for count in client_counts:
+        clients = [app.socketio.test_client(app.app) for _ in range(count)]
+        for client in clients:
+            join_session(app, client, session_id)
+            client.get_received()
+        start = time.perf_counter()
+        for _ in range(events):
+            app.session_events.emit('test_progress', status)
+        elapsed = time.perf_counter() - start
+        delivered = sum(len(client.get_received()) for client in clients)
+        for client in clients:
+            client.disconnect()
+        report[str(count)] = {
+            'events': events,
+            'seconds': elapsed,
+            'events_per_second': events / elapsed,
+            'deliveries': delivered,
+            'deliveries_per_second': delivered / elapsed,
+            'us_per_delivery': elapsed / delivered * 1e6 if delivered else None,
+        }
+
+    progress = {
+        'type': 'download_progress',
+        'download': 123.45,
+        'elapsed': 1.5,
+        'session_id': session_id
+    }
+    sent_before = app.session_events.stats()['sent']
+    start = time.perf_counter()
+    for _ in range(events):
+        app.session_events.emit('test_progress', progress)
+    elapsed = time.perf_counter() - start
+    app.session_events.close(session_id)  # Send whatever is still pending
+    report['coalescing'] = {
+        'events': events,
+        'sent': app.session_events.stats()['sent'] - sent_before,
+        'seconds': elapsed,
+        'us_per_event': elapsed / events * 1e6,
+    }
+    return report
+
+
+def bench_memory(app, iterations):
+    """Traced heap after every iteration of a continuous run, and its growth rate."""
+    from cancellation import CancelToken
+    from streaming_stats import StabilityAccumulator
+
+    token = CancelToken()
+    stats = StabilityAccumulator()
+    samples = []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            result = app.run_single_speed_test('bench-memory', None, token, 'continuous')
+            if result.get('type') == 'final':
+                stats.add(result)
+            gc.collect()
+            samples.append(tracemalloc.get_traced_memory()[0])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        stats.close()
+
+    # Growth over the second half, once caches and pools have warmed up
+    half = len(samples) // 2
+    steady = samples[half:]
+    growth = (steady[-1] - steady[0]) / (len(steady) - 1) if len(steady) > 1 else 0.0
+    return {
+        'iterations': iterations,
+        'traced_bytes': samples,
+        'peak_traced_bytes': peak,
+        'growth_bytes_per_iteration': growth,
+    }
+
+
+def stability_payload(points):
+    """Synthetic stability export payload with ``points`` chart samples."""
+    start = time.time() - points * 10
+    stability_data = [{
+        'test_number': i + 1,
+        'ping': 20 + (i % 17),
+        'download': 100 + (i % 31),
+        'upload': 20 + (i % 7),
+        'timestamp': datetime.fromtimestamp(start + i * 10, timezone.utc).isoformat(),
+    } for i in range(points)]
+    summary = {'avg': 100.0, 'min': 80.0, 'max': 130.0, 'std': 5.0}
+    results = {
+        'type': 'stability_final',
+        'duration_minutes': points * 10 // 60,
+        'total_tests': points,
+        'download_stats': summary,
+        'upload_stats': summary,
+        'ping_stats': summary,
+    }
+    return results, stability_data
+
+
+def bench_export(app, sizes):
+    """Render latency and size per format and series length, plus cache-hit latency."""
+    import reports
+
+    report = {}
+    for points in sizes:
+        results, stability_data = stability_payload(points)
+        for export_format in reports.MIMETYPES:
+            start = time.perf_counter()
+            data = reports.render_report(export_format, results, stability_data)
+            render = time.perf_counter() - start
+            app.export_service.render(export_format, results, stability_data)
+            start = time.perf_counter()
+            app.export_service.render(export_format, results, stability_data)
+            hit = time.perf_counter() - start
+            report[f'{export_format}_{points}'] = {
+                'points': points,
+                'render_seconds': render,
+                'bytes': len(data),
+                'cache_hit_seconds': hit,
+            }
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline, current, path=''):
+    """``(path, old, new)`` for every numeric value present in both reports."""
+    if isinstance(baseline, dict) and isinstance(current, dict):
+        for key in baseline.keys() & current.keys():
+            yield from compare(baseline[key], current[key], f'{path}.{key}' if path else key)
+    elif (isinstance(baseline, (int, float)) and isinstance(current, (int, float))
+          and not isinstance(baseline, bool)):
+        yield path, baseline, current
+
+
+def print_comparison(baseline, current):
+    for path, old, new in sorted(compare(baseline['benchmarks'], current['benchmarks'])):
+        change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+        print(f'{path:60s} {old:14.6g} -> {new:14.6g}  {change}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend benchmarks")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--compare', help="Earlier results file to diff against")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help="Run a subset")
+    parser.add_argument('--iterations', type=int, default=5, help="Tests in the phase benchmark")
+    parser.add_argument('--memory-iterations', type=int, default=30, help="Tests in the memory benchmark")
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 100], help="Fan-out client counts")
+    parser.add_argument('--events', type=int, default=1000, help="Events emitted per fan-out run")
+    parser.add_argument('--export-points', type=int, nargs='+', default=[50, 5000, 500000],
+                        help="Stability series lengths for the export benchmark")
+    parser.add_argument('--test-length', type=int, default=1, help="Transfer seconds per direction")
+    args = parser.parse_args()
+
+    server = start_local_server(test_length=args.test_length)
+    workdir = tempfile.mkdtemp(prefix='speedtest-bench-')
+    # Configure the backend before importing it: local server, throwaway database
+    os.environ['SPEEDTEST_SERVER_URL'] = server.url
+    os.environ['RESULTS_DB_PATH'] = os.path.join(workdir, 'results.db')
+    import app
+
+    runners = {
+        'phases': lambda: bench_phases(app, args.iterations),
+        'fanout': lambda: bench_fanout(app, args.clients, args.events),
+        'memory': lambda: bench_memory(app, args.memory_iterations),
+        'export': lambda: bench_export(app, args.export_points),
+    }
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'benchmarks': {},
+    }
+    try:
+        for name in args.only or BENCHMARKS:
+            print(f'Running {name}...')
+            report['benchmarks'][name] = runners[name]()
+    finally:
+        app.export_service.shutdown()
+        server.shutdown()
+        server.server_close()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Cooperative cancellation for running speed tests."""
+import threading
+
+
+class TestCancelled(Exception):
+    """Raised at a checkpoint once a test's token has been cancelled."""
+
+
+class CancelToken:
+    """Shared stop flag checked by a test at every phase boundary.
+
+    ``event`` is a plain ``threading.Event`` so it can double as the
+    ``shutdown_event`` speedtest-cli's transfer threads poll between reads.
+    Callbacks registered with ``on_cancel`` run once, on the thread that
+    cancels, which lets a test tear down sockets and workers immediately
+    instead of at its next checkpoint. A token shared by the tests of a
+    continuous run should have each test unregister its callbacks when it
+    ends. ``test_id`` identifies the test in
+    the shared session registry.
+    """
+
+    def __init__(self, test_id=None):
+        self.test_id = test_id
+        self.event = threading.Event()
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self, reason='stopped'):
+        with self._lock:
+            if self.event.is_set():
+                return
+            self.reason = reason
+            self.event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+
+    def on_cancel(self, callback):
+        """Run ``callback`` on cancellation (immediately if already cancelled).
+
+        Returns a function that unregisters ``callback``, for callbacks that
+        must not outlive what they tear down (a pooled session, say).
+        """
+        with self._lock:
+            if not self.event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        """Raise ``TestCancelled`` if the test has been cancelled."""
+        if self.event.is_set():
+            raise TestCancelled(self.reason)
+
+    def sleep(self, seconds):
+        """Interruptible sleep; returns ``True`` if cancelled meanwhile."""
+        return self.event.wait(seconds)
@@ -0,0 +1,116 @@
+"""Early termination of transfer phases once throughput has converged."""
+import math
+import statistics
+
+STOP_CONVERGED = 'converged'
+STOP_MAX_DURATION = 'max_duration'
+STOP_MAX_BYTES = 'max_bytes'
+STOP_COMPLETED = 'completed'
+
+
+def t_critical(confidence, df):
+    """Two-sided Student's t critical value (Cornish-Fisher expansion around z)."""
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    return (z + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2))
+
+
+class ConvergencePolicy:
+    """When a transfer phase may stop.
+
+    The throughput estimate is the mean of the last ``window`` batch rates,
+    each covering ``batch_seconds`` of transfer; batching keeps the
+    (strongly autocorrelated) 100 ms samples from understating the
+    variance. A phase stops once the ``confidence`` interval of that mean is
+    within ``tolerance`` of it (a relative half-width), but never before
+    ``min_duration`` seconds, and always at ``max_duration`` seconds or
+    ``max_bytes`` transferred. A ``tolerance`` of 0 disables convergence
+    stops while keeping the caps.
+    """
+
+    def __init__(self, tolerance=0.05, confidence=0.95, window=6, batch_seconds=0.5,
+                 min_duration=3.0, max_duration=15.0, max_bytes=None):
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.window = max(2, window)
+        self.batch_seconds = batch_seconds
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.max_bytes = max_bytes
+
+    def tracker(self, max_bytes=None):
+        """Per-phase tracker, optionally with a tighter byte cap than the policy's."""
+        return ConvergenceTracker(self, max_bytes)
+
+
+class ConvergenceTracker:
+    """Per-phase state for a ``ConvergencePolicy``.
+
+    Feed it every throughput sample with ``add``; it returns the stop
+    reason once the phase should end and ``None`` until then.
+    """
+
+    def __init__(self, policy, max_bytes=None):
+        self.policy = policy
+        caps = [cap for cap in (policy.max_bytes, max_bytes) if cap]
+        self.max_bytes = min(caps) if caps else None
+        self.batches = []
+        self.reason = None
+        self.elapsed = 0.0
+        self.bytes = 0
+        self._batch_bits = 0.0
+        self._batch_time = 0.0
+        self._last_elapsed = 0.0
+
+    def add(self, mbps, elapsed, total_bytes):
+        """Record the rate of the interval ending at ``elapsed`` seconds."""
+        if self.reason is not None:
+            return self.reason
+        policy = self.policy
+        interval = elapsed - self._last_elapsed
+        self._last_elapsed = elapsed
+        self.elapsed = elapsed
+        self.bytes = total_bytes
+        self._batch_bits += mbps * interval
+        self._batch_time += interval
+        if self._batch_time >= policy.batch_seconds:
+            self.batches.append(self._batch_bits / self._batch_time)
+            self._batch_bits = self._batch_time = 0.0
+
+        if self.max_bytes and total_bytes >= self.max_bytes:
+            self.reason = STOP_MAX_BYTES
+        elif policy.max_duration and elapsed >= policy.max_duration:
+            self.reason = STOP_MAX_DURATION
+        elif (policy.tolerance and elapsed >= policy.min_duration
+              and self.relative_ci() <= policy.tolerance):
+            self.reason = STOP_CONVERGED
+        return self.reason
+
+    def estimate(self):
+        """Mean rate (Mbps) over the last ``window`` batches."""
+        recent = self.batches[-self.policy.window:]
+        return statistics.fmean(recent) if recent else 0.0
+
+    def relative_ci(self):
+        """Half-width of the confidence interval relative to the estimate; inf until known."""
+        recent = self.batches[-self.policy.window:]
+        if len(recent) < self.policy.window:
+            return math.inf
+        mean = statistics.fmean(recent)
+        if mean <= 0:
+            return math.inf
+        half_width = (t_critical(self.policy.confidence, len(recent) - 1)
+                      * statistics.stdev(recent) / math.sqrt(len(recent)))
+        return half_width / mean
+
+    def summary(self):
+        relative_ci = self.relative_ci()
+        return {
+            'stop_reason': self.reason or STOP_COMPLETED,
+            'estimate': round(self.estimate(), 2),
+            'relative_ci': round(relative_ci, 4) if math.isfinite(relative_ci) else None,
+            'confidence': self.policy.confidence,
+            'tolerance': self.policy.tolerance,
+            'elapsed': round(self.elapsed, 2),
+            'bytes': self.bytes,
+        }
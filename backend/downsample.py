@@ -0,0 +1,46 @@
+"""Shape-preserving downsampling for plotting long series."""
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: indices of ``threshold`` representative points.
+
+    Always keeps the first and last point. Every bucket in between
+    contributes the point forming the largest triangle with the previously
+    kept point and the mean of the next bucket, which preserves peaks and
+    dips that plain striding or averaging would flatten. Work per bucket is
+    vectorized, so the cost is O(n) with only ``threshold`` Python steps.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.size
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start = end
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        px, py = x[previous], y[previous]
+        # Twice the triangle area; the constant factor doesn't change argmax
+        areas = np.abs((px - avg_x) * (y[start:end] - py) - (px - x[start:end]) * (avg_y - py))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def downsample(x, y, threshold):
+    """``(x, y)`` reduced to at most ``threshold`` points with LTTB; NaNs are dropped."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    index = lttb(x, y, threshold)
+    return x[index], y[index]
@@ -0,0 +1,146 @@
+"""Off-request report rendering with a content-addressed cache."""
+import hashlib
+import json
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import reports
+
+
+def payload_key(export_format, results, stability_data):
+    """Content hash identifying a report; identical payloads share it."""
+    canonical = json.dumps([export_format, results, stability_data],
+                           sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ExportService:
+    """Renders reports in a worker pool, deduplicating and caching by payload.
+
+    Workers are separate processes (report rendering is CPU bound) that
+    import reportlab, matplotlib and python-docx once at startup. Finished
+    reports are kept as bytes in an LRU bounded by ``max_cache_bytes``;
+    concurrent requests for the same payload share one in-flight render.
+    ``on_rendered(export_format, seconds, failed)`` is called as each
+    render finishes, with its time from submission.
+    """
+
+    def __init__(self, workers=2, max_cache_bytes=64 * 1024 * 1024, render=reports.render_report,
+                 on_rendered=None):
+        self.max_cache_bytes = max_cache_bytes
+        self._render = render
+        self.on_rendered = on_rendered
+        # Workers start lazily, long after the app has started threads; forking
+        # then could copy a lock some other thread holds. Spawned workers
+        # re-run the main script's top level, so the app is started from
+        # server.py, which doesn't import app.py when imported itself.
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=reports.preload,
+                                         mp_context=multiprocessing.get_context('spawn'))
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> report bytes, least recently used first
+        self._cache_bytes = 0
+        self._inflight = {}  # key -> Future
+        self._failures = OrderedDict()  # key -> error message, most recent last
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, export_format, results, stability_data):
+        """Start (or join) rendering; returns ``(key, future_or_None)``.
+
+        ``None`` means the report is already cached under ``key``.
+        """
+        if export_format not in reports.MIMETYPES:
+            raise ValueError(f"Invalid format: {export_format}")
+        key = payload_key(export_format, results, stability_data)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return key, None
+            future = self._inflight.get(key)
+            started = future is None
+            if started:
+                submitted_at = time.perf_counter()
+                self.misses += 1
+                future = self._pool.submit(self._render, export_format, results, stability_data)
+                self._inflight[key] = future
+        if started:
+            # Outside the lock: an already-finished future runs the callback inline
+            future.add_done_callback(lambda done: self._finished(key, done, export_format, submitted_at))
+        return key, future
+
+    def render(self, export_format, results, stability_data, timeout=60):
+        """Rendered report bytes, from the cache or a worker."""
+        key, future = self.submit(export_format, results, stability_data)
+        if future is None:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            # Evicted between submit and get; render again
+            key, future = self.submit(export_format, results, stability_data)
+            if future is None:
+                return self.get(key)
+        return future.result(timeout=timeout)
+
+    def get(self, key):
+        """Cached bytes for ``key``, or ``None``."""
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+            return data
+
+    def status(self, key):
+        """'ready', 'pending', 'failed' or 'unknown' for a submitted key."""
+        with self._lock:
+            if key in self._cache:
+                return 'ready'
+            future = self._inflight.get(key)
+            if future is not None:
+                return 'pending'
+            return 'failed' if key in self._failures else 'unknown'
+
+    def error(self, key):
+        with self._lock:
+            return self._failures.get(key)
+
+    def _finished(self, key, future, export_format, submitted_at):
+        self._store(key, future)
+        if self.on_rendered is not None:
+            failed = future.cancelled() or future.exception() is not None
+            self.on_rendered(export_format, time.perf_counter() - submitted_at, failed)
+
+    def _store(self, key, future):
+        with self._lock:
+            self._inflight.pop(key, None)
+            error = 'cancelled' if future.cancelled() else future.exception()
+            if error is not None:
+                self._failures[key] = str(error)
+                while len(self._failures) > 100:
+                    self._failures.popitem(last=False)
+                return
+            self._failures.pop(key, None)
+            data = future.result()
+            if len(data) > self.max_cache_bytes:
+                return
+            self._cache[key] = data
+            self._cache_bytes += len(data)
+            while self._cache_bytes > self.max_cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_reports': len(self._cache),
+                'cached_bytes': self._cache_bytes,
+                'inflight': len(self._inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,91 @@
+"""Decoding and validation of result batches uploaded by speed.py agents."""
+import json
+import math
+import zlib
+
+MAX_AGENT_ID = 128
+MAX_OUTBOX_ID = 64
+METRICS = ('ping', 'jitter', 'download', 'upload')
+
+
+class IngestError(ValueError):
+    """The request body can't be ingested; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_body(data, content_encoding=None, max_bytes=32 * 1024 * 1024):
+    """Request body bytes, gunzipped if needed, refusing anything over ``max_bytes``."""
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        body = data
+    elif encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(data, max_bytes + 1)
+        except zlib.error as e:
+            raise IngestError(f'Invalid gzip body: {e}')
+    else:
+        raise IngestError(f'Unsupported Content-Encoding: {encoding}', status=415)
+    if len(body) > max_bytes:
+        raise IngestError(f'Body larger than {max_bytes} bytes', status=413)
+    return body
+
+
+def _number(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f'not a number: {value!r}')
+    return float(value)
+
+
+def parse_batch(body, max_results=10000):
+    """Validate a batch; returns ``(agent_id, outbox_id, rows, rejected)``.
+
+    ``outbox_id`` names the agent outbox the sequence numbers come from
+    ('' from agents that don't send one).
+
+    ``rows`` are ``(seq, ts, server_id, ping, jitter, download, upload,
+    payload)`` tuples, one per valid result with the last copy of a
+    repeated ``seq`` winning. Malformed results are counted in ``rejected``
+    rather than failing the whole batch, so one bad row can't wedge an
+    agent's outbox.
+    """
+    try:
+        batch = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise IngestError(f'Invalid JSON: {e}')
+    if not isinstance(batch, dict):
+        raise IngestError('Expected a JSON object')
+    agent_id = batch.get('agent_id')
+    if not isinstance(agent_id, str) or not agent_id or len(agent_id) > MAX_AGENT_ID:
+        raise IngestError('agent_id must be a non-empty string')
+    outbox_id = batch.get('outbox_id', '')
+    if not isinstance(outbox_id, str) or len(outbox_id) > MAX_OUTBOX_ID:
+        raise IngestError('outbox_id must be a string')
+    results = batch.get('results')
+    if not isinstance(results, list):
+        raise IngestError('results must be a list')
+    if len(results) > max_results:
+        raise IngestError(f'At most {max_results} results per request', status=413)
+
+    rows = {}
+    rejected = 0
+    for result in results:
+        try:
+            seq = result['seq']
+            if isinstance(seq, bool) or not isinstance(seq, int) or seq < 0:
+                raise ValueError(f'bad seq: {seq!r}')
+            ts = _number(result['ts'])
+            if ts is None:
+                raise ValueError('missing ts')
+            metrics = [_number(result.get(name)) for name in METRICS]
+            server_id = result.get('server_id')
+            rows[seq] = (seq, ts, str(server_id) if server_id is not None else None,
+                         *metrics, json.dumps(result, separators=(',', ':')))
+        except (TypeError, KeyError, ValueError):
+            rejected += 1
+    return agent_id, outbox_id, list(rows.values()), rejected
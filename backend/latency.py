@@ -0,0 +1,143 @@
+"""Per-sample HTTP latency measurement and jitter statistics."""
+import http.client
+import os
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+# RFC 3550 section 6.4.1: J(i) = J(i-1) + (|D(i-1,i)| - J(i-1)) / 16
+JITTER_GAIN = 1 / 16
+
+
+def latency_url(server_url):
+    """``latency.txt`` next to a server's ``upload.php`` URL."""
+    return f"{os.path.dirname(server_url)}/latency.txt"
+
+
+class LatencySampler:
+    """Times ``latency.txt`` fetches over one kept-alive HTTP connection.
+
+    The connection is opened (and warmed with one uncounted request) up
+    front so every counted sample measures a request round trip rather than
+    a TCP/TLS handshake. A failed request counts as a lost sample and the
+    connection is re-established before the next one. With ``keep_alive``
+    the connection also survives between ``sample()`` calls, so a reused
+    sampler skips the handshake entirely; call ``close()`` when done.
+    """
+
+    def __init__(self, url, timeout=2, interval=0.0, keep_alive=False):
+        parts = urlparse(url)
+        self.scheme = parts.scheme or 'http'
+        self.netloc = parts.netloc
+        self.path = parts.path or '/latency.txt'
+        self.timeout = timeout
+        self.interval = interval
+        self.keep_alive = keep_alive
+        self._conn = None
+
+    def _connect(self):
+        connection_class = (http.client.HTTPSConnection if self.scheme == 'https'
+                            else http.client.HTTPConnection)
+        self._conn = connection_class(self.netloc, timeout=self.timeout)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _fetch(self, seq):
+        if self._conn is None:
+            self._connect()
+        # Unique query string so no cache between us and the server answers
+        path = f"{self.path}?x={int(time.time() * 1000)}.{seq}"
+        start = time.perf_counter()
+        self._conn.request('GET', path, headers={'Connection': 'keep-alive'})
+        response = self._conn.getresponse()
+        body = response.read()
+        rtt = (time.perf_counter() - start) * 1000
+        if response.status != 200 or not body.startswith(b'test=test'):
+            raise http.client.HTTPException(f"Unexpected latency response: {response.status}")
+        return rtt
+
+    def probe(self):
+        """One uncounted round trip; its RTT in ms, or ``None`` if it failed."""
+        try:
+            return self._fetch(0)
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return None
+
+    def sample(self, count=10, on_sample=None, stop_event=None):
+        """Take ``count`` samples as ``(timestamp, rtt_ms)``; lost ones have ``None``.
+
+        Sampling ends early, returning what was collected, once ``stop_event``
+        is set.
+        """
+        samples = []
+        try:
+            self.probe()
+            for i in range(count):
+                if stop_event is not None and stop_event.is_set():
+                    break
+                timestamp = time.time()
+                try:
+                    rtt = self._fetch(i + 1)
+                except (OSError, http.client.HTTPException):
+                    self.close()
+                    rtt = None
+                samples.append((timestamp, rtt))
+                if on_sample is not None:
+                    on_sample(i + 1, rtt)
+                if self.interval and i + 1 < count:
+                    if stop_event is not None:
+                        stop_event.wait(self.interval)
+                    else:
+                        time.sleep(self.interval)
+        finally:
+            if not self.keep_alive:
+                self.close()
+        return samples
+
+
+def rfc3550_jitter(rtts):
+    """Final RFC 3550 interarrival jitter estimate for a series of RTTs.
+
+    The filter is seeded with the first absolute difference rather than
+    RFC 3550's J = 0. From zero, the ~10 samples of a ping phase only get
+    it to under half of the steady-state value. Unrolled, the filter is a weighted
+    sum of the absolute successive differences (weights summing to 1), so
+    the whole series is reduced in a single dot product.
+    """
+    rtts = np.asarray(rtts, dtype=float)
+    if rtts.size < 2:
+        return 0.0
+    deltas = np.abs(np.diff(rtts))
+    weights = JITTER_GAIN * (1 - JITTER_GAIN) ** np.arange(deltas.size - 1, -1, -1)
+    # The seed's weight: everything the later updates leave of it
+    weights[0] = (1 - JITTER_GAIN) ** (deltas.size - 1)
+    return float(np.dot(deltas, weights))
+
+
+def latency_stats(samples):
+    """Summarize ``(timestamp, rtt_ms)`` samples from ``LatencySampler``."""
+    rtts = np.array([rtt for _, rtt in samples if rtt is not None], dtype=float)
+    lost = len(samples) - rtts.size
+    stats = {
+        'count': len(samples),
+        'lost': lost,
+        'loss_percent': round(lost / len(samples) * 100, 2) if samples else 0.0,
+    }
+    if rtts.size == 0:
+        return stats
+    p50, p95, p99 = np.percentile(rtts, [50, 95, 99])
+    stats.update({
+        'mean': round(float(rtts.mean()), 3),
+        'min': round(float(rtts.min()), 3),
+        'median': round(float(p50), 3),
+        'p95': round(float(p95), 3),
+        'p99': round(float(p99), 3),
+        'max': round(float(rtts.max()), 3),
+        'jitter': round(rfc3550_jitter(rtts), 3),
+    })
+    return stats
@@ -0,0 +1,280 @@
+"""Local stand-in for the speedtest.net protocol, for offline and LAN testing.
+
+Serves what speedtest-cli talks to: the client configuration, a server
+list containing only this server, ``latency.txt``, ``random*.jpg``
+downloads and ``upload.php``. Downloads are sent from one pre-generated
+random payload with ``sendfile`` and uploads are read into a reused buffer
+and discarded. Bandwidth and latency can optionally be shaped.
+
+Run standalone with ``python local_server.py --port 8081`` and point the
+backend at it with ``SPEEDTEST_SERVER_URL=http://127.0.0.1:8081`` (or
+``speed.py --server-url ...``).
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+import speedtest
+
+# Hosts speedtest-cli fetches its configuration and server list from
+SPEEDTEST_HOSTS = ('www.speedtest.net', 'c.speedtest.net')
+
+# random4000x4000.jpg, the largest download speedtest-cli requests, is ~32 MB
+MAX_PAYLOAD = 4000 * 4000 * 2
+CHUNK = 256 * 1024
+RANDOM_IMAGE = re.compile(r'/random(\d+)x(\d+)\.jpg$')
+
+CONFIG_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<settings>
+<client ip="{ip}" lat="0" lon="0" isp="Local network" isprating="3.7" rating="0" ispdlavg="0" ispulavg="0" loggedin="0" country="LAN"/>
+<server-config threadcount="4" ignoreids="" notonmap="" forcepingid="" preferredserverid=""/>
+<download testlength="{test_length}" initialtest="250K" mintestsize="250K" threadsperurl="4"/>
+<upload testlength="{test_length}" ratio="5" initialtest="0" mintestsize="32K" threads="2" maxchunksize="512K" maxchunkcount="50" threadsperurl="4"/>
+</settings>
+"""
+
+SERVERS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<settings>
+<servers>
+<server url="http://{host}/speedtest/upload.php" lat="0" lon="0" name="Local" country="LAN" cc="LN" sponsor="Local speedtest server" id="{server_id}" host="{host}"/>
+</servers>
+</settings>
+"""
+
+
+def image_size(width, height):
+    """Approximate byte size of speedtest.net's ``random<w>x<h>.jpg``."""
+    return min(width * height * 2, MAX_PAYLOAD)
+
+
+class TokenBucket:
+    """Shared rate limiter; ``consume`` blocks until ``count`` bytes may pass."""
+
+    def __init__(self, mbps):
+        self.rate = mbps * 1_000_000 / 8  # bytes per second
+        self.capacity = max(CHUNK, self.rate / 20)  # at most 50 ms of burst
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class SpeedtestRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'LocalSpeedtest/1.0'
+    # Headers and body go out in separate writes; don't let Nagle hold the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _delay(self):
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000)
+
+    def _send_body(self, body, content_type='text/plain'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _host(self):
+        return self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]
+
+    def do_GET(self):
+        self._delay()
+        path = urlsplit(self.path).path
+        if path.endswith('/latency.txt'):
+            self._send_body(b'test=test\n')
+        elif path.endswith('/speedtest-config.php'):
+            body = CONFIG_XML.format(ip=self.client_address[0], test_length=self.server.test_length)
+            self._send_body(body.encode(), 'text/xml')
+        elif path.endswith(('/speedtest-servers-static.php', '/speedtest-servers.php')):
+            body = SERVERS_XML.format(host=self._host(), server_id=self.server.server_id)
+            self._send_body(body.encode(), 'text/xml')
+        else:
+            match = RANDOM_IMAGE.search(path)
+            if match is None:
+                self.send_error(404)
+                return
+            self._send_payload(image_size(int(match.group(1)), int(match.group(2))))
+
+    def _send_payload(self, size):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(size))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        bucket = self.server.download_bucket
+        with open(self.server.payload_path, 'rb') as payload:
+            if bucket is None:
+                # Zero-copy from the page cache straight into the socket
+                self.connection.sendfile(payload, 0, size)
+                return
+            offset = 0
+            while offset < size:
+                count = min(CHUNK, size - offset)
+                bucket.consume(count)
+                self.connection.sendfile(payload, offset, count)
+                offset += count
+
+    def do_POST(self):
+        self._delay()
+        if not urlsplit(self.path).path.endswith('/upload.php'):
+            self.send_error(404)
+            return
+        remaining = int(self.headers.get('Content-Length') or 0)
+        received = 0
+        buffer = memoryview(self.server.discard_buffer())
+        bucket = self.server.upload_bucket
+        while remaining:
+            count = self.rfile.readinto(buffer[:min(remaining, len(buffer))])
+            if not count:
+                break
+            if bucket is not None:
+                bucket.consume(count)
+            received += count
+            remaining -= count
+        self._send_body(f'size={received}'.encode())
+
+
+class SpeedtestServer(ThreadingHTTPServer):
+    """Threaded speedtest-protocol server; see the module docstring.
+
+    ``download_mbps`` / ``upload_mbps`` cap the aggregate rate in each
+    direction, ``latency_ms`` delays every response and ``test_length``
+    is the transfer duration (seconds) advertised to clients.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), download_mbps=None, upload_mbps=None,
+                 latency_ms=0, test_length=10, server_id=1, verbose=False):
+        self._payload_dir = None  # server_close() runs if binding fails
+        super().__init__(address, SpeedtestRequestHandler)
+        self.download_bucket = TokenBucket(download_mbps) if download_mbps else None
+        self.upload_bucket = TokenBucket(upload_mbps) if upload_mbps else None
+        self.latency_ms = latency_ms
+        self.test_length = test_length
+        self.server_id = server_id
+        self.verbose = verbose
+        self._local = threading.local()
+        self._payload_dir = tempfile.mkdtemp(prefix='speedtest-payload-')
+        self.payload_path = os.path.join(self._payload_dir, 'random.bin')
+        with open(self.payload_path, 'wb') as f:
+            # Incompressible, so nothing on the path can shrink the transfer
+            for _ in range(0, MAX_PAYLOAD, 1024 * 1024):
+                f.write(os.urandom(1024 * 1024))
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def discard_buffer(self):
+        """Per-thread scratch buffer uploads are read into and dropped."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = bytearray(CHUNK)
+        return buffer
+
+    def handle_error(self, request, client_address):
+        # Clients drop transfers mid-payload once their test length is up
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        if self._payload_dir is not None:
+            shutil.rmtree(self._payload_dir, ignore_errors=True)
+
+
+def start_local_server(host='127.0.0.1', port=0, **options):
+    """Start a ``SpeedtestServer`` on a background thread and return it."""
+    server = SpeedtestServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SpeedtestRedirect(urllib.request.BaseHandler):
+    """Sends speedtest-cli's config and server list requests to ``base_url``."""
+
+    handler_order = 100  # Before the HTTP handlers build the request
+
+    def __init__(self, base_url):
+        self.base = urlsplit(base_url)
+
+    def _rewrite(self, request):
+        parts = urlsplit(request.full_url)
+        if parts.hostname in SPEEDTEST_HOSTS:
+            request.full_url = urlunsplit(
+                (self.base.scheme, self.base.netloc, parts.path, parts.query, '')
+            )
+        return request
+
+    http_request = https_request = _rewrite
+
+
+class LocalSpeedtest(speedtest.Speedtest):
+    """``speedtest.Speedtest`` whose configuration and servers come from ``base_url``."""
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url
+        super().__init__(**kwargs)
+
+    def get_config(self):
+        # The constructor builds the opener and immediately fetches the config
+        if not any(isinstance(h, SpeedtestRedirect) for h in self._opener.handlers):
+            self._opener.add_handler(SpeedtestRedirect(self.base_url))
+        return super().get_config()
+
+
+def create_speedtest(base_url=None, **kwargs):
+    """A ``Speedtest`` against ``base_url``'s protocol server, or speedtest.net without one."""
+    if base_url:
+        return LocalSpeedtest(base_url, **kwargs)
+    return speedtest.Speedtest(**kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local speedtest-protocol server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--download-mbps', type=float, help="Cap aggregate download rate")
+    parser.add_argument('--upload-mbps', type=float, help="Cap aggregate upload rate")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Delay added to every response")
+    parser.add_argument('--test-length', type=int, default=10, help="Transfer duration advertised to clients")
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    server = SpeedtestServer((args.host, args.port), download_mbps=args.download_mbps,
+                             upload_mbps=args.upload_mbps, latency_ms=args.latency_ms,
+                             test_length=args.test_length, verbose=args.verbose)
+    print(f"Serving the speedtest protocol on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,47 @@
+"""Helpers for the app's prometheus_client metrics."""
+import threading
+import time
+from contextlib import contextmanager
+
+# Label value every server past a ``LabelLimiter``'s first ``max_values`` shares
+OVERFLOW_LABEL = 'other'
+
+# Default buckets for durations in seconds; runs past prometheus_client's 10 s top bucket
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60)
+
+
+class LabelLimiter:
+    """Maps open-ended label values (server IDs) to at most ``max_values`` distinct labels.
+
+    The first ``max_values`` values seen keep their own label; later ones
+    all become ``OVERFLOW_LABEL``, so per-server series can't grow
+    without bound.
+    """
+
+    def __init__(self, max_values=20):
+        self.max_values = max_values
+        self._values = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        value = str(value)
+        if value in self._values:
+            return value
+        with self._lock:
+            if len(self._values) < self.max_values:
+                self._values.add(value)
+                return value
+        return OVERFLOW_LABEL
+
+
+@contextmanager
+def timed(histogram):
+    """Observe the block's wall-clock seconds in ``histogram`` if it succeeds.
+
+    Unlike ``Histogram.time()``, aborted work (cancelled phases, failed
+    fetches) isn't recorded, so it can't skew the distribution towards
+    short durations.
+    """
+    start = time.perf_counter()
+    yield
+    histogram.observe(time.perf_counter() - start)
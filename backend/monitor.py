@@ -0,0 +1,168 @@
+"""Building blocks for low-overhead connection monitoring.
+
+A monitoring run sends a cheap latency probe every second or so and only
+runs full throughput tests on a schedule, or when the probes show the
+connection degrading, all within a data budget.
+"""
+from streaming_stats import WindowStats
+
+# Rough wire cost of one latency.txt probe on a kept-alive connection:
+# request and response headers plus the 10 byte body and TCP/IP overhead
+PROBE_BYTES = 600
+
+# Capped transfers stop up to a sampling interval past their cap, so full
+# tests only get this share of the spare budget
+TRANSFER_HEADROOM = 0.9
+
+
+def transfer_cap(available):
+    """Per-direction byte cap for a full test with ``available`` bytes to spend."""
+    if available is None:
+        return None
+    return int(available * TRANSFER_HEADROOM / 2)
+
+
+class DataBudget:
+    """Bytes a run may spend; a ``limit`` of ``None`` means unlimited."""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.spent = 0
+
+    def charge(self, count):
+        self.spent += count
+
+    @property
+    def remaining(self):
+        if self.limit is None:
+            return None
+        return max(0, self.limit - self.spent)
+
+    def allows(self, count):
+        return self.limit is None or self.spent + count <= self.limit
+
+    def available(self, reserve=0):
+        """Bytes left after setting ``reserve`` aside; ``None`` when unlimited."""
+        if self.limit is None:
+            return None
+        return max(0, self.limit - self.spent - reserve)
+
+    def summary(self):
+        return {
+            'limit_bytes': self.limit,
+            'spent_bytes': self.spent,
+            'remaining_bytes': self.remaining,
+            'spent_percent': round(self.spent / self.limit * 100, 2) if self.limit else None,
+        }
+
+
+class OutageTracker:
+    """Turns probe outcomes into outage intervals.
+
+    An outage starts after ``loss_threshold`` consecutive lost probes
+    (backdated to the first of them) and ends with the next answered one.
+    """
+
+    def __init__(self, loss_threshold=3):
+        self.loss_threshold = loss_threshold
+        self.outages = []
+        self.current = None
+        self._first_loss = None
+        self._losses = 0
+
+    def add(self, timestamp, reachable):
+        """Record one probe; returns 'outage_started', 'outage_ended' or None."""
+        if reachable:
+            self._losses = 0
+            self._first_loss = None
+            if self.current is not None:
+                self.current['end'] = timestamp
+                self.current['duration'] = round(timestamp - self.current['start'], 2)
+                self.outages.append(self.current)
+                self.current = None
+                return 'outage_ended'
+            return None
+        if self._losses == 0:
+            self._first_loss = timestamp
+        self._losses += 1
+        if self.current is not None:
+            self.current['lost_probes'] += 1
+        elif self._losses >= self.loss_threshold:
+            self.current = {'start': self._first_loss, 'end': None, 'duration': None,
+                            'lost_probes': self._losses}
+            return 'outage_started'
+        return None
+
+    def summary(self, now):
+        outages = list(self.outages)
+        if self.current is not None:
+            outages.append(dict(self.current, duration=round(now - self.current['start'], 2)))
+        return {
+            'count': len(outages),
+            'total_seconds': round(sum(o['duration'] for o in outages), 2),
+            'ongoing': self.current is not None,
+            'outages': outages,
+        }
+
+
+class DegradationDetector:
+    """Flags RTTs well above the connection's recent base latency.
+
+    The baseline is the minimum RTT over the last ``window`` healthy
+    probes. A probe is slow when it exceeds the baseline by
+    ``factor`` times (or by ``margin_ms``, whichever is larger); the
+    connection counts as degraded after ``consecutive`` slow probes.
+    Slow probes don't feed the baseline, so sustained bufferbloat can't
+    redefine normal.
+    """
+
+    def __init__(self, window=60, factor=2.0, margin_ms=20.0, consecutive=3, warmup=5):
+        self.baseline = WindowStats(window)
+        self.factor = factor
+        self.margin_ms = margin_ms
+        self.consecutive = consecutive
+        self.warmup = warmup
+        self._slow = 0
+
+    def threshold(self):
+        base = self.baseline.min
+        return base + max(base * (self.factor - 1), self.margin_ms)
+
+    def add(self, rtt):
+        """Record one answered probe; returns True while the connection is degraded."""
+        if self.baseline.count >= self.warmup and rtt > self.threshold():
+            self._slow += 1
+        else:
+            self._slow = 0
+            self.baseline.add(rtt)
+        return self._slow >= self.consecutive
+
+
+class FullTestSchedule:
+    """Decides when a monitoring run spends data on a full throughput test.
+
+    Tests run every ``interval`` seconds (the first one right away; ``0``
+    leaves only triggered tests) and additionally when the probes report
+    degradation or the end of an outage, but never within ``min_gap``
+    seconds of the previous test.
+    """
+
+    def __init__(self, interval=900, min_gap=60):
+        self.interval = interval
+        self.min_gap = min_gap
+        self.last = None
+
+    def due(self, now, degraded=False, recovered=False):
+        """Why a full test should run now, or None."""
+        if self.last is not None and now - self.last < self.min_gap:
+            return None
+        if self.interval and (self.last is None or now - self.last >= self.interval):
+            return 'scheduled'
+        if degraded:
+            return 'degraded'
+        if recovered:
+            return 'recovered'
+        return None
+
+    def ran(self, now):
+        self.last = now
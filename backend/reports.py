@@ -0,0 +1,288 @@
+"""PDF/DOCX report rendering, kept importable by export worker processes."""
+import io
+from datetime import datetime
+
+import numpy as np
+
+from downsample import downsample
+
+MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+def preload():
+    """Import the heavy report libraries up front (export worker initializer)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    import reportlab.platypus  # noqa: F401
+    import docx  # noqa: F401
+
+# Points per plotted series. Charts are downsampled to this budget so
+# render time and report size don't grow with the length of the run.
+CHART_POINTS = 1000
+CHART_SIZE = (7, 5.5)  # inches
+CHART_DPI = 120
+
+def stability_series(stability_data):
+    """Elapsed minutes plus ping/download/upload arrays from stability data points"""
+    count = len(stability_data)
+    elapsed = np.arange(count, dtype=float)
+    times = []
+    for point in stability_data:
+        try:
+            times.append(datetime.fromisoformat(str(point['timestamp']).replace('Z', '+00:00')).timestamp())
+        except (KeyError, TypeError, ValueError):
+            break
+    if count and len(times) == count:
+        elapsed = (np.array(times) - times[0]) / 60.0
+    series = {}
+    for metric in ('ping', 'download', 'upload'):
+        values = [point.get(metric) for point in stability_data]
+        series[metric] = np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=float)
+    return elapsed, series, len(times) == count
+
+def render_stability_chart(stability_data, points=CHART_POINTS):
+    """Throughput and latency over time as PNG bytes, or None without data"""
+    if not stability_data:
+        return None
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    elapsed, series, timed = stability_series(stability_data)
+    fig, (speed_ax, ping_ax) = plt.subplots(2, 1, figsize=CHART_SIZE, sharex=True)
+    try:
+        for metric, label, color in (('download', 'Download', '#06B6D4'), ('upload', 'Upload', '#8B5CF6')):
+            x, y = downsample(elapsed, series[metric], points)
+            speed_ax.plot(x, y, label=label, color=color, linewidth=1)
+        speed_ax.set_ylabel('Mbps')
+        speed_ax.set_title('Throughput over time')
+        speed_ax.legend(loc='upper right')
+        speed_ax.grid(alpha=0.3)
+
+        x, y = downsample(elapsed, series['ping'], points)
+        ping_ax.plot(x, y, color='#F59E0B', linewidth=1)
+        ping_ax.set_ylabel('ms')
+        ping_ax.set_title('Latency over time')
+        ping_ax.set_xlabel('Elapsed (minutes)' if timed else 'Sample')
+        ping_ax.grid(alpha=0.3)
+
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=CHART_DPI)
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+def render_report(export_format, results, stability_data):
+    """Render a report in ``export_format`` ('pdf' or 'docx') to bytes"""
+    if export_format == 'pdf':
+        return create_pdf_report(results, stability_data)
+    if export_format == 'docx':
+        return create_docx_report(results, stability_data)
+    raise ValueError(f"Invalid format: {export_format}")
+
+def create_pdf_report(results, stability_data):
+    """Create a PDF report of the speed test results and return its bytes"""
+    from reportlab.lib.pagesizes import letter, A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    
+    # Render in memory; nothing touches the disk
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = []
+    
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=colors.HexColor('#06B6D4')
+    )
+    story.append(Paragraph("Speed Test Results", title_style))
+    story.append(Spacer(1, 20))
+    
+    # Test information
+    test_info = [
+        ['Test Date:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
+        ['Test Type:', 'Stability Test' if results.get('type') == 'stability_final' else 'Quick Test'],
+    ]
+    
+    if results.get('type') == 'stability_final':
+        test_info.extend([
+            ['Duration:', f"{results.get('duration_minutes', 0)} minutes"],
+            ['Tests Completed:', str(results.get('total_tests', 0))],
+        ])
+    
+    info_table = Table(test_info, colWidths=[2*inch, 3*inch])
+    info_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('BACKGROUND', (1, 0), (1, -1), colors.beige),
+    ]))
+    story.append(info_table)
+    story.append(Spacer(1, 20))
+    
+    # Results table
+    if results.get('type') == 'stability_final':
+        # Stability test results
+        story.append(Paragraph("Connection Stability Analysis", styles['Heading2']))
+        
+        stats_data = [
+            ['Metric', 'Average', 'Minimum', 'Maximum', 'Std Dev'],
+            ['Download (Mbps)', 
+             str(results['download_stats']['avg']), 
+             str(results['download_stats']['min']), 
+             str(results['download_stats']['max']), 
+             str(results['download_stats']['std'])],
+            ['Upload (Mbps)', 
+             str(results['upload_stats']['avg']), 
+             str(results['upload_stats']['min']), 
+             str(results['upload_stats']['max']), 
+             str(results['upload_stats']['std'])],
+            ['Ping (ms)', 
+             str(results['ping_stats']['avg']), 
+             str(results['ping_stats']['min']), 
+             str(results['ping_stats']['max']), 
+             str(results['ping_stats']['std'])],
+        ]
+    else:
+        # Single test results
+        story.append(Paragraph("Speed Test Results", styles['Heading2']))
+        
+        stats_data = [
+            ['Metric', 'Value'],
+            ['Download Speed', f"{results.get('download', 0)} Mbps"],
+            ['Upload Speed', f"{results.get('upload', 0)} Mbps"],
+            ['Ping', f"{results.get('ping', 0)} ms"],
+            ['Jitter', f"{results.get('jitter', 0)} ms"],
+        ]
+    
+    results_table = Table(stats_data)
+    results_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(results_table)
+    
+    # Stability charts
+    chart = render_stability_chart(stability_data)
+    if chart:
+        story.append(Spacer(1, 20))
+        story.append(Paragraph("Stability Over Time", styles['Heading2']))
+        width = 6.5 * inch
+        story.append(Image(io.BytesIO(chart), width=width, height=width * CHART_SIZE[1] / CHART_SIZE[0]))
+    
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+def create_docx_report(results, stability_data):
+    """Create a DOCX report of the speed test results and return its bytes"""
+    from docx import Document
+    from docx.shared import Inches, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    
+    # Create document
+    doc = Document()
+    
+    # Title
+    title = doc.add_heading('Speed Test Results', 0)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    # Test information
+    doc.add_heading('Test Information', level=1)
+    info_table = doc.add_table(rows=1, cols=2)
+    info_table.style = 'Table Grid'
+    
+    # Add test info rows
+    test_info = [
+        ('Test Date:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+        ('Test Type:', 'Stability Test' if results.get('type') == 'stability_final' else 'Quick Test'),
+    ]
+    
+    if results.get('type') == 'stability_final':
+        test_info.extend([
+            ('Duration:', f"{results.get('duration_minutes', 0)} minutes"),
+            ('Tests Completed:', str(results.get('total_tests', 0))),
+        ])
+    
+    for label, value in test_info:
+        row_cells = info_table.add_row().cells
+        row_cells[0].text = label
+        row_cells[1].text = value
+    
+    # Results
+    doc.add_heading('Results', level=1)
+    results_table = doc.add_table(rows=1, cols=2 if results.get('type') != 'stability_final' else 5)
+    results_table.style = 'Table Grid'
+    
+    if results.get('type') == 'stability_final':
+        # Headers
+        hdr_cells = results_table.rows[0].cells
+        hdr_cells[0].text = 'Metric'
+        hdr_cells[1].text = 'Average'
+        hdr_cells[2].text = 'Minimum'
+        hdr_cells[3].text = 'Maximum'
+        hdr_cells[4].text = 'Std Dev'
+        
+        # Data rows
+        metrics = [
+            ('Download (Mbps)', results['download_stats']),
+            ('Upload (Mbps)', results['upload_stats']),
+            ('Ping (ms)', results['ping_stats']),
+        ]
+        
+        for metric_name, stats in metrics:
+            row_cells = results_table.add_row().cells
+            row_cells[0].text = metric_name
+            row_cells[1].text = str(stats['avg'])
+            row_cells[2].text = str(stats['min'])
+            row_cells[3].text = str(stats['max'])
+            row_cells[4].text = str(stats['std'])
+    else:
+        # Headers
+        hdr_cells = results_table.rows[0].cells
+        hdr_cells[0].text = 'Metric'
+        hdr_cells[1].text = 'Value'
+        
+        # Data rows
+        metrics = [
+            ('Download Speed', f"{results.get('download', 0)} Mbps"),
+            ('Upload Speed', f"{results.get('upload', 0)} Mbps"),
+            ('Ping', f"{results.get('ping', 0)} ms"),
+            ('Jitter', f"{results.get('jitter', 0)} ms"),
+        ]
+        
+        for metric_name, value in metrics:
+            row_cells = results_table.add_row().cells
+            row_cells[0].text = metric_name
+            row_cells[1].text = value
+    
+    # Stability charts
+    chart = render_stability_chart(stability_data)
+    if chart:
+        doc.add_heading('Stability Over Time', level=1)
+        doc.add_picture(io.BytesIO(chart), width=Inches(6.5))
+    
+    # Save to an in-memory buffer
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,258 @@
+"""Embedded SQLite time-series store for speed test results."""
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    session_id TEXT,
+    test_type TEXT,
+    server_id TEXT,
+    ping REAL,
+    jitter REAL,
+    download REAL,
+    upload REAL,
+    partial INTEGER NOT NULL DEFAULT 0,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_ts ON results (ts);
+CREATE INDEX IF NOT EXISTS idx_results_session_ts ON results (session_id, ts);
+CREATE INDEX IF NOT EXISTS idx_results_server_ts ON results (server_id, ts);
+CREATE TABLE IF NOT EXISTS ingested_sequences (
+    agent_id TEXT NOT NULL,
+    outbox_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (agent_id, outbox_id, seq)
+) WITHOUT ROWID;
+"""
+
+METRICS = ('ping', 'jitter', 'download', 'upload')
+# Most buckets one aggregated history query returns; wider ranges get wider buckets
+MAX_BUCKETS = 5000
+
+
+class ResultStore:
+    """Append-mostly result store with batched writes and bucketed queries.
+
+    ``record()`` only enqueues; a single writer thread drains the queue and
+    commits up to ``batch_size`` rows per transaction, or whatever has
+    arrived after ``flush_interval`` seconds. The database runs in WAL mode
+    so history queries never wait on the writer.
+    """
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, result, test_type='single', ts=None):
+        """Queue one result dict (as emitted in ``test_result``) for writing."""
+        server = result.get('server') or {}
+        self._queue.put((
+            ts if ts is not None else time.time(),
+            result.get('session_id'),
+            test_type,
+            str(server.get('id')) if server.get('id') is not None else None,
+            result.get('ping'),
+            result.get('jitter'),
+            result.get('download'),
+            result.get('upload'),
+            1 if result.get('partial') else 0,
+            json.dumps(result, default=str),
+        ))
+
+    def ingest(self, agent_id, rows, outbox_id=''):
+        """Store a batch of agent results, skipping ``(agent_id, outbox_id, seq)`` keys seen before.
+
+        ``rows`` are ``(seq, ts, server_id, ping, jitter, download, upload,
+        payload)`` tuples as returned by ``ingest.parse_batch``. Agent results
+        are stored with the agent ID as their session and test type 'agent'.
+        The whole batch is committed in one transaction, synchronously so
+        the caller can acknowledge it; returns ``(inserted, duplicates)``.
+        """
+        if not rows:
+            return 0, 0
+        conn = self._ingest_conn()
+        seqs = [row[0] for row in rows]
+        # Take the write lock first so concurrent retries of a batch can't both insert it
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            seen = {seq for (seq,) in conn.execute(
+                'SELECT seq FROM ingested_sequences '
+                'WHERE agent_id = ? AND outbox_id = ? AND seq BETWEEN ? AND ?',
+                (agent_id, outbox_id, min(seqs), max(seqs))
+            )}
+            fresh = [row for row in rows if row[0] not in seen]
+            conn.executemany('INSERT INTO ingested_sequences (agent_id, outbox_id, seq) VALUES (?, ?, ?)',
+                             [(agent_id, outbox_id, row[0]) for row in fresh])
+            conn.executemany(
+                'INSERT INTO results (ts, session_id, test_type, server_id, ping, '
+                'jitter, download, upload, partial, payload) '
+                "VALUES (?, ?, 'agent', ?, ?, ?, ?, ?, 0, ?)",
+                [(ts, agent_id, server_id, ping, jitter, download, upload, payload)
+                 for _, ts, server_id, ping, jitter, download, upload, payload in fresh]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return len(fresh), len(rows) - len(fresh)
+
+    def _ingest_conn(self):
+        conn = getattr(self._local, 'ingest_conn', None)
+        if conn is None:
+            # Autocommit mode; ingest() manages its own transaction
+            conn = self._local.ingest_conn = self._connect()
+            conn.isolation_level = None
+        return conn
+
+    def flush(self, timeout=None):
+        """Block until everything recorded so far has been committed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch, waiters = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break  # Commit now rather than making flush() wait out the interval
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(
+                            'INSERT INTO results (ts, session_id, test_type, server_id, ping, '
+                            'jitter, download, upload, partial, payload) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            batch
+                        )
+                except sqlite3.Error as e:
+                    print(f"Failed to store {len(batch)} results: {e}")
+            for waiter in waiters:
+                waiter.set()
+
+    def _filters(self, start, end, session_id, server_id, include_partial):
+        clauses = ['ts >= ?', 'ts < ?']
+        params = [start, end]
+        if session_id:
+            clauses.append('session_id = ?')
+            params.append(session_id)
+        if server_id:
+            clauses.append('server_id = ?')
+            params.append(str(server_id))
+        if not include_partial:
+            clauses.append('partial = 0')
+        return ' AND '.join(clauses), params
+
+    def history(self, start, end, session_id=None, server_id=None, bucket_seconds=None,
+                max_points=None, limit=1000, include_partial=False):
+        """Results between ``start`` and ``end`` (epoch seconds).
+
+        With ``bucket_seconds`` (or ``max_points``, which picks a bucket size
+        covering the range in at most that many buckets) rows are aggregated
+        in SQL into per-bucket count and min/avg/max of every metric, so the
+        response size depends on the bucket count rather than the row count.
+        Buckets are widened as needed to keep that count within
+        ``MAX_BUCKETS``. Otherwise up to ``limit`` raw rows are returned,
+        oldest first.
+        """
+        where, params = self._filters(start, end, session_id, server_id, include_partial)
+        conn = self._reader()
+        if max_points and not bucket_seconds:
+            bucket_seconds = max(1, math.ceil((end - start) / max_points))
+        if bucket_seconds:
+            # Buckets are aligned to multiples of their width, so the range can straddle one more
+            bucket_seconds = max(bucket_seconds, 1, math.ceil((end - start) / (MAX_BUCKETS - 1)))
+        if not bucket_seconds:
+            rows = conn.execute(
+                f'SELECT ts, session_id, test_type, server_id, {", ".join(METRICS)} '
+                f'FROM results WHERE {where} ORDER BY ts LIMIT ?',
+                params + [limit]
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        aggregates = ', '.join(
+            f'MIN({m}) AS {m}_min, AVG({m}) AS {m}_avg, MAX({m}) AS {m}_max' for m in METRICS
+        )
+        rows = conn.execute(
+            f'SELECT CAST(ts / ? AS INTEGER) * ? AS bucket, COUNT(*) AS count, {aggregates} '
+            f'FROM results WHERE {where} GROUP BY bucket ORDER BY bucket',
+            [bucket_seconds, bucket_seconds] + params
+        ).fetchall()
+        buckets = []
+        for row in rows:
+            bucket = {'ts': row['bucket'], 'count': row['count']}
+            for m in METRICS:
+                bucket[m] = {
+                    'min': row[f'{m}_min'],
+                    'avg': round(row[f'{m}_avg'], 2) if row[f'{m}_avg'] is not None else None,
+                    'max': row[f'{m}_max'],
+                }
+            buckets.append(bucket)
+        return buckets
+
+    def session_results(self, session_id, since=None, test_type=None, offset=0, limit=100):
+        """A page of a session's stored result payloads, oldest first.
+
+        Returns ``(results, more)``, ``more`` telling whether a later page exists.
+        """
+        clauses, params = ['session_id = ?'], [session_id]
+        if since is not None:
+            clauses.append('ts >= ?')
+            params.append(since)
+        if test_type:
+            clauses.append('test_type = ?')
+            params.append(test_type)
+        rows = self._reader().execute(
+            f'SELECT payload FROM results WHERE {" AND ".join(clauses)} '
+            'ORDER BY ts, id LIMIT ? OFFSET ?',
+            params + [limit + 1, offset]
+        ).fetchall()
+        return [json.loads(row['payload']) for row in rows[:limit]], len(rows) > limit
+
+    def latest(self, session_id):
+        """The most recent stored result payload for ``session_id``, or ``None``."""
+        row = self._reader().execute(
+            'SELECT payload FROM results WHERE session_id = ? ORDER BY ts DESC LIMIT 1',
+            (session_id,)
+        ).fetchone()
+        return json.loads(row['payload']) if row else None
@@ -0,0 +1,187 @@
+"""Bounded test scheduler with admission control."""
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class QueueFull(Exception):
+    """Raised when a test is submitted while the wait queue is full."""
+
+
+class Job:
+    """A queued or running test."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, session_id, fn, args, server_key, estimate, learn_duration=False, owned=False):
+        self.id = next(self._ids)
+        self.session_id = session_id
+        self.fn = fn
+        self.args = args
+        self.server_key = server_key
+        self.estimate = estimate
+        self.submitted_at = time.time()
+        self.started_at = None
+        # Whether this job's run time should feed the scheduler's default estimate
+        self.learn_duration = learn_duration
+        # Withdrawn by the thread waiting on it (slot()) rather than by cancel()
+        self.owned = owned
+
+    def remaining(self, now):
+        if self.started_at is None:
+            return self.estimate
+        return max(0.0, self.estimate - (now - self.started_at))
+
+
+class TestScheduler:
+    """Runs at most ``max_concurrent`` tests, ``max_per_server`` per server.
+
+    Everything else waits in a FIFO queue of at most ``max_queue`` entries.
+    A job whose server is saturated does not hold up jobs behind it that
+    target a different server. ``on_queued(session_id, position, eta)`` is
+    called for every waiting job whenever the queue moves; ``position`` is
+    1-based and ``eta`` is the estimated wait in seconds.
+    """
+
+    def __init__(self, max_concurrent=2, max_per_server=1, max_queue=20,
+                 default_estimate=30.0, on_queued=None):
+        self.max_concurrent = max_concurrent
+        self.max_per_server = max_per_server
+        self.max_queue = max_queue
+        self.on_queued = on_queued
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._running = {}  # job id -> Job
+        self._per_server = {}
+        # Exponentially weighted run time, used for jobs without an estimate
+        self._avg_duration = default_estimate
+
+    def submit(self, session_id, fn, args=(), server_id=None, estimate=None, _owned=False):
+        """Queue ``fn(*args)``; returns the job or raises ``QueueFull``."""
+        # Auto-selected tests almost always land on the same nearest server
+        server_key = str(server_id) if server_id else 'auto'
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFull(f"Test queue is full ({self.max_queue} waiting)")
+            job = Job(session_id, fn, args, server_key, estimate or self._avg_duration,
+                      learn_duration=estimate is None, owned=_owned)
+            self._queue.append(job)
+            started = self._dispatch()
+            waiting = self._positions()
+        self._notify(waiting)
+        for job_to_start in started:
+            self._start(job_to_start)
+        return job
+
+    @contextmanager
+    def slot(self, session_id, server_id=None, estimate=None, cancel_event=None):
+        """Hold a slot, in queue order with submitted jobs, for the duration of the block.
+
+        For the individual tests of a long run, which shouldn't keep a slot
+        between them. Yields ``False`` instead if ``cancel_event`` is set
+        before the slot is granted; raises ``QueueFull``.
+        """
+        granted, released = threading.Event(), threading.Event()
+
+        def hold():
+            granted.set()
+            released.wait()
+
+        job = self.submit(session_id, hold, server_id=server_id, estimate=estimate, _owned=True)
+        try:
+            while not granted.wait(0.2):
+                if cancel_event is not None and cancel_event.is_set() and self._withdraw(job):
+                    break
+            yield granted.is_set()
+        finally:
+            released.set()
+
+    def _withdraw(self, job):
+        """Drop ``job`` if it is still queued; ``True`` if it was."""
+        with self._lock:
+            if job not in self._queue:
+                return False
+            self._queue.remove(job)
+            waiting = self._positions()
+        self._notify(waiting)
+        return True
+
+    def cancel(self, session_id):
+        """Drop a still-queued job for ``session_id``; ``True`` if one was removed."""
+        with self._lock:
+            for job in self._queue:
+                if job.session_id == session_id and not job.owned:
+                    self._queue.remove(job)
+                    break
+            else:
+                return False
+            waiting = self._positions()
+        self._notify(waiting)
+        return True
+
+    def is_queued(self, session_id):
+        with self._lock:
+            return any(job.session_id == session_id for job in self._queue)
+
+    def stats(self):
+        with self._lock:
+            return {'running': len(self._running), 'queued': len(self._queue)}
+
+    def _dispatch(self):
+        """Move startable jobs from the queue to running. Caller holds the lock."""
+        started = []
+        for job in list(self._queue):
+            if len(self._running) >= self.max_concurrent:
+                break
+            if self._per_server.get(job.server_key, 0) >= self.max_per_server:
+                continue
+            self._queue.remove(job)
+            job.started_at = time.time()
+            self._running[job.id] = job
+            self._per_server[job.server_key] = self._per_server.get(job.server_key, 0) + 1
+            started.append(job)
+        return started
+
+    def _positions(self):
+        """``(session_id, position, eta)`` for every queued job. Caller holds the lock."""
+        now = time.time()
+        # Slots free up as running jobs finish; queued jobs then run in order
+        slots = sorted(job.remaining(now) for job in self._running.values())
+        slots += [0.0] * (self.max_concurrent - len(slots))
+        waiting = []
+        for position, job in enumerate(self._queue, start=1):
+            slots.sort()
+            eta = slots[0]
+            slots[0] = eta + job.estimate
+            waiting.append((job.session_id, position, round(eta, 1)))
+        return waiting
+
+    def _notify(self, waiting):
+        if self.on_queued is None:
+            return
+        for session_id, position, eta in waiting:
+            self.on_queued(session_id, position, eta)
+
+    def _start(self, job):
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        try:
+            job.fn(*job.args)
+        finally:
+            self._finish(job)
+
+    def _finish(self, job):
+        with self._lock:
+            del self._running[job.id]
+            self._per_server[job.server_key] -= 1
+            if job.learn_duration:
+                duration = time.time() - job.started_at
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+            started = self._dispatch()
+            waiting = self._positions()
+        self._notify(waiting)
+        for job_to_start in started:
+            self._start(job_to_start)
@@ -0,0 +1,13 @@
+"""Starts the backend: python server.py
+
+Export workers are spawned processes, and a spawned process re-runs the
+main script's top level before it does anything else. app.py's top level
+starts threads and opens the shared stores, so it must not be the main
+script; this one only imports it when run directly.
+"""
+
+if __name__ == '__main__':
+    from app import app, socketio
+
+    print("Starting Flask-SocketIO server...")
+    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
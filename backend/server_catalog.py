@@ -0,0 +1,191 @@
+"""Process-wide, TTL-cached speedtest.net server catalog."""
+import json
+import os
+import threading
+import time
+
+import speedtest
+
+from server_index import ServerIndex, decode_cursor, encode_cursor
+
+
+def format_server(server):
+    """Shape a raw speedtest.net server dict for the frontend."""
+    return {
+        'id': server.get('id'),
+        'name': server.get('sponsor', 'Unknown'),
+        'location': f"{server.get('name', 'Unknown')}, {server.get('country', 'Unknown')}",
+        'distance': round(server.get('d', 0), 2),
+        'country': server.get('country', 'Unknown'),
+        'cc': server.get('cc', 'XX'),
+        'url': server.get('url', '')
+    }
+
+
+def fetch_servers(create=None):
+    """Download the full server list, flattened and sorted by distance.
+
+    ``create`` builds the client (default: a secure ``speedtest.Speedtest``).
+    """
+    st = create() if create is not None else speedtest.Speedtest(secure=True)
+    servers = st.get_servers()
+    all_servers = [server for distance_key in servers for server in servers[distance_key]]
+    all_servers.sort(key=lambda x: x['d'])
+    return all_servers
+
+
+class ServerCatalog:
+    """Shared snapshot of the server list.
+
+    Readers always get the in-memory snapshot when one exists, even a stale
+    one; an expired snapshot triggers a background refresh instead of
+    blocking the caller. Only the very first load (with no on-disk snapshot
+    to warm from) waits on the network. Concurrent refreshes are collapsed
+    into a single upstream fetch.
+    """
+
+    def __init__(self, snapshot_path=None, ttl=3600, fetch=fetch_servers):
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._servers = None
+        self._formatted = None
+        self._by_id = {}
+        self._index = None
+        self._fetched_at = 0
+        self._inflight = None  # threading.Event set when the running fetch ends
+        self._last_error = None
+        self._refresher = None
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self._install(snapshot['servers'], snapshot['fetched_at'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable server catalog snapshot: {e}")
+
+    def _save_snapshot(self, servers, fetched_at):
+        if not self.snapshot_path:
+            return
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'fetched_at': fetched_at, 'servers': servers}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Could not persist server catalog snapshot: {e}")
+
+    def _install(self, servers, fetched_at):
+        # Built once per refresh so every reader shares the same objects
+        formatted = [format_server(server) for server in servers]
+        by_id = {str(server.get('id')): server for server in servers}
+        index = ServerIndex(servers)
+        with self._lock:
+            self._servers = servers
+            self._formatted = formatted
+            self._by_id = by_id
+            self._index = index
+            self._fetched_at = fetched_at
+
+    def _refresh(self, done):
+        try:
+            servers = self._fetch()
+            fetched_at = time.time()
+            self._install(servers, fetched_at)
+            self._save_snapshot(servers, fetched_at)
+            self._last_error = None
+        except Exception as e:
+            self._last_error = e
+            print(f"Server catalog refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._inflight = None
+            done.set()
+
+    def refresh(self, wait=True):
+        """Refresh from upstream, joining a fetch already in flight."""
+        with self._lock:
+            done = self._inflight
+            leader = done is None
+            if leader:
+                done = self._inflight = threading.Event()
+        if leader:
+            if wait:
+                self._refresh(done)
+            else:
+                threading.Thread(target=self._refresh, args=(done,), daemon=True).start()
+        if wait:
+            done.wait()
+
+    def is_stale(self):
+        return time.time() - self._fetched_at >= self.ttl
+
+    def _ensure_loaded(self):
+        self._start_refresher()
+        if self._servers is None:
+            self.refresh(wait=True)
+            if self._servers is None:
+                raise RuntimeError(f"Unable to load server list: {self._last_error}")
+        elif self.is_stale():
+            self.refresh(wait=False)
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            delay = self._fetched_at + self.ttl - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.refresh(wait=True)
+                if self._last_error is not None:
+                    # Back off rather than hammering a failing upstream
+                    time.sleep(min(self.ttl, 60))
+
+    def servers(self):
+        """Raw server dicts sorted by distance. Treat them as read-only."""
+        self._ensure_loaded()
+        return self._servers
+
+    def formatted(self, limit=20):
+        """Frontend-formatted servers, closest first."""
+        self._ensure_loaded()
+        return self._formatted[:limit]
+
+    def query(self, lat=None, lon=None, cc=None, sponsor=None, limit=20, cursor=None):
+        """A page of frontend-formatted servers and the cursor of the next page (or ``None``).
+
+        Servers are ordered by distance from ``lat``/``lon``, or from the
+        client when no coordinates are given, and can be filtered by
+        country code and sponsor name. Raises ``ValueError`` for a bad cursor.
+        """
+        self._ensure_loaded()
+        after = decode_cursor(cursor) if cursor else None
+        index = self._index
+        if lat is not None and lon is not None:
+            entries = index.nearest(lat, lon, limit + 1, cc, sponsor, after)
+        else:
+            entries = index.closest(limit + 1, cc, sponsor, after)
+        page = [dict(format_server(server), distance=round(km, 2)) for _, km, server in entries[:limit]]
+        next_cursor = encode_cursor(entries[limit - 1][0]) if len(entries) > limit else None
+        return page, next_cursor
+
+    def closest(self, limit=5):
+        """Copies of the closest raw servers, safe to hand to speedtest-cli."""
+        return [dict(server) for server in self.servers()[:limit]]
+
+    def get(self, server_id):
+        """Copy of the raw server with ``server_id``, or ``None``."""
+        self._ensure_loaded()
+        server = self._by_id.get(str(server_id))
+        return dict(server) if server is not None else None
@@ -0,0 +1,161 @@
+"""Nearest-neighbour and filtered queries over the server catalog."""
+import base64
+import bisect
+import heapq
+import itertools
+import json
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _unit_vector(lat, lon):
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord_squared):
+    """Great-circle distance for a squared chord length between unit vectors."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """The ``(distance key, server id)`` sort key of the last server on the previous page."""
+    try:
+        distance, server_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(distance), str(server_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def _build(points, depth=0):
+    """k-d tree node ``(x, y, z, axis, server_id, server, left, right)`` over
+    ``((x, y, z), server_id, server)`` points."""
+    if not points:
+        return None
+    axis = depth % 3
+    points.sort(key=lambda point: point[0][axis])
+    middle = len(points) // 2
+    (x, y, z), server_id, server = points[middle]
+    return (x, y, z, axis, server_id, server,
+            _build(points[:middle], depth + 1), _build(points[middle + 1:], depth + 1))
+
+
+def _key(server, field):
+    return str(server.get(field, '')).casefold()
+
+
+class ServerIndex:
+    """Immutable index over one catalog snapshot, built once per refresh.
+
+    Servers are points on the unit sphere in a k-d tree (chord length
+    orders them the same as great-circle distance, with no date-line
+    special cases), plus one tree per country code and per sponsor so a
+    filtered query doesn't wade through the rest of the world. Filters
+    match case-insensitively. Results are ordered by
+    ``(distance, server id)``; a page's cursor is that key of its last
+    server, so paging stays consistent across catalog refreshes.
+    """
+
+    def __init__(self, servers):
+        points = []
+        by_cc, by_sponsor = {}, {}
+        for server in servers:
+            try:
+                xyz = _unit_vector(float(server['lat']), float(server['lon']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            point = (xyz, str(server.get('id')), server)
+            points.append(point)
+            by_cc.setdefault(_key(server, 'cc'), []).append(point)
+            by_sponsor.setdefault(_key(server, 'sponsor'), []).append(point)
+        self.size = len(points)
+        self._tree = _build(points)
+        self._trees = {
+            'cc': {cc: (len(group), _build(group)) for cc, group in by_cc.items()},
+            'sponsor': {sponsor: (len(group), _build(group)) for sponsor, group in by_sponsor.items()},
+        }
+        # For queries from the client's own location, whose distance is ``d``
+        self._by_distance = sorted(servers, key=lambda s: (s.get('d', 0), str(s.get('id'))))
+        self._distance_keys = [(s.get('d', 0), str(s.get('id'))) for s in self._by_distance]
+
+    def _filtered_tree(self, cc, sponsor):
+        """The smallest tree covering the filters, and the filter it leaves to check."""
+        trees = [(self._trees['cc'].get(cc, (0, None)), 'sponsor', sponsor)] if cc else []
+        if sponsor:
+            trees.append((self._trees['sponsor'].get(sponsor, (0, None)), 'cc', cc))
+        if not trees:
+            return self._tree, None, None
+        (_, tree), field, value = min(trees, key=lambda entry: entry[0][0])
+        return tree, field if value else None, value
+
+    def nearest(self, lat, lon, limit=20, cc=None, sponsor=None, after=None):
+        """Up to ``limit`` ``(key, km, server)`` entries closest to ``lat``/``lon``.
+
+        ``key`` is the entry's sort key; pass the last one as ``after``
+        for the next page.
+        """
+        tree, field, value = self._filtered_tree(cc and cc.casefold(), sponsor and sponsor.casefold())
+        tx, ty, tz = target = _unit_vector(lat, lon)
+        best = []  # max-heap of (-chord², reversed id, server): the worst match on top
+        worst = math.inf  # chord² of best[0] once the heap is full
+
+        def search(node):
+            nonlocal worst
+            x, y, z, axis, server_id, server, left, right = node
+            distance = (x - tx) * (x - tx) + (y - ty) * (y - ty) + (z - tz) * (z - tz)
+            if (distance <= worst and (after is None or (distance, server_id) > after)
+                    and (field is None or _key(server, field) == value)):
+                entry = (-distance, _Reversed(server_id), server)
+                if len(best) < limit:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+                if len(best) == limit:
+                    worst = -best[0][0]
+            offset = target[axis] - (x, y, z)[axis]
+            near, far = (left, right) if offset < 0 else (right, left)
+            if near is not None:
+                search(near)
+            if far is not None and offset * offset <= worst:
+                search(far)
+
+        if limit > 0 and tree is not None:
+            search(tree)
+        ranked = sorted((((-negated, str(order)), server) for negated, order, server in best),
+                        key=lambda entry: entry[0])
+        return [(key, chord_to_km(key[0]), server) for key, server in ranked]
+
+    def closest(self, limit=20, cc=None, sponsor=None, after=None):
+        """Up to ``limit`` ``(key, km, server)`` entries closest to the client, by ``d``."""
+        cc, sponsor = cc and cc.casefold(), sponsor and sponsor.casefold()
+        start = bisect.bisect_right(self._distance_keys, after) if after else 0
+        found = []
+        for server in itertools.islice(self._by_distance, start, None):
+            if len(found) >= limit:
+                break
+            if (not cc or _key(server, 'cc') == cc) and (not sponsor or _key(server, 'sponsor') == sponsor):
+                found.append(((server.get('d', 0), str(server.get('id'))), server.get('d', 0), server))
+        return found
+
+
+class _Reversed:
+    """Sorts in reverse, so the max-heap keeps the lower id of two equidistant servers."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __str__(self):
+        return self.value
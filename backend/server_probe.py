@@ -0,0 +1,138 @@
+"""Concurrent TCP latency probing for best-server selection."""
+import socket
+import threading
+import time
+from statistics import median
+
+
+def split_host(host, default_port=8080):
+    """Split a speedtest.net ``host`` field into ``(hostname, port)``."""
+    if ':' in host:
+        hostname, port = host.rsplit(':', 1)
+        return hostname, int(port)
+    return host, default_port
+
+
+def tcp_rtt(host, port, timeout):
+    """Time one TCP handshake in milliseconds; ``None`` when it fails."""
+    start = time.perf_counter()
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except OSError:
+        return None
+    rtt = (time.perf_counter() - start) * 1000
+    sock.close()
+    return rtt
+
+
+def trimmed_mean(values, trim=0.2):
+    """Mean after dropping ``trim`` of the samples from each end."""
+    ordered = sorted(values)
+    cut = int(len(ordered) * trim)
+    kept = ordered[cut:len(ordered) - cut] or ordered
+    return sum(kept) / len(kept)
+
+
+class ServerProber:
+    """Ranks candidate servers by RTT, probing them all at once.
+
+    Each candidate gets its own thread taking up to ``samples`` TCP connect
+    timings. Probing ends at ``deadline`` seconds no matter how many servers
+    are unreachable, or sooner once one server has finished sampling and every
+    other server has failed or can no longer come within ``margin`` of the
+    leader's estimate.
+    """
+
+    def __init__(self, samples=3, deadline=0.5, sample_timeout=0.3,
+                 margin=0.25, estimator='median', probe=tcp_rtt):
+        if estimator not in ('median', 'trimmed_mean'):
+            raise ValueError(f"Unknown RTT estimator: {estimator}")
+        self.samples = samples
+        self.deadline = deadline
+        self.sample_timeout = sample_timeout
+        self.margin = margin
+        self.estimator = median if estimator == 'median' else trimmed_mean
+        self.probe = probe
+
+    def rank(self, servers, on_probe=None):
+        """Return reachable ``servers`` fastest first, with ``latency`` set.
+
+        Each returned server is annotated with ``latency`` (the RTT estimate
+        in ms) and ``latency_samples``; unreachable servers are left out.
+        ``on_probe(server, start, rtt)`` is called from the probing thread
+        after every sample (``start`` is a ``perf_counter`` time, ``rtt``
+        ``None`` for a failed one).
+        """
+        if not servers:
+            return []
+        cond = threading.Condition()
+        rtts = [[] for _ in servers]
+        finished = [False] * len(servers)
+        stop = threading.Event()
+        started = time.perf_counter()
+        ends_at = started + self.deadline
+
+        def worker(index, server):
+            try:
+                host, port = split_host(server['host'])
+            except (KeyError, ValueError):
+                host = None
+            for _ in range(self.samples if host else 0):
+                remaining = ends_at - time.perf_counter()
+                if stop.is_set() or remaining <= 0:
+                    break
+                start = time.perf_counter()
+                rtt = self.probe(host, port, min(self.sample_timeout, remaining))
+                if on_probe is not None:
+                    on_probe(server, start, rtt)
+                if rtt is None:
+                    break  # Unreachable; don't waste the deadline on retries
+                with cond:
+                    rtts[index].append(rtt)
+                    cond.notify()
+            with cond:
+                finished[index] = True
+                cond.notify()
+
+        for index, server in enumerate(servers):
+            threading.Thread(target=worker, args=(index, server), daemon=True).start()
+
+        with cond:
+            while not all(finished):
+                now = time.perf_counter()
+                if now >= ends_at:
+                    break
+                if self._clear_winner(rtts, finished, (now - started) * 1000):
+                    break
+                cond.wait(ends_at - now)
+            stop.set()
+            snapshot = [list(samples) for samples in rtts]
+
+        ranked = []
+        for server, samples in zip(servers, snapshot):
+            if samples:
+                server['latency'] = round(self.estimator(samples), 3)
+                server['latency_samples'] = [round(rtt, 3) for rtt in samples]
+                ranked.append(server)
+        ranked.sort(key=lambda server: server['latency'])
+        return ranked
+
+    def _clear_winner(self, rtts, finished, elapsed_ms):
+        done = [i for i, samples in enumerate(rtts)
+                if finished[i] and len(samples) == self.samples]
+        if not done:
+            return False
+        leader = min(done, key=lambda i: self.estimator(rtts[i]))
+        cutoff = self.estimator(rtts[leader]) * (1 + self.margin)
+        for i, samples in enumerate(rtts):
+            if i == leader:
+                continue
+            if finished[i] and not samples:
+                continue  # Dead server
+            if samples:
+                if min(samples) <= cutoff:
+                    return False
+            elif elapsed_ms <= cutoff:
+                # Its first handshake could still beat the leader
+                return False
+        return True
@@ -0,0 +1,140 @@
+"""Per-session Socket.IO delivery with coalesced high-frequency progress frames."""
+import threading
+import time
+
+# Progress frames sent several times a second; only the latest value matters
+COALESCED_TYPES = frozenset({'ping_sample', 'download_progress', 'upload_progress'})
+
+
+def session_room(session_id):
+    """Socket.IO room the clients following ``session_id`` join."""
+    return f'session:{session_id}'
+
+
+class _SessionState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_sent = 0.0
+        self.pending = {}  # frame type -> latest frame, in arrival order
+        self.merged = {}  # frame type -> frames folded into the pending one
+        self.timer = None
+        self.codec = None
+
+
+class SessionEvents:
+    """Sends a test's events to its session room instead of every client.
+
+    ``test_progress`` frames whose type is in ``COALESCED_TYPES`` go out at
+    most ``max_rate`` times a second per session. Frames arriving faster
+    replace the pending frame of their type, which then carries a
+    ``coalesced`` count, and are sent when the interval is up. Any other
+    event for the session flushes pending frames first, so clients still see
+    events in order. ``on_send(event, session_id, seconds)`` is called for
+    every frame sent, with the time the send took. A session with a codec
+    (``set_codec``) has each frame passed through ``codec.encode(event,
+    data)`` as it is sent, after coalescing.
+    """
+
+    def __init__(self, socketio, max_rate=5, on_send=None):
+        self.socketio = socketio
+        self.on_send = on_send
+        self.interval = 1.0 / max_rate if max_rate else 0.0
+        self._lock = threading.Lock()
+        self._sessions = {}  # session_id -> _SessionState
+        self.sent = 0
+        self.coalesced = 0
+
+    def _state(self, session_id):
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = self._sessions[session_id] = _SessionState()
+            return state
+
+    def _send(self, event, data, session_id, codec=None):
+        start = time.perf_counter()
+        if codec is not None:
+            data = codec.encode(event, data)
+        self.socketio.emit(event, data, to=session_room(session_id))
+        self.sent += 1
+        if self.on_send is not None:
+            self.on_send(event, session_id, time.perf_counter() - start)
+
+    def emit(self, event, data, session_id=None):
+        """Send ``event`` to the room of ``session_id`` (default: ``data['session_id']``)."""
+        session_id = session_id if session_id is not None else data['session_id']
+        if (event == 'test_progress' and self.interval
+                and data.get('type') in COALESCED_TYPES):
+            self._coalesce(self._state(session_id), data, session_id)
+            return
+        with self._lock:
+            state = self._sessions.get(session_id)
+        if state is None:
+            # Nothing can be pending, so there's no per-session state to keep
+            self._send(event, data, session_id)
+            return
+        with state.lock:
+            self._flush_locked(state, session_id)
+            self._send(event, data, session_id, state.codec)
+
+    def _coalesce(self, state, data, session_id):
+        frame_type = data['type']
+        with state.lock:
+            now = time.monotonic()
+            if not state.pending and now - state.last_sent >= self.interval:
+                state.last_sent = now
+                self._send('test_progress', data, session_id, state.codec)
+                return
+            merged = state.merged.get(frame_type, 0) + 1
+            if merged > 1:
+                self.coalesced += 1
+            state.merged[frame_type] = merged
+            state.pending.pop(frame_type, None)
+            state.pending[frame_type] = data
+            if state.timer is None:
+                delay = max(0.0, state.last_sent + self.interval - now)
+                state.timer = threading.Timer(delay, self.flush, args=(session_id,))
+                state.timer.daemon = True
+                state.timer.start()
+
+    def _flush_locked(self, state, session_id):
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        if not state.pending:
+            return
+        for frame_type, data in state.pending.items():
+            merged = state.merged.get(frame_type, 1)
+            self._send('test_progress', dict(data, coalesced=merged) if merged > 1 else data,
+                       session_id, state.codec)
+        state.pending = {}
+        state.merged = {}
+        state.last_sent = time.monotonic()
+
+    def set_codec(self, session_id, codec):
+        """Encode the session's frames with ``codec`` until it is closed (``None``: plain JSON)."""
+        state = self._state(session_id)
+        with state.lock:
+            state.codec = codec
+
+    def flush(self, session_id):
+        """Send any pending progress frames for ``session_id`` now."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+        if state is None:
+            return
+        with state.lock:
+            self._flush_locked(state, session_id)
+
+    def close(self, session_id):
+        """Flush and forget a session whose test has ended."""
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+        if state is not None:
+            with state.lock:
+                self._flush_locked(state, session_id)
+
+    def stats(self):
+        with self._lock:
+            sessions = len(self._sessions)
+        return {'sessions': sessions, 'sent': self.sent, 'coalesced': self.coalesced}
@@ -0,0 +1,130 @@
+"""Warm speedtest-cli sessions reused across tests against the same server."""
+import copy
+import threading
+import time
+
+import speedtest
+
+from latency import LatencySampler, latency_url
+
+
+class WarmSession:
+    """A configured ``Speedtest`` with its selected server.
+
+    Holds what is expensive to rebuild for every test: the client
+    configuration, the chosen server (and its selection ping) and a
+    kept-alive connection for latency sampling.
+    """
+
+    def __init__(self, key, st, server):
+        self.key = key
+        self.st = st
+        self.server = server
+        self.sampler = LatencySampler(latency_url(server['url']), keep_alive=True)
+        self.created = time.monotonic()
+        self.uses = 0
+        # Tests mutate config (stop_transfers zeroes the transfer lengths),
+        # so every reuse starts from this pristine copy
+        self._config = copy.deepcopy(st.config)
+        self._best_server = st.results.server
+        self._best_ping = st.results.ping
+
+    def age(self, now=None):
+        return (now if now is not None else time.monotonic()) - self.created
+
+    def rebind(self, shutdown_event):
+        """Reset per-test state and bind the session to a new test's shutdown event."""
+        st = self.st
+        st._shutdown_event = shutdown_event
+        st.config = copy.deepcopy(self._config)
+        st.results = speedtest.SpeedtestResults(
+            ping=self._best_ping,
+            server=self._best_server,
+            client=st.config['client'],
+            opener=st._opener,
+            secure=st._secure,
+        )
+        self.uses += 1
+
+    def revalidate(self):
+        """Cheap liveness check: one latency round trip, retried once on a fresh connection."""
+        # The server may have dropped the idle keep-alive connection, which
+        # says nothing about the server itself
+        return self.sampler.probe() is not None or self.sampler.probe() is not None
+
+    def close(self):
+        self.sampler.close()
+
+
+class SessionPool:
+    """Idle warm sessions keyed by server preference (a server id or 'auto').
+
+    A session is leased to one test at a time: ``acquire`` hands out an idle
+    session, ``release`` returns it after a successful test and ``discard``
+    drops it after a failure or cancellation. Sessions older than ``ttl``
+    seconds are dropped, so the client config and best-server choice are
+    still refreshed periodically; at most ``max_idle`` are kept per key.
+    """
+
+    def __init__(self, ttl=600, max_idle=2):
+        self.ttl = ttl
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> [WarmSession], most recently released last
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def acquire(self, key, shutdown_event):
+        """A revalidated session for ``key`` bound to ``shutdown_event``, or ``None``."""
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                session = idle.pop() if idle else None
+                if session is None:
+                    self.misses += 1
+                    return None
+            if session.age() >= self.ttl or not session.revalidate():
+                self._drop(session)
+                continue
+            session.rebind(shutdown_event)
+            with self._lock:
+                self.hits += 1
+            return session
+
+    def release(self, session):
+        """Return a session whose test completed normally."""
+        if session.age() >= self.ttl:
+            self._drop(session)
+            return
+        with self._lock:
+            idle = self._idle.setdefault(session.key, [])
+            if len(idle) < self.max_idle:
+                idle.append(session)
+                return
+        session.close()
+
+    def discard(self, session):
+        """Drop a session whose test failed or was cancelled."""
+        self._drop(session)
+
+    def _drop(self, session):
+        session.close()
+        with self._lock:
+            self.invalidated += 1
+
+    def clear(self):
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle = {}
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidated': self.invalidated,
+            }
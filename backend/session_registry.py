@@ -0,0 +1,357 @@
+"""Which worker owns each session's test, shared across worker processes.
+
+Every worker process keeps its running tests' ``CancelToken`` objects
+locally and records ownership here. A ``stop_test`` that reaches a worker
+other than the owner becomes a cancel request, which the owner picks up
+with ``poll_cancels``. Workers ``heartbeat`` regularly; tests whose
+worker stopped heartbeating for ``ttl`` seconds count as gone.
+
+Backends: ``MemoryRegistry`` (one process), ``SqliteRegistry`` (processes
+sharing a file on one host) and ``RedisRegistry`` (any number of hosts).
+``create_registry`` picks one from a URL.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def worker_id():
+    """Identifier for this worker process, unique across hosts and restarts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class MemoryRegistry:
+    """Registry for a single worker process."""
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tests = {}  # session_id -> test record
+        self._cancels = {}  # worker_id -> [(session_id, test_id, reason)]
+        self._heartbeats = {}  # worker_id -> last heartbeat
+
+    def _alive(self, worker, now):
+        return now - self._heartbeats.get(worker, now) < self.ttl
+
+    def claim(self, session_id, test_id, worker, test_type):
+        """Record ``worker`` as running ``test_id`` for ``session_id``."""
+        with self._lock:
+            self._heartbeats.setdefault(worker, time.time())
+            self._tests[session_id] = {'test_id': test_id, 'worker_id': worker,
+                                       'test_type': test_type, 'started_at': time.time()}
+
+    def release(self, session_id, test_id):
+        """Drop the session's record if it still belongs to ``test_id``."""
+        with self._lock:
+            record = self._tests.get(session_id)
+            if record is not None and record['test_id'] == test_id:
+                del self._tests[session_id]
+
+    def owner(self, session_id):
+        """The session's live test record, or ``None``."""
+        with self._lock:
+            record = self._tests.get(session_id)
+            if record is None or not self._alive(record['worker_id'], time.time()):
+                return None
+            return dict(record)
+
+    def request_cancel(self, session_id, reason='stopped'):
+        """Ask the owning worker to cancel the session's test; ``True`` if there is one."""
+        with self._lock:
+            record = self._tests.get(session_id)
+            if record is None or not self._alive(record['worker_id'], time.time()):
+                return False
+            self._cancels.setdefault(record['worker_id'], []).append(
+                (session_id, record['test_id'], reason))
+            return True
+
+    def poll_cancels(self, worker):
+        """Take the pending ``(session_id, test_id, reason)`` requests for ``worker``."""
+        with self._lock:
+            return self._cancels.pop(worker, [])
+
+    def heartbeat(self, worker):
+        now = time.time()
+        with self._lock:
+            self._heartbeats[worker] = now
+            stale = {w for w in self._heartbeats if not self._alive(w, now)}
+            for w in stale:
+                del self._heartbeats[w]
+                self._cancels.pop(w, None)
+            for session_id in [s for s, r in self._tests.items() if r['worker_id'] in stale]:
+                del self._tests[session_id]
+
+    def count(self):
+        """Live tests across all workers."""
+        now = time.time()
+        with self._lock:
+            return sum(1 for r in self._tests.values() if self._alive(r['worker_id'], now))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tests (
+    session_id TEXT PRIMARY KEY,
+    test_id TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    test_type TEXT,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cancels (
+    test_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cancels_worker ON cancels (worker_id);
+"""
+
+
+class SqliteRegistry:
+    """Registry in a SQLite file shared by the worker processes of one host."""
+
+    def __init__(self, path, ttl=30):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SQLITE_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit; multi-statement updates open their own transaction
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return conn
+
+    def _live_record(self, conn, session_id):
+        return conn.execute(
+            'SELECT t.test_id, t.worker_id, t.test_type, t.started_at FROM tests t '
+            'JOIN workers w ON w.worker_id = t.worker_id '
+            'WHERE t.session_id = ? AND w.heartbeat > ?',
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+
+    def claim(self, session_id, test_id, worker, test_type):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR IGNORE INTO workers VALUES (?, ?)', (worker, now))
+            conn.execute('INSERT OR REPLACE INTO tests VALUES (?, ?, ?, ?, ?)',
+                         (session_id, test_id, worker, test_type, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release(self, session_id, test_id):
+        conn = self._conn()
+        conn.execute('DELETE FROM tests WHERE session_id = ? AND test_id = ?', (session_id, test_id))
+        conn.execute('DELETE FROM cancels WHERE test_id = ?', (test_id,))
+
+    def owner(self, session_id):
+        row = self._live_record(self._conn(), session_id)
+        if row is None:
+            return None
+        return dict(zip(('test_id', 'worker_id', 'test_type', 'started_at'), row))
+
+    def request_cancel(self, session_id, reason='stopped'):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._live_record(conn, session_id)
+            if row is not None:
+                conn.execute('INSERT OR REPLACE INTO cancels VALUES (?, ?, ?, ?)',
+                             (row[0], session_id, row[1], reason))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return row is not None
+
+    def poll_cancels(self, worker):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT session_id, test_id, reason FROM cancels WHERE worker_id = ?',
+                                (worker,)).fetchall()
+            if rows:
+                conn.execute('DELETE FROM cancels WHERE worker_id = ?', (worker,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def heartbeat(self, worker):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR REPLACE INTO workers VALUES (?, ?)', (worker, now))
+            stale = 'SELECT worker_id FROM workers WHERE heartbeat <= ?'
+            conn.execute(f'DELETE FROM tests WHERE worker_id IN ({stale})', (now - self.ttl,))
+            conn.execute(f'DELETE FROM cancels WHERE worker_id IN ({stale})', (now - self.ttl,))
+            conn.execute('DELETE FROM workers WHERE heartbeat <= ?', (now - self.ttl,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def count(self):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM tests t JOIN workers w ON w.worker_id = t.worker_id '
+            'WHERE w.heartbeat > ?', (time.time() - self.ttl,)
+        ).fetchone()[0]
+
+
+class RedisRegistry:
+    """Registry on a Redis server, for workers spread over several hosts.
+
+    ``client`` is a redis-py style client: ``redis.Redis``, or any
+    Redis-compatible stand-in with the same API (e.g. a fakeredis client
+    in development). Worker liveness is a key that expires after ``ttl``
+    seconds unless refreshed by ``heartbeat``. So do the worker's test
+    records, so a crashed worker's tests disappear on their own.
+    """
+
+    def __init__(self, client, ttl=30, prefix='speedtest:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._sessions = f'{prefix}sessions'
+
+    def _test_key(self, session_id):
+        return f'{self.prefix}test:{session_id}'
+
+    def _worker_key(self, worker):
+        return f'{self.prefix}worker:{worker}'
+
+    def _cancel_key(self, worker):
+        return f'{self.prefix}cancels:{worker}'
+
+    def _worker_tests_key(self, worker):
+        return f'{self.prefix}worker_tests:{worker}'
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def _record(self, session_id):
+        raw = self.client.hgetall(self._test_key(session_id))
+        if not raw:
+            return None
+        record = {self._text(k): self._text(v) for k, v in raw.items()}
+        if not self.client.exists(self._worker_key(record['worker_id'])):
+            return None
+        record['started_at'] = float(record['started_at'])
+        return record
+
+    def claim(self, session_id, test_id, worker, test_type):
+        key = self._test_key(session_id)
+        worker_tests = self._worker_tests_key(worker)
+        pipe = self.client.pipeline()
+        pipe.set(self._worker_key(worker), time.time(), ex=self.ttl, nx=True)
+        pipe.hset(key, mapping={
+            'test_id': test_id, 'worker_id': worker,
+            'test_type': test_type, 'started_at': time.time(),
+        })
+        pipe.expire(key, self.ttl)
+        pipe.sadd(self._sessions, session_id)
+        pipe.sadd(worker_tests, session_id)
+        pipe.expire(worker_tests, self.ttl)
+        pipe.execute()
+
+    def release(self, session_id, test_id):
+        key = self._test_key(session_id)
+
+        def delete_if_ours(pipe):
+            current, worker = (self._text(v) for v in pipe.hmget(key, 'test_id', 'worker_id'))
+            pipe.multi()
+            if current == test_id:
+                pipe.delete(key)
+                pipe.srem(self._sessions, session_id)
+                pipe.srem(self._worker_tests_key(worker), session_id)
+
+        # WATCH/MULTI, so a claim by a newer test in between isn't deleted
+        self.client.transaction(delete_if_ours, key)
+
+    def owner(self, session_id):
+        return self._record(session_id)
+
+    def request_cancel(self, session_id, reason='stopped'):
+        record = self._record(session_id)
+        if record is None:
+            return False
+        cancel_key = self._cancel_key(record['worker_id'])
+        self.client.rpush(cancel_key, json.dumps([session_id, record['test_id'], reason]))
+        self.client.expire(cancel_key, self.ttl)
+        return True
+
+    def poll_cancels(self, worker):
+        requests = []
+        while True:
+            raw = self.client.lpop(self._cancel_key(worker))
+            if raw is None:
+                return requests
+            requests.append(tuple(json.loads(raw)))
+
+    def heartbeat(self, worker):
+        self.client.set(self._worker_key(worker), time.time(), ex=self.ttl)
+        worker_tests = self._worker_tests_key(worker)
+        sessions = [self._text(s) for s in self.client.smembers(worker_tests)]
+        if not sessions:
+            return
+        pipe = self.client.pipeline()
+        for session_id in sessions:
+            pipe.hget(self._test_key(session_id), 'worker_id')
+        owners = [self._text(owner) for owner in pipe.execute()]
+        pipe = self.client.pipeline()
+        for session_id, owner in zip(sessions, owners):
+            if owner == worker:
+                pipe.expire(self._test_key(session_id), self.ttl)
+            else:
+                # Released, expired or claimed since by another worker's test
+                pipe.srem(worker_tests, session_id)
+        pipe.expire(worker_tests, self.ttl)
+        pipe.execute()
+
+    def _live_sessions(self):
+        sessions = [self._text(s) for s in self.client.smembers(self._sessions)]
+        live = 0
+        for session_id in sessions:
+            if self._record(session_id) is not None:
+                live += 1
+            elif not self.client.exists(self._test_key(session_id)):
+                # Released without the set being updated; tidy up
+                self.client.srem(self._sessions, session_id)
+        return live
+
+    def count(self):
+        return self._live_sessions()
+
+
+def create_registry(url=None, ttl=30):
+    """Registry for ``url``: ``memory://`` (default), ``sqlite:///path/to/file.db``
+    or ``redis://host:port/db``."""
+    url = url or 'memory://'
+    if url.startswith('memory://'):
+        return MemoryRegistry(ttl)
+    if url.startswith('sqlite:///'):
+        return SqliteRegistry(url[len('sqlite:///'):], ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('A redis:// session registry needs the redis package')
+        return RedisRegistry(redis.Redis.from_url(url), ttl)
+    raise ValueError(f"Unknown session registry URL: {url}")
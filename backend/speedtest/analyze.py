@@ -0,0 +1,371 @@
+"""Analyze internet_log histories in bounded memory.
+
+Reads CSV logs (plain or gzipped rotations) and binary ``.bin`` logs written
+by speed.py in fixed-size chunks, parsing each chunk into NumPy arrays, and
+reports uptime, outage intervals, per-hour-of-day and per-day percentiles,
+and throughput distributions.
+
+    python analyze.py internet_log.csv internet_log-*.csv.gz --json
+
+Files may be given in any order: they are read oldest first, by their first
+timestamp, since outage detection needs rows in time order. Each file is
+expected to be in time order itself, as speed.py appends to it.
+"""
+import argparse
+import gzip
+import json
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+from result_log import BINARY_MAGIC
+
+# Binary record layout, matching result_log.BINARY_RECORD ("<dfffB")
+BINARY_DTYPE = np.dtype([('ts', '<f8'), ('ping', '<f4'), ('download', '<f4'),
+                         ('upload', '<f4'), ('status', 'u1')])
+
+# Offsets of the digit pairs in "YYYY-MM-DD HH:MM:SS" after the year
+TIMESTAMP_LENGTH = 19
+_TS_FIELDS = ((5, 2), (8, 2), (11, 2), (14, 2), (17, 2))
+# Widest numeric field accepted, e.g. "12345678.99"
+MAX_FIELD_WIDTH = 12
+
+METRICS = ('ping', 'download', 'upload')
+# Log-spaced histogram bins (~1.6% wide) from 0.01 to 100,000 ms/Mbps
+BIN_EDGES = np.logspace(-2, 5, 1025)
+
+
+def days_from_civil(y, m, d):
+    """Vectorized days since 1970-01-01 for proleptic Gregorian dates."""
+    y = y - (m <= 2)
+    era = np.floor_divide(y, 400)
+    yoe = y - era * 400
+    mp = (m + 9) % 12
+    doy = (153 * mp + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _digits(buf, positions, width):
+    """Integer value of ``width`` ASCII digits at each position; -1 if not digits."""
+    chars = buf[positions[:, None] + np.arange(width)].astype(np.int64) - 48
+    valid = ((chars >= 0) & (chars <= 9)).all(axis=1)
+    value = chars @ (10 ** np.arange(width - 1, -1, -1))
+    return np.where(valid, value, -1)
+
+
+def _decimals(buf, starts, ends):
+    """Parse the ``buf[start:end]`` decimal fields; NaN for "N/A".
+
+    Walks the fields right to left one character column at a time, so the
+    cost is a few array operations per column of the widest field rather
+    than any per-row work. Returns ``(values, valid)``.
+    """
+    lengths = ends - starts
+    width = min(int(lengths.max(initial=0)), MAX_FIELD_WIDTH)
+    value = np.zeros(lengths.size, dtype=np.int64)
+    scale = np.ones(lengths.size, dtype=np.int64)
+    decimals = np.zeros(lengths.size, dtype=np.int64)
+    dots = np.zeros(lengths.size, dtype=np.int64)
+    junk = np.zeros(lengths.size, dtype=bool)
+    for k in range(width):
+        active = lengths > k
+        chars = buf[np.where(active, ends - 1 - k, 0)]
+        digit = chars.astype(np.int64) - 48
+        is_digit = active & (digit >= 0) & (digit <= 9)
+        is_dot = active & (chars == 46)
+        value += np.where(is_digit, digit * scale, 0)
+        scale = np.where(is_digit, scale * 10, scale)
+        # Everything right of the dot has been digits, so k of them
+        decimals = np.where(is_dot, k, decimals)
+        dots += is_dot
+        junk |= active & ~is_digit & ~is_dot
+
+    not_available = (lengths == 3) & (buf[starts] == ord('N'))
+    valid = (lengths > 0) & (lengths <= MAX_FIELD_WIDTH) & ~junk & (dots <= 1)
+    values = np.where(not_available, np.nan, value / 10.0 ** decimals)
+    return values, valid | not_available
+
+
+def parse_csv_chunk(chunk):
+    """Parse complete CSV lines into ``(ts, ping, download, upload, status)`` arrays.
+
+    The whole chunk is handled as one uint8 array: line and comma offsets
+    come from ``flatnonzero`` and every field is decoded with vectorized
+    digit arithmetic, so there is no per-row Python work. Header and
+    malformed lines are dropped; the count is returned last. Timestamps are
+    naive local wall-clock seconds, which is what the log records and what
+    hour-of-day grouping wants.
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    if not newlines.size or newlines[-1] != buf.size - 1:
+        newlines = np.append(newlines, buf.size)
+    line_starts = np.concatenate(([0], newlines[:-1] + 1))
+    line_ends = newlines.copy()
+    # Tolerate csv-module "\r\n" line endings
+    has_cr = (line_ends > line_starts) & (buf[np.maximum(line_ends - 1, 0)] == ord('\r'))
+    line_ends[has_cr] -= 1
+
+    commas = np.flatnonzero(buf == ord(','))
+    first_comma = np.searchsorted(commas, line_starts)
+    comma_count = np.searchsorted(commas, line_ends) - first_comma
+    good = (comma_count == 4) & (line_ends - line_starts > TIMESTAMP_LENGTH + 8)
+    starts = line_starts[good]
+    ends = line_ends[good]
+    fields = commas[first_comma[good][:, None] + np.arange(4)]
+    good_ts = fields[:, 0] - starts == TIMESTAMP_LENGTH
+
+    year = _digits(buf, starts, 4)
+    month, day, hour, minute, second = (_digits(buf, starts + offset, width)
+                                        for offset, width in _TS_FIELDS)
+    days = days_from_civil(year, month, day)
+    ts = (days * 86400 + hour * 3600 + minute * 60 + second).astype(np.float64)
+    good_ts &= (year > 0) & (month >= 1) & (month <= 12) & (day >= 1) & (hour >= 0)
+    good_ts &= (minute >= 0) & (second >= 0)
+
+    ping, ok_ping = _decimals(buf, fields[:, 0] + 1, fields[:, 1])
+    download, ok_download = _decimals(buf, fields[:, 1] + 1, fields[:, 2])
+    upload, ok_upload = _decimals(buf, fields[:, 2] + 1, fields[:, 3])
+    status_char = buf[np.minimum(fields[:, 3] + 1, buf.size - 1)]
+    ok_status = (status_char == ord('C')) | (status_char == ord('D'))
+
+    keep = good_ts & ok_ping & ok_download & ok_upload & ok_status
+    blank = line_ends == line_starts
+    header = ~blank & (buf[np.minimum(line_starts, buf.size - 1)] == ord('T'))
+    skipped = int(line_starts.size - blank.sum() - header.sum() - keep.sum())
+    return (ts[keep], ping[keep], download[keep], upload[keep],
+            (status_char[keep] == ord('C')).astype(np.uint8), skipped)
+
+
+def iter_csv(path, chunk_bytes):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        remainder = b''
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b'\n')
+            if cut < 0:
+                remainder = block
+                continue
+            remainder = block[cut + 1:]
+            yield parse_csv_chunk(block[:cut + 1])
+        if remainder.strip():
+            yield parse_csv_chunk(remainder)
+
+
+def iter_binary(path, chunk_bytes):
+    records = np.memmap(path, dtype=BINARY_DTYPE, mode='r', offset=len(BINARY_MAGIC))
+    step = max(1, chunk_bytes // BINARY_DTYPE.itemsize)
+    # Binary timestamps are UTC epoch seconds; shift to local wall-clock
+    # time so hours and days line up with the CSV logs
+    offset = datetime.now().astimezone().utcoffset().total_seconds()
+    for start in range(0, len(records), step):
+        block = records[start:start + step]
+        yield (block['ts'] + offset, block['ping'].astype(np.float64),
+               block['download'].astype(np.float64), block['upload'].astype(np.float64),
+               block['status'].copy(), 0)
+
+
+def iter_log(path, chunk_bytes):
+    stripped = path[:-3] if path.endswith('.gz') else path
+    if stripped.endswith('.bin'):
+        if path.endswith('.gz'):
+            raise ValueError(f"Decompress {path} before analyzing it")
+        return iter_binary(path, chunk_bytes)
+    return iter_csv(path, chunk_bytes)
+
+
+def first_timestamp(path, chunk_bytes=64 * 1024):
+    """Timestamp of the log's first row, reading only as far as that row; ``-inf`` if empty."""
+    chunks = iter_log(path, chunk_bytes)
+    try:
+        for ts, *_ in chunks:
+            if ts.size:
+                return float(ts[0])
+    finally:
+        chunks.close()
+    return float('-inf')
+
+
+class LogAnalysis:
+    """Chunk-at-a-time accumulator; memory depends on days covered, not rows."""
+
+    def __init__(self, max_outages=1000):
+        self.rows = 0
+        self.skipped = 0
+        self.connected = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.hourly = {m: np.zeros((24, len(BIN_EDGES) - 1), dtype=np.int64) for m in METRICS}
+        self.daily = {m: {} for m in METRICS}
+        self.overall = {m: np.zeros(len(BIN_EDGES) - 1, dtype=np.int64) for m in METRICS}
+        self.outage_count = 0
+        self.outage_seconds = 0.0
+        self.longest_outage = None
+        self.outages = deque(maxlen=max_outages)
+        self._outage_start = None
+        self._last_down_ts = None
+
+    def add(self, ts, ping, download, upload, status, skipped=0):
+        self.skipped += skipped
+        n = ts.size
+        if not n:
+            return
+        if (np.diff(ts) < 0).any():
+            order = np.argsort(ts, kind='stable')
+            ts, ping, download, upload, status = (
+                ts[order], ping[order], download[order], upload[order], status[order])
+        self.rows += n
+        self.connected += int(status.sum())
+        self.first_ts = ts[0] if self.first_ts is None else min(self.first_ts, ts[0])
+        self.last_ts = ts[-1] if self.last_ts is None else max(self.last_ts, ts[-1])
+
+        hours = ((ts // 3600) % 24).astype(np.int64)
+        days = (ts // 86400).astype(np.int64)
+        for name, values in zip(METRICS, (ping, download, upload)):
+            valid = np.isfinite(values) & (values > 0) & (status == 1)
+            bins = np.clip(np.searchsorted(BIN_EDGES, values[valid], side='right') - 1,
+                           0, len(BIN_EDGES) - 2)
+            nbins = len(BIN_EDGES) - 1
+            self.hourly[name] += np.bincount(hours[valid] * nbins + bins,
+                                             minlength=24 * nbins).reshape(24, nbins)
+            self.overall[name] += np.bincount(bins, minlength=nbins)
+            unique_days, day_index = np.unique(days[valid], return_inverse=True)
+            per_day = np.bincount(day_index * nbins + bins,
+                                  minlength=unique_days.size * nbins).reshape(-1, nbins)
+            for day, hist in zip(unique_days.tolist(), per_day):
+                if day in self.daily[name]:
+                    self.daily[name][day] += hist
+                else:
+                    self.daily[name][day] = hist
+
+        self._add_outages(ts, status)
+
+    def _add_outages(self, ts, status):
+        down = status == 0
+        # Transitions relative to the state carried over from the last chunk
+        previous = np.concatenate(([self._outage_start is not None], down[:-1]))
+        starts = np.flatnonzero(down & ~previous)
+        ends = np.flatnonzero(~down & previous)
+        start_times = list(ts[starts])
+        if self._outage_start is not None:
+            start_times.insert(0, self._outage_start)
+        for start, end in zip(start_times, ts[ends]):
+            self._close_outage(start, end)
+        self._outage_start = start_times[-1] if len(start_times) > len(ends) else None
+        if down.any():
+            self._last_down_ts = ts[np.flatnonzero(down)[-1]]
+
+    def _close_outage(self, start, end):
+        duration = float(end - start)
+        self.outage_count += 1
+        self.outage_seconds += duration
+        outage = {'start': _fmt_ts(start), 'end': _fmt_ts(end), 'seconds': round(duration, 1)}
+        if self.longest_outage is None or duration > self.longest_outage['seconds']:
+            self.longest_outage = outage
+        self.outages.append(outage)
+
+    def finish(self):
+        if self._outage_start is not None:
+            # Still down at the end of the log
+            self._close_outage(self._outage_start, self._last_down_ts)
+            self._outage_start = None
+
+    def report(self):
+        self.finish()
+        report = {
+            'rows': self.rows,
+            'skipped_lines': self.skipped,
+            'first': _fmt_ts(self.first_ts) if self.first_ts is not None else None,
+            'last': _fmt_ts(self.last_ts) if self.last_ts is not None else None,
+            'uptime_percent': round(self.connected / self.rows * 100, 3) if self.rows else None,
+            'outages': {
+                'count': self.outage_count,
+                'total_seconds': round(self.outage_seconds, 1),
+                'longest': self.longest_outage,
+                'recent': list(self.outages),
+            },
+            'distribution': {m: histogram_summary(self.overall[m]) for m in METRICS},
+            'by_hour': {
+                m: {f"{h:02d}": histogram_summary(self.hourly[m][h])
+                    for h in range(24) if self.hourly[m][h].any()}
+                for m in METRICS
+            },
+            'by_day': {
+                m: {datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d'):
+                    histogram_summary(hist)
+                    for day, hist in sorted(self.daily[m].items())}
+                for m in METRICS
+            },
+        }
+        return report
+
+
+def _fmt_ts(ts):
+    return datetime.fromtimestamp(float(ts), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def histogram_summary(hist, percentiles=(5, 50, 95, 99)):
+    """Count and percentiles (bin geometric midpoints) of a BIN_EDGES histogram."""
+    total = int(hist.sum())
+    if not total:
+        return {'count': 0}
+    cumulative = np.cumsum(hist)
+    mids = np.sqrt(BIN_EDGES[:-1] * BIN_EDGES[1:])
+    summary = {'count': total}
+    for p in percentiles:
+        index = int(np.searchsorted(cumulative, total * p / 100, side='left'))
+        summary[f'p{p}'] = round(float(mids[min(index, len(mids) - 1)]), 2)
+    summary['mean'] = round(float((hist * mids).sum() / total), 2)
+    return summary
+
+
+def analyze(paths, chunk_bytes=16 * 1024 * 1024):
+    analysis = LogAnalysis()
+    # Rotated logs don't overlap, so oldest-first file order is chronological
+    for path in sorted(paths, key=first_timestamp):
+        for chunk in iter_log(path, chunk_bytes):
+            analysis.add(*chunk)
+    return analysis.report()
+
+
+def print_report(report):
+    print(f"📄 Rows analyzed    : {report['rows']} ({report['skipped_lines']} malformed lines skipped)")
+    print(f"🕒 Period           : {report['first']} → {report['last']}")
+    print(f"✅ Uptime           : {report['uptime_percent']}%")
+    outages = report['outages']
+    print(f"❌ Outages          : {outages['count']} ({outages['total_seconds']} s total)")
+    if outages['longest']:
+        longest = outages['longest']
+        print(f"   Longest          : {longest['seconds']} s from {longest['start']}")
+    print("\n📊 Distribution (p5 / p50 / p95 / p99):")
+    for metric, summary in report['distribution'].items():
+        if summary['count']:
+            print(f"   {metric:<9}: {summary['p5']} / {summary['p50']} / "
+                  f"{summary['p95']} / {summary['p99']}")
+    print("\n🕐 Median download by hour:")
+    for hour, summary in report['by_hour']['download'].items():
+        print(f"   {hour}:00  {summary['p50']:>10} Mbps  (p5 {summary['p5']}, n={summary['count']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze internet_log histories")
+    parser.add_argument('paths', nargs='+', help="CSV (optionally .gz) or .bin logs")
+    parser.add_argument('--json', action='store_true', help="Print the full report as JSON")
+    parser.add_argument('--chunk-mb', type=int, default=16, help="Read size per chunk")
+    args = parser.parse_args()
+
+    report = analyze(args.paths, chunk_bytes=args.chunk_mb * 1024 * 1024)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
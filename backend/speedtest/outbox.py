@@ -0,0 +1,167 @@
+"""Durable outbox and batched uploads for speed.py's agent mode."""
+import gzip
+import json
+import socket
+import sqlite3
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class Outbox:
+    """Results waiting to be uploaded, kept in SQLite so they survive restarts.
+
+    Every result gets the next sequence number, which is never reused
+    (``AUTOINCREMENT``), so the backend can deduplicate re-sent batches by
+    ``(agent_id, outbox_id, seq)``. ``outbox_id`` is generated once per
+    outbox file, so a recreated outbox whose sequence starts over at 1
+    isn't mistaken for re-sends of the old one. Above ``max_rows`` unsent results the oldest are
+    dropped, so a long upstream outage can't fill the disk.
+    """
+
+    def __init__(self, path, max_rows=100_000):
+        self.path = path
+        self.max_rows = max_rows
+        self.dropped = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def agent_id(self, default=None):
+        """This node's agent ID: ``default``, or the one generated on first use."""
+        with self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'agent_id'").fetchone()
+            if default and (row is None or row[0] != default):
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('agent_id', ?)", (default,))
+                return default
+            if row is not None:
+                return row[0]
+            generated = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+            self._conn.execute("INSERT INTO meta VALUES ('agent_id', ?)", (generated,))
+            return generated
+
+    def outbox_id(self):
+        """Random ID of this outbox file, generated on first use."""
+        with self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'outbox_id'").fetchone()
+            if row is not None:
+                return row[0]
+            generated = uuid.uuid4().hex
+            self._conn.execute("INSERT INTO meta VALUES ('outbox_id', ?)", (generated,))
+            return generated
+
+    def add(self, result):
+        """Store one result dict; returns its sequence number."""
+        with self._conn:
+            seq = self._conn.execute('INSERT INTO outbox (payload) VALUES (?)',
+                                     (json.dumps(result),)).lastrowid
+            overflow = self.pending_count() - self.max_rows
+            if overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM outbox WHERE seq IN (SELECT seq FROM outbox ORDER BY seq LIMIT ?)',
+                    (overflow,)
+                )
+                self.dropped += overflow
+        return seq
+
+    def pending(self, limit=1000):
+        """Up to ``limit`` unsent results, oldest first, with ``seq`` set."""
+        rows = self._conn.execute('SELECT seq, payload FROM outbox ORDER BY seq LIMIT ?',
+                                  (limit,)).fetchall()
+        return [dict(json.loads(payload), seq=seq) for seq, payload in rows]
+
+    def pending_count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def ack(self, last_seq):
+        """Forget every result up to and including ``last_seq``."""
+        with self._conn:
+            self._conn.execute('DELETE FROM outbox WHERE seq <= ?', (last_seq,))
+
+    def close(self):
+        self._conn.close()
+
+
+def upload_batch(url, agent_id, outbox_id, results, token=None, timeout=30):
+    """POST ``results`` as one gzipped JSON batch; returns the decoded response."""
+    body = gzip.compress(json.dumps({'agent_id': agent_id, 'outbox_id': outbox_id, 'results': results},
+                                    separators=(',', ':')).encode('utf-8'))
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'Content-Encoding': 'gzip',
+    })
+    if token:
+        request.add_header('Authorization', f'Bearer {token}')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class Uploader:
+    """Drains an ``Outbox`` to the ingestion endpoint in batches of ``batch_size``.
+
+    After a failed upload the next attempt waits ``backoff`` seconds,
+    doubling up to ``max_backoff``; results stay in the outbox meanwhile.
+    A batch the server finds too large is retried at half the size.
+    """
+
+    def __init__(self, outbox, url, agent_id, token=None, batch_size=1000,
+                 backoff=5.0, max_backoff=600.0):
+        self.outbox = outbox
+        self.url = url
+        self.agent_id = agent_id
+        self.outbox_id = outbox.outbox_id()
+        self.token = token
+        self.batch_size = batch_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.uploaded = 0
+        self.failures = 0
+        self.last_error = None
+        self._delay = backoff
+        self._retry_at = 0.0
+
+    def flush(self):
+        """Upload pending results unless backing off; returns how many were sent."""
+        if time.monotonic() < self._retry_at:
+            return 0
+        sent = 0
+        while True:
+            batch = self.outbox.pending(self.batch_size)
+            if not batch:
+                break
+            try:
+                upload_batch(self.url, self.agent_id, self.outbox_id, batch, self.token)
+            except (OSError, ValueError) as e:  # URLError and HTTPError are OSErrors
+                code = e.code if isinstance(e, urllib.error.HTTPError) else None
+                if code == 413 and len(batch) > 1:
+                    self.batch_size = max(1, len(batch) // 2)
+                    continue
+                if code in (400, 422):
+                    # Retrying an identical malformed batch won't help; skip past it
+                    print(f"⚠️ Upload rejected ({code}); dropping {len(batch)} results")
+                    self.outbox.ack(batch[-1]['seq'])
+                    continue
+                self.failures += 1
+                self.last_error = e
+                self._retry_at = time.monotonic() + self._delay
+                self._delay = min(self._delay * 2, self.max_backoff)
+                break
+            self.outbox.ack(batch[-1]['seq'])
+            sent += len(batch)
+            self._delay = self.backoff
+            if len(batch) < self.batch_size:
+                break
+        self.uploaded += sent
+        return sent
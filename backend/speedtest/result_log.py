@@ -0,0 +1,169 @@
+"""Buffered, rotating result log for speed.py."""
+import csv
+import gzip
+import io
+import math
+import os
+import shutil
+import struct
+import threading
+import time
+from datetime import datetime
+
+CSV_HEADER = ["Timestamp", "Ping (ms)", "Download (Mbps)", "Upload (Mbps)", "Status"]
+
+# Binary log: magic header, then fixed-size little-endian records of
+# (epoch seconds, ping ms, download Mbps, upload Mbps, connected flag).
+# Missing measurements are stored as NaN.
+BINARY_MAGIC = b"SPDLOG1\n"
+BINARY_RECORD = struct.Struct("<dfffB")
+
+
+def _fmt(value):
+    return f"{value:.2f}" if value else "N/A"
+
+
+class CsvFormat:
+    extension = ".csv"
+    binary = False
+
+    def header(self):
+        buf = io.StringIO()
+        csv.writer(buf).writerow(CSV_HEADER)
+        return buf.getvalue()
+
+    def encode(self, rows):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for ts, ping, download, upload, status in rows:
+            writer.writerow([datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'),
+                             _fmt(ping), _fmt(download), _fmt(upload), status])
+        return buf.getvalue()
+
+
+class BinaryFormat:
+    extension = ".bin"
+    binary = True
+
+    def header(self):
+        return BINARY_MAGIC
+
+    def encode(self, rows):
+        nan = math.nan
+        return b"".join(
+            BINARY_RECORD.pack(ts,
+                               ping if ping is not None else nan,
+                               download if download is not None else nan,
+                               upload if upload is not None else nan,
+                               1 if status == "Connected" else 0)
+            for ts, ping, download, upload, status in rows
+        )
+
+
+FORMATS = {'csv': CsvFormat, 'binary': BinaryFormat}
+
+
+class ResultLog:
+    """Appends results through one open handle and a bounded buffer.
+
+    Rows are flushed once ``buffer_rows`` are pending or ``flush_interval``
+    seconds have passed since the last flush, and fsynced on ``close()``.
+    The file is rotated when it would exceed ``max_bytes`` or, with
+    ``rotate_daily``, when the local date changes; rotated files get a
+    timestamp suffix and are gzipped in the background when ``compress``
+    is set. Existing history is appended to, never truncated.
+    """
+
+    def __init__(self, path, fmt='csv', buffer_rows=64, flush_interval=5.0,
+                 max_bytes=64 * 1024 * 1024, rotate_daily=False, compress=False):
+        self.format = FORMATS[fmt]()
+        # The format picks the extension, so CSV and binary logs sit side by side
+        self.path = os.path.splitext(path)[0] + self.format.extension
+        self.buffer_rows = buffer_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._file = None
+        self._size = 0
+        self._day = None
+        self._compressors = []
+        self._open()
+
+    def _open(self):
+        mode = 'ab' if self.format.binary else 'a'
+        kwargs = {} if self.format.binary else {'newline': '', 'encoding': 'utf-8'}
+        self._file = open(self.path, mode, **kwargs)
+        self._size = self._file.seek(0, os.SEEK_END)
+        if self._size == 0:
+            self._write(self.format.header())
+        self._day = datetime.now().date()
+
+    def _write(self, data):
+        self._file.write(data)
+        self._size += len(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def write(self, ping, download, upload, status, timestamp=None):
+        self._buffer.append((timestamp if timestamp is not None else time.time(),
+                             ping, download, upload, status))
+        if (len(self._buffer) >= self.buffer_rows
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            data = self.format.encode(self._buffer)
+            self._buffer = []
+            if self._should_rotate(len(data)):
+                self._rotate()
+            self._write(data)
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def _should_rotate(self, incoming):
+        if self.rotate_daily and datetime.now().date() != self._day:
+            return True
+        header_size = len(self.format.header())
+        return self.max_bytes and self._size > header_size and self._size + incoming > self.max_bytes
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        root, ext = os.path.splitext(self.path)
+        rotated = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            rotated = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}{ext}"
+            suffix += 1
+        os.replace(self.path, rotated)
+        if self.compress:
+            worker = threading.Thread(target=self._gzip, args=(rotated,), daemon=True)
+            worker.start()
+            self._compressors.append(worker)
+        self._open()
+
+    @staticmethod
+    def _gzip(path):
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(path)
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        for worker in self._compressors:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
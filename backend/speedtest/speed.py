@@ -1,54 +1,115 @@
 import speedtest
 import time
-import csv
+import argparse
+import os
+import random
+import sys
 from datetime import datetime
 from statistics import mean
 
+from outbox import Outbox, Uploader
+from result_log import ResultLog
+
 LOG_FILE = "internet_log.csv"
+OUTBOX_FILE = "agent_outbox.db"
+# local_server.py and throughput_engine.py live with the web backend, one directory up
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def use_backend_modules():
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+def byte_cap(max_bytes):
+    """Convergence tracker that only ends a transfer after ``max_bytes``"""
+    use_backend_modules()
+    from convergence import ConvergencePolicy
+    return ConvergencePolicy(tolerance=0, max_duration=None, max_bytes=max_bytes).tracker()
+
+def test_once(st, engine='speedtest', max_bytes=None):
+    """One full test; returns (ping, download, upload, bytes transferred)
 
-def test_once(st):
+    ``max_bytes`` caps each direction's transfer.
+    """
     ping = st.results.ping
-    download = st.download() / 1_000_000  # Mbps
-    upload = st.upload() / 1_000_000      # Mbps
-    return ping, download, upload
-
-def write_log(timestamp, ping, download, upload, status):
-    with open(LOG_FILE, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([timestamp, f"{ping:.2f}" if ping else "N/A",
-                         f"{download:.2f}" if download else "N/A",
-                         f"{upload:.2f}" if upload else "N/A", status])
-
-def continuous_speed_test(duration_sec=600):
-    st = speedtest.Speedtest(secure=True)
+    if engine == 'native':
+        # Adaptive multi-stream measurement against the same server
+        use_backend_modules()
+        from throughput_engine import ThroughputEngine
+        results = [ThroughputEngine(st.best['url'], direction,
+                                    convergence=byte_cap(max_bytes) if max_bytes else None).run()
+                   for direction in ('download', 'upload')]
+        return ping, results[0]['mbps'], results[1]['mbps'], results[0]['bytes'] + results[1]['bytes']
+    if max_bytes:
+        use_backend_modules()
+        from throughput import TransferSampler
+        speeds = []
+        for direction in ('download', 'upload'):
+            # Restore the test length a capped transfer zeroes
+            length = st.config['length'][direction]
+            try:
+                with TransferSampler(st, direction, lambda mbps, elapsed: None,
+                                     convergence=byte_cap(max_bytes)) as sampler:
+                    transfer = st.download if direction == 'download' else st.upload
+                    speeds.append(transfer(callback=sampler.callback) / 1_000_000)
+            finally:
+                st.config['length'][direction] = length
+        download, upload = speeds
+    else:
+        download = st.download() / 1_000_000  # Mbps
+        upload = st.upload() / 1_000_000      # Mbps
+    return ping, download, upload, st.results.bytes_received + st.results.bytes_sent
+
+def open_logs(log_format='csv', **options):
+    """Open one ResultLog per requested output format"""
+    formats = ['csv', 'binary'] if log_format == 'both' else [log_format]
+    return [ResultLog(LOG_FILE, fmt=fmt, **options) for fmt in formats]
+
+def connect(server_url=None):
+    """Speedtest client with its best server picked, optionally against a local protocol server"""
+    if server_url:
+        use_backend_modules()
+        from local_server import LocalSpeedtest
+        st = LocalSpeedtest(server_url, secure=True)
+    else:
+        st = speedtest.Speedtest(secure=True)
     st.get_best_server()
+    return st
+
+def continuous_speed_test(duration_sec=600, logs=None, server_url=None, engine='speedtest'):
+    st = connect(server_url)
 
     pings, downloads, uploads = [], [], []
     print(f"🌐 Starting 10-minute continuous test...\n")
 
-    # Initialize CSV log
-    with open(LOG_FILE, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Timestamp", "Ping (ms)", "Download (Mbps)", "Upload (Mbps)", "Status"])
+    # Appends to the existing history; the header is only written to new files
+    logs = logs if logs is not None else open_logs()
 
     start_time = time.time()
     test_count = 0
 
-    while time.time() - start_time < duration_sec:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        try:
-            ping, download, upload = test_once(st)
-            pings.append(ping)
-            downloads.append(download)
-            uploads.append(upload)
-            test_count += 1
-            write_log(timestamp, ping, download, upload, "Connected")
-            print(f"#{test_count:03d} ✅ [{timestamp}] Ping: {ping:.2f} ms | Download: {download:.2f} Mbps | Upload: {upload:.2f} Mbps")
-        except Exception as e:
-            write_log(timestamp, None, None, None, "Disconnected")
-            print(f"❌ [{timestamp}] Connection error: {e}")
-        # Optional: remove sleep for full-throttle testing
-        # time.sleep(1)  # If you want slight delay between tests
+    try:
+        while time.time() - start_time < duration_sec:
+            now = time.time()
+            timestamp = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+            try:
+                ping, download, upload, _ = test_once(st, engine)
+                pings.append(ping)
+                downloads.append(download)
+                uploads.append(upload)
+                test_count += 1
+                for log in logs:
+                    log.write(ping, download, upload, "Connected", timestamp=now)
+                print(f"#{test_count:03d} ✅ [{timestamp}] Ping: {ping:.2f} ms | Download: {download:.2f} Mbps | Upload: {upload:.2f} Mbps")
+            except Exception as e:
+                for log in logs:
+                    log.write(None, None, None, "Disconnected", timestamp=now)
+                print(f"❌ [{timestamp}] Connection error: {e}")
+            # Optional: remove sleep for full-throttle testing
+            # time.sleep(1)  # If you want slight delay between tests
+    finally:
+        # Flush buffered rows and fsync, even on Ctrl-C
+        for log in logs:
+            log.close()
 
     # Final stats
     if pings:
@@ -60,5 +121,203 @@ def continuous_speed_test(duration_sec=600):
     else:
         print("No successful tests during the period.")
 
+def monitor_connection(duration_sec=600, logs=None, server_url=None, engine='speedtest',
+                       probe_interval=1.0, full_test_interval=900, data_budget=None,
+                       min_test_bytes=20_000_000):
+    """Probe latency every second, with full tests on a schedule or on degradation, within a data budget"""
+    use_backend_modules()
+    from latency import LatencySampler, latency_url
+    from monitor import (PROBE_BYTES, DataBudget, DegradationDetector, FullTestSchedule,
+                         OutageTracker, transfer_cap)
+
+    st = connect(server_url)
+    sampler = LatencySampler(latency_url(st.best['url']), keep_alive=True)
+    budget = DataBudget(data_budget)
+    outages = OutageTracker()
+    degradation = DegradationDetector()
+    schedule = FullTestSchedule(full_test_interval, min_gap=min(120, full_test_interval or 120))
+    rtts, lost = [], 0
+    downloads, uploads = [], []
+    print(f"🌐 Monitoring for {duration_sec}s (probe every {probe_interval}s)...\n")
+
+    logs = logs if logs is not None else open_logs()
+    start_time = time.time()
+    deadline = start_time + duration_sec
+    next_probe = start_time
+    stop_reason = "completed"
+
+    try:
+        while time.time() < deadline:
+            if not budget.allows(PROBE_BYTES):
+                stop_reason = "data budget exhausted"
+                break
+            now = time.time()
+            timestamp = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+            rtt = sampler.probe()
+            budget.charge(PROBE_BYTES)
+            degraded = False
+            if rtt is None:
+                lost += 1
+            else:
+                rtts.append(rtt)
+                degraded = degradation.add(rtt)
+            event = outages.add(now, rtt is not None)
+            for log in logs:
+                log.write(rtt, None, None, "Connected" if rtt is not None else "Disconnected", timestamp=now)
+            if event == 'outage_started':
+                print(f"❌ [{timestamp}] Outage: {outages.current['lost_probes']} probes lost")
+            elif event == 'outage_ended':
+                print(f"✅ [{timestamp}] Back after {outages.outages[-1]['duration']:.1f}s")
+
+            trigger = schedule.due(now, degraded, event == 'outage_ended')
+            # Keep enough budget for the probes still to come
+            reserve = (deadline - now) / probe_interval * PROBE_BYTES
+            available = budget.available(reserve)
+            if trigger and rtt is not None and (available is None or available >= min_test_bytes):
+                schedule.ran(now)
+                try:
+                    ping, download, upload, used = test_once(st, engine, max_bytes=transfer_cap(available))
+                    budget.charge(used)
+                    downloads.append(download)
+                    uploads.append(upload)
+                    for log in logs:
+                        log.write(ping, download, upload, "Connected", timestamp=now)
+                    print(f"📶 [{timestamp}] Full test ({trigger}): Ping: {ping:.2f} ms | "
+                          f"Download: {download:.2f} Mbps | Upload: {upload:.2f} Mbps | "
+                          f"{used / 1e6:.1f} MB")
+                except Exception as e:
+                    print(f"❌ [{timestamp}] Full test failed: {e}")
+
+            # After a slow probe or a full test, carry on now rather than catching up
+            next_probe = max(next_probe + probe_interval, time.time())
+            time.sleep(max(0.0, min(next_probe, deadline) - time.time()))
+    finally:
+        sampler.close()
+        for log in logs:
+            log.close()
+
+    probes = len(rtts) + lost
+    outage_summary = outages.summary(time.time())
+    spent = budget.summary()
+    print(f"\n📊 Monitoring Stats ({stop_reason}):")
+    print(f"Probes           : {probes} ({lost} lost, {lost / probes * 100 if probes else 0:.1f}%)")
+    if rtts:
+        print(f"Probe Ping       : avg {mean(rtts):.2f} / min {min(rtts):.2f} / max {max(rtts):.2f} ms")
+    print(f"Outages          : {outage_summary['count']} ({outage_summary['total_seconds']:.1f}s)")
+    print(f"Full Tests       : {len(downloads)}")
+    if downloads:
+        print(f"Average Download : {mean(downloads):.2f} Mbps")
+        print(f"Average Upload   : {mean(uploads):.2f} Mbps")
+    budget_note = f" of {spent['limit_bytes'] / 1e6:.1f} MB ({spent['spent_percent']}%)" if spent['limit_bytes'] else ""
+    print(f"Data Used        : {spent['spent_bytes'] / 1e6:.1f} MB{budget_note}")
+
+def run_agent(ingest_url, duration_sec=None, logs=None, server_url=None, engine='speedtest',
+              interval=300, jitter=0.2, agent_id=None, token=None, outbox_path=OUTBOX_FILE,
+              batch_size=1000, upload_interval=60):
+    """Test on a jittered schedule and ship results to the backend's /api/ingest
+
+    Results go to a durable outbox first and are uploaded in gzipped batches,
+    so restarts and backend outages lose nothing. Runs until ``duration_sec``
+    (forever when ``None``) or Ctrl-C.
+    """
+    outbox = Outbox(outbox_path)
+    agent_id = outbox.agent_id(agent_id)
+    uploader = Uploader(outbox, ingest_url, agent_id, token=token, batch_size=batch_size)
+    logs = logs if logs is not None else []
+    st = None
+    print(f"🛰️ Agent {agent_id}: testing every ~{interval}s, uploading to {ingest_url}")
+
+    start_time = time.time()
+    # A random first delay spreads out nodes that were started together
+    next_test = start_time + random.uniform(0, interval * jitter)
+    next_upload = start_time
+
+    try:
+        while duration_sec is None or time.time() - start_time < duration_sec:
+            now = time.time()
+            if now >= next_test:
+                result = {'ts': now, 'ping': None, 'download': None, 'upload': None}
+                try:
+                    # Reconnect after failures; the best server may have changed
+                    st = st or connect(server_url)
+                    ping, download, upload, used = test_once(st, engine)
+                    result.update(ping=ping, download=download, upload=upload, bytes=used,
+                                  server_id=st.best.get('id'), status="Connected")
+                except Exception as e:
+                    st = None
+                    result.update(status="Disconnected", error=str(e))
+                seq = outbox.add(result)
+                for log in logs:
+                    log.write(result['ping'], result['download'], result['upload'],
+                              result['status'], timestamp=now)
+                print(f"#{seq} {result['status']} {result.get('download') or 0:.2f}/"
+                      f"{result.get('upload') or 0:.2f} Mbps ({outbox.pending_count()} queued)")
+                next_test = now + interval * random.uniform(1 - jitter, 1 + jitter)
+            if time.time() >= next_upload:
+                sent = uploader.flush()
+                if sent:
+                    print(f"⬆️ Uploaded {sent} results")
+                elif uploader.last_error is not None and outbox.pending_count():
+                    print(f"⚠️ Upload failed, will retry: {uploader.last_error}")
+                next_upload = time.time() + upload_interval
+            wake = min(next_test, next_upload)
+            if duration_sec is not None:
+                wake = min(wake, start_time + duration_sec)
+            time.sleep(max(0.0, wake - time.time()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Last attempt; whatever fails stays in the outbox for the next run
+        uploader.flush()
+        print(f"📦 {uploader.uploaded} uploaded, {outbox.pending_count()} still queued")
+        outbox.close()
+        for log in logs:
+            log.close()
+
 if __name__ == "__main__":
-    continuous_speed_test(duration_sec=600)  # 10 minutes
+    parser = argparse.ArgumentParser(description="Continuous internet speed logger")
+    parser.add_argument('--duration', type=int, help="Test duration in seconds (default 600; agents run until stopped)")
+    parser.add_argument('--log-format', choices=['csv', 'binary', 'both'], default='csv')
+    parser.add_argument('--buffer-rows', type=int, default=64, help="Rows buffered before a write")
+    parser.add_argument('--flush-interval', type=float, default=5.0, help="Max seconds between writes")
+    parser.add_argument('--max-bytes', type=int, default=64 * 1024 * 1024, help="Rotate above this size")
+    parser.add_argument('--rotate-daily', action='store_true', help="Also rotate when the date changes")
+    parser.add_argument('--compress', action='store_true', help="Gzip rotated logs")
+    parser.add_argument('--server-url', help="Test against a local speedtest-protocol server (local_server.py)")
+    parser.add_argument('--engine', choices=['speedtest', 'native'], default='speedtest',
+                        help="Transfer measurement: speedtest-cli or the adaptive multi-stream engine")
+    parser.add_argument('--monitor', action='store_true',
+                        help="Latency probes with occasional full tests instead of back-to-back full tests")
+    parser.add_argument('--probe-interval', type=float, default=1.0, help="Seconds between monitor probes")
+    parser.add_argument('--full-test-interval', type=float, default=900,
+                        help="Seconds between scheduled full tests in monitor mode (0: only on degradation)")
+    parser.add_argument('--data-budget-mb', type=float, help="Monitor mode data cap in MB")
+    parser.add_argument('--agent', metavar='INGEST_URL',
+                        help="Run as a headless agent uploading to this /api/ingest URL")
+    parser.add_argument('--agent-id', help="Agent name (default: generated once and kept in the outbox)")
+    parser.add_argument('--interval', type=float, default=300, help="Agent seconds between tests")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Agent schedule jitter, as a fraction of --interval")
+    parser.add_argument('--upload-interval', type=float, default=60, help="Agent seconds between uploads")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Agent results per upload request")
+    parser.add_argument('--outbox', default=OUTBOX_FILE, help="Agent outbox database")
+    parser.add_argument('--no-log', action='store_true', help="Agent mode: skip the local result log")
+    args = parser.parse_args()
+
+    logs = [] if args.no_log else open_logs(
+        args.log_format, buffer_rows=args.buffer_rows, flush_interval=args.flush_interval,
+        max_bytes=args.max_bytes, rotate_daily=args.rotate_daily, compress=args.compress
+    )
+    if args.agent:
+        run_agent(args.agent, duration_sec=args.duration, logs=logs, server_url=args.server_url,
+                  engine=args.engine, interval=args.interval, jitter=args.jitter,
+                  agent_id=args.agent_id, token=os.environ.get('SPEEDTEST_INGEST_TOKEN'),
+                  outbox_path=args.outbox, batch_size=args.batch_size,
+                  upload_interval=args.upload_interval)
+    elif args.monitor:
+        monitor_connection(duration_sec=args.duration or 600, logs=logs, server_url=args.server_url,
+                           engine=args.engine, probe_interval=args.probe_interval,
+                           full_test_interval=args.full_test_interval,
+                           data_budget=int(args.data_budget_mb * 1_000_000) if args.data_budget_mb else None)
+    else:
+        continuous_speed_test(duration_sec=args.duration or 600, logs=logs, server_url=args.server_url,
+                              engine=args.engine)  # 10 minutes by default
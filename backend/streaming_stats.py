@@ -0,0 +1,232 @@
+"""Constant-memory statistics for long continuous/stability runs."""
+import json
+import math
+from collections import deque
+
+
+class RunningStats:
+    """Welford mean/variance plus running min/max."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def variance(self):
+        """Sample variance, matching ``statistics.variance``."""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+
+class P2Quantile:
+    """Streaming quantile estimate using the P-square algorithm.
+
+    Jain & Chlamtac (1985): five markers track the minimum, the target
+    quantile, the maximum and two midpoints, adjusted with a piecewise
+    parabolic fit as samples arrive. Memory and time per sample are O(1).
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self._initial = []
+        self._heights = None
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value):
+        if self._heights is None:
+            self._initial.append(value)
+            if len(self._initial) == 5:
+                self._heights = sorted(self._initial)
+            return
+
+        q = self._heights
+        n = self._positions
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= value < q[i + 1])
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = candidate
+                n[i] += step
+
+    def _parabolic(self, i, step):
+        q = self._heights
+        n = self._positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self):
+        if self._heights is not None:
+            return self._heights[2]
+        if not self._initial:
+            return 0.0
+        # Exact quantile of the first few samples
+        ordered = sorted(self._initial)
+        return ordered[min(len(ordered) - 1, int(round(self.p * (len(ordered) - 1))))]
+
+
+class WindowStats:
+    """Mean/stdev/min/max over the last ``size`` samples, O(1) amortized."""
+
+    def __init__(self, size):
+        self.size = size
+        self._values = deque()
+        self._sum = 0.0
+        self._sumsq = 0.0
+        # Monotonic deques of (index, value) for the window min and max
+        self._mins = deque()
+        self._maxs = deque()
+        self._index = 0
+
+    def add(self, value):
+        self._values.append(value)
+        self._sum += value
+        self._sumsq += value * value
+        if len(self._values) > self.size:
+            old = self._values.popleft()
+            self._sum -= old
+            self._sumsq -= old * old
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((self._index, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((self._index, value))
+        oldest = self._index - self.size + 1
+        while self._mins[0][0] < oldest:
+            self._mins.popleft()
+        while self._maxs[0][0] < oldest:
+            self._maxs.popleft()
+        self._index += 1
+
+    @property
+    def count(self):
+        return len(self._values)
+
+    @property
+    def mean(self):
+        return self._sum / len(self._values) if self._values else 0.0
+
+    @property
+    def stdev(self):
+        n = len(self._values)
+        if n < 2:
+            return 0.0
+        variance = (self._sumsq - self._sum * self._sum / n) / (n - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    @property
+    def min(self):
+        return self._mins[0][1] if self._mins else 0.0
+
+    @property
+    def max(self):
+        return self._maxs[0][1] if self._maxs else 0.0
+
+
+class MetricAccumulator:
+    """Everything tracked for one metric (ping, download or upload)."""
+
+    def __init__(self, window=20):
+        self.totals = RunningStats()
+        self.p50 = P2Quantile(0.5)
+        self.p95 = P2Quantile(0.95)
+        self.window = WindowStats(window)
+
+    def add(self, value):
+        self.totals.add(value)
+        self.p50.add(value)
+        self.p95.add(value)
+        self.window.add(value)
+
+    def summary(self):
+        totals = self.totals
+        if not totals.count:
+            return {}
+        return {
+            'avg': round(totals.mean, 2),
+            'min': round(totals.min, 2),
+            'max': round(totals.max, 2),
+            'std': round(totals.stdev, 2),
+            'p50': round(self.p50.value, 2),
+            'p95': round(self.p95.value, 2),
+            'window_avg': round(self.window.mean, 2),
+            'window_std': round(self.window.stdev, 2),
+            'window_min': round(self.window.min, 2),
+            'window_max': round(self.window.max, 2),
+        }
+
+
+class StabilityAccumulator:
+    """Per-run statistics for continuous tests in constant time per result.
+
+    Only the last ``keep_recent`` results are held in memory. When
+    ``spill_path`` is given every result is also appended to it as a JSON
+    line so the full series can be recovered after the run.
+    """
+
+    METRICS = ('ping', 'download', 'upload')
+
+    def __init__(self, window=20, keep_recent=50, spill_path=None):
+        self.metrics = {name: MetricAccumulator(window) for name in self.METRICS}
+        self.recent = deque(maxlen=keep_recent)
+        self.count = 0
+        self.spill_path = spill_path
+        self._spill = open(spill_path, 'a') if spill_path else None
+
+    def add(self, result):
+        self.count += 1
+        for name, metric in self.metrics.items():
+            metric.add(result[name])
+        self.recent.append(result)
+        if self._spill is not None:
+            self._spill.write(json.dumps(result, default=str) + '\n')
+            self._spill.flush()
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def summary(self, name):
+        return self.metrics[name].summary()
+
+    def stability_score(self):
+        # Stability score: lower variance = higher stability
+        spread = sum(self.metrics[name].totals.stdev for name in self.METRICS)
+        return max(0, 100 - spread)
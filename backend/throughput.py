@@ -0,0 +1,162 @@
+"""Live throughput sampling for speedtest-cli transfers."""
+import threading
+import timeit
+
+import speedtest
+
+
+class TransferSampler:
+    """Reports measured throughput while a download/upload is still running.
+
+    ``Speedtest.download()``/``upload()`` only return a total once every
+    transfer thread has finished, but each worker thread keeps a running
+    byte counter. This polls those counters from a side thread and hands
+    ``on_sample(mbps, elapsed)`` the throughput of every interval.
+
+    With a ``convergence`` tracker (see convergence.py) the transfer is cut
+    short as soon as the tracker asks to stop.
+
+    Usage::
+
+        with TransferSampler(st, 'download', on_sample) as sampler:
+            st.download(callback=sampler.callback)
+    """
+
+    def __init__(self, st, direction, on_sample, interval=0.1, convergence=None):
+        if direction not in ('download', 'upload'):
+            raise ValueError(f"Unknown transfer direction: {direction}")
+        self.st = st
+        self.direction = direction
+        self.on_sample = on_sample
+        self.interval = interval
+        self.convergence = convergence
+        self.finished = False
+        self.samples = []
+        self.total_bytes = 0
+        self._worker_class = (speedtest.HTTPDownloader if direction == 'download'
+                              else speedtest.HTTPUploader)
+        # worker thread -> number of counter entries already accounted for
+        self._workers = {}
+        # worker thread -> [first seen, last byte count change] (timer seconds)
+        self._activity = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def start(self):
+        self._start = timeit.default_timer()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # Account for whatever arrived after the last full interval
+        self._collect()
+
+    def callback(self, current, total, start=False, end=False):
+        """speedtest-cli progress callback; registers freshly started workers."""
+        if start:
+            self._discover()
+            if self.finished:
+                self._cut_workers()
+
+    def _discover(self):
+        # Workers belong to this test when they share its shutdown event,
+        # which keeps concurrent tests from reading each other's counters.
+        shutdown_event = getattr(self.st, '_shutdown_event', None)
+        with self._lock:
+            for thread in threading.enumerate():
+                if (isinstance(thread, self._worker_class)
+                        and thread not in self._workers
+                        and thread._shutdown_event is shutdown_event):
+                    self._workers[thread] = 0
+                    now = timeit.default_timer()
+                    self._activity[thread] = [now, now]
+
+    def finish(self):
+        """End the transfer early without cancelling the test.
+
+        Running workers stop after their current read; workers the producer
+        starts afterwards see a zero test length and return immediately.
+        """
+        self.finished = True
+        self.st.config['length'][self.direction] = 0
+        self._discover()
+        self._cut_workers()
+
+    def _cut_workers(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.timeout = 0
+                if self.direction == 'upload':
+                    worker.request.data.timeout = 0
+
+    def _counter(self, worker):
+        if self.direction == 'download':
+            return worker.result
+        return worker.request.data.total
+
+    def _collect(self):
+        """Return bytes transferred since the previous call."""
+        new_bytes = 0
+        now = timeit.default_timer()
+        with self._lock:
+            for worker, seen in self._workers.items():
+                counter = self._counter(worker)
+                size = len(counter)
+                if size > seen:
+                    new_bytes += sum(counter[seen:size])
+                    self._workers[worker] = size
+                    self._activity[worker][1] = now
+        self.total_bytes += new_bytes
+        return new_bytes
+
+    def worker_spans(self):
+        """``(thread, first seen, last active, bytes)`` per worker, in timer seconds.
+
+        Times are only as precise as the sampling interval.
+        """
+        with self._lock:
+            return [(worker, start, end, sum(self._counter(worker)))
+                    for worker, (start, end) in self._activity.items()]
+
+    def _run(self):
+        last = self._start
+        while not self._stop.wait(self.interval):
+            self._discover()
+            now = timeit.default_timer()
+            new_bytes = self._collect()
+            mbps = (new_bytes * 8 / (now - last)) / 1_000_000
+            last = now
+            elapsed = now - self._start
+            self.samples.append((elapsed, mbps))
+            self.on_sample(mbps, elapsed)
+            if (self.convergence is not None and not self.finished
+                    and self.convergence.add(mbps, elapsed, self.total_bytes)):
+                self.finish()
+
+
+def stop_transfers(st):
+    """Make a running ``download()``/``upload()`` on ``st`` return promptly.
+
+    Worker threads already poll the Speedtest's shutdown event between reads;
+    zeroing the configured test lengths also stops the producer from opening
+    connections for the requests it has not started yet.
+    """
+    st._shutdown_event.set()
+    lengths = st.config.get('length', {})
+    for direction in ('download', 'upload'):
+        if direction in lengths:
+            lengths[direction] = 0
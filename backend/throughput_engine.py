@@ -0,0 +1,242 @@
+"""Native multi-connection throughput measurement with adaptive stream count."""
+import http.client
+import os
+import random
+import socket
+import string
+import threading
+import time
+from urllib.parse import urlparse
+
+DOWNLOAD_FILE = 'random4000x4000.jpg'
+UPLOAD_SIZE = 4 * 1024 * 1024  # bytes per POST, within what speedtest servers accept
+READ_SIZE = 1024 * 1024
+SEND_SIZE = 256 * 1024
+TRANSFER_ERRORS = (OSError, http.client.HTTPException, ValueError, AttributeError)
+
+
+def upload_payload(size=UPLOAD_SIZE):
+    """Form-encoded filler body in the shape speedtest.net servers expect."""
+    alphabet = (string.ascii_uppercase + string.digits).encode()
+    block = bytes(random.choice(alphabet) for _ in range(64 * 1024))
+    return (b'content1=' + block * (size // len(block) + 1))[:size]
+
+
+class Stream(threading.Thread):
+    """One persistent connection issuing back-to-back transfer requests."""
+
+    def __init__(self, engine, index):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.index = index
+        self.bytes = 0
+        self.requests = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.ended = None
+        self._conn = None
+
+    def run(self):
+        engine = self.engine
+        buffer = bytearray(READ_SIZE) if engine.direction == 'download' else None
+        while not engine.stopped:
+            try:
+                if self._conn is None:
+                    self._conn = engine.connect()
+                if buffer is not None:
+                    self._download(buffer)
+                else:
+                    self._upload()
+                self.requests += 1
+            except TRANSFER_ERRORS:
+                self.close()
+                if engine.stopped:
+                    break
+                self.errors += 1
+                engine.stop_event.wait(0.05)
+        self.close()
+        self.ended = time.monotonic()
+
+    def _download(self, buffer):
+        engine = self.engine
+        self._conn.request('GET', engine.request_path(self.index),
+                           headers={'Connection': 'keep-alive', 'Cache-Control': 'no-cache'})
+        response = self._conn.getresponse()
+        if response.status != 200:
+            raise http.client.HTTPException(f"Download failed: {response.status}")
+        view = memoryview(buffer)
+        while not engine.stopped:
+            count = response.readinto(view)
+            if not count:
+                return
+            self.bytes += count
+        # Stopped mid-body; the connection can't be reused
+        self.close()
+
+    def _upload(self):
+        engine = self.engine
+        payload = engine.payload
+        conn = self._conn
+        conn.putrequest('POST', engine.request_path(self.index))
+        conn.putheader('Content-Type', 'application/x-www-form-urlencoded')
+        conn.putheader('Content-Length', str(len(payload)))
+        conn.putheader('Connection', 'keep-alive')
+        conn.endheaders()
+        for offset in range(0, len(payload), SEND_SIZE):
+            if engine.stopped:
+                self.close()
+                return
+            chunk = payload[offset:offset + SEND_SIZE]
+            conn.send(chunk)
+            self.bytes += len(chunk)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise http.client.HTTPException(f"Upload failed: {response.status}")
+
+    def abort(self):
+        """Unblock a read or send in progress from another thread."""
+        conn = self._conn
+        sock = conn.sock if conn is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def stats(self, now):
+        elapsed = max(now - self.started, 1e-9)
+        return {
+            'bytes': self.bytes,
+            'requests': self.requests,
+            'errors': self.errors,
+            'mbps': round(self.bytes * 8 / elapsed / 1_000_000, 2),
+        }
+
+
+class ThroughputEngine:
+    """Measures one direction over parallel HTTP streams, adding streams until throughput plateaus.
+
+    Starts ``min_streams`` persistent connections against a speedtest
+    server's ``random*.jpg`` (download) or ``upload.php`` (upload). Every
+    ``ramp_interval`` seconds the aggregate rate of the last window is
+    compared with the best so far; while it improves by at least
+    ``growth_threshold`` the stream count doubles (up to ``max_streams``).
+    The reported rate covers the time since the stream count last changed,
+    so slow start of the first connections doesn't drag it down.
+    ``on_sample(mbps, elapsed)`` gets the aggregate rate every
+    ``sample_interval`` seconds; setting ``stop_event`` ends the run early,
+    as does a ``convergence`` tracker (see convergence.py) asking to stop.
+    """
+
+    def __init__(self, server_url, direction, duration=10.0, min_streams=2, max_streams=16,
+                 ramp_interval=1.0, growth_threshold=0.05, sample_interval=0.1,
+                 timeout=10, on_sample=None, stop_event=None, convergence=None):
+        if direction not in ('download', 'upload'):
+            raise ValueError(f"Unknown transfer direction: {direction}")
+        parts = urlparse(server_url)
+        self.scheme = parts.scheme or 'http'
+        self.netloc = parts.netloc
+        self.path = (parts.path if direction == 'upload'
+                     else f"{os.path.dirname(parts.path)}/{DOWNLOAD_FILE}")
+        self.direction = direction
+        self.duration = duration
+        self.min_streams = max(1, min_streams)
+        self.max_streams = max(self.min_streams, max_streams)
+        self.ramp_interval = ramp_interval
+        self.growth_threshold = growth_threshold
+        self.sample_interval = sample_interval
+        self.timeout = timeout
+        self.on_sample = on_sample
+        self.stop_event = stop_event or threading.Event()
+        self.convergence = convergence
+        self.payload = upload_payload() if direction == 'upload' else None
+        self.streams = []
+        self._done = threading.Event()
+
+    @property
+    def stopped(self):
+        return self._done.is_set() or self.stop_event.is_set()
+
+    def connect(self):
+        connection_class = (http.client.HTTPSConnection if self.scheme == 'https'
+                            else http.client.HTTPConnection)
+        return connection_class(self.netloc, timeout=self.timeout)
+
+    def request_path(self, index):
+        # Unique query string so no cache between us and the server answers
+        return f"{self.path}?x={time.time_ns()}.{index}"
+
+    def _add_streams(self, count):
+        for _ in range(count):
+            stream = Stream(self, len(self.streams))
+            self.streams.append(stream)
+            stream.start()
+
+    def _transferred(self):
+        return sum(stream.bytes for stream in self.streams)
+
+    def run(self):
+        """Run the measurement and return its aggregate and per-stream results."""
+        start = time.monotonic()
+        deadline = start + self.duration
+        self._add_streams(self.min_streams)
+        samples = []
+        last_time, last_bytes = start, 0
+        window_time, window_bytes = start, 0  # start of the current ramp window
+        settled_time, settled_bytes = start, 0  # when the stream count last changed
+        best_rate = 0.0
+        saturated = False
+        try:
+            while not self.stop_event.wait(self.sample_interval):
+                now = time.monotonic()
+                total = self._transferred()
+                rate = (total - last_bytes) * 8 / (now - last_time) / 1_000_000
+                last_time, last_bytes = now, total
+                elapsed = now - start
+                samples.append((round(elapsed, 3), round(rate, 2), len(self.streams)))
+                if self.on_sample is not None:
+                    self.on_sample(rate, elapsed)
+                if now >= deadline:
+                    break
+                if self.convergence is not None and self.convergence.add(rate, elapsed, total):
+                    break
+                if not saturated and now - window_time >= self.ramp_interval:
+                    window_rate = (total - window_bytes) * 8 / (now - window_time) / 1_000_000
+                    improved = window_rate >= best_rate * (1 + self.growth_threshold)
+                    best_rate = max(best_rate, window_rate)
+                    if improved and len(self.streams) < self.max_streams:
+                        self._add_streams(min(len(self.streams), self.max_streams - len(self.streams)))
+                        settled_time, settled_bytes = now, total
+                    else:
+                        saturated = True
+                    window_time, window_bytes = now, total
+        finally:
+            self._done.set()
+            for stream in self.streams:
+                stream.abort()
+            for stream in self.streams:
+                stream.join(self.timeout)
+
+        end = time.monotonic()
+        total = self._transferred()
+        if end - settled_time >= self.ramp_interval / 2:
+            measured_bytes, measured_time = total - settled_bytes, end - settled_time
+        else:
+            measured_bytes, measured_time = total, end - start
+        return {
+            'direction': self.direction,
+            'mbps': round(measured_bytes * 8 / max(measured_time, 1e-9) / 1_000_000, 2),
+            'bytes': total,
+            'duration': round(end - start, 3),
+            'measured_seconds': round(measured_time, 3),
+            'streams': len(self.streams),
+            'saturated': saturated,
+            'per_stream': [stream.stats(end) for stream in self.streams],
+            'samples': samples,
+        }
@@ -0,0 +1,208 @@
+"""Opt-in per-test timing traces in the Chrome trace-event format."""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Trace:
+    """Timestamped spans recorded while one session's test runs.
+
+    Spans are Chrome trace-event "complete" events with microsecond
+    timestamps relative to the start of the trace. Timestamps can be
+    given on the ``perf`` (``time.perf_counter``), ``monotonic`` or
+    ``wall`` (``time.time``) clock. At most ``max_events`` events are
+    kept; later ones are counted in ``dropped``.
+    """
+
+    enabled = True
+
+    def __init__(self, session_id, test_type, max_events=20000):
+        self.session_id = session_id
+        self.test_type = test_type
+        self.max_events = max_events
+        self.started_at = time.time()
+        self.finished_at = None
+        self.reason = None
+        self.events = []
+        self.dropped = 0
+        self._threads = {}  # tid -> thread name
+        self._stack = []  # start times of the open begin() calls
+        self._lock = threading.Lock()
+        self._perf = time.perf_counter()
+        self._monotonic = time.monotonic()
+
+    def _micros(self, timestamp, clock):
+        if clock == 'wall':
+            offset = timestamp - self.started_at
+        elif clock == 'monotonic':
+            offset = timestamp - self._monotonic
+        else:
+            offset = timestamp - self._perf
+        return round(offset * 1_000_000, 1)
+
+    def _add(self, event, tid, thread_name):
+        if tid is None:
+            thread = threading.current_thread()
+            tid, thread_name = thread.ident, thread.name
+        event['pid'] = os.getpid()
+        event['tid'] = tid
+        with self._lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(event)
+            if tid not in self._threads:
+                self._threads[tid] = thread_name or str(tid)
+
+    def complete(self, name, cat, start, end, clock='perf', tid=None, thread_name=None, **args):
+        """Record a span that ran from ``start`` to ``end``."""
+        start_us = self._micros(start, clock)
+        self._add({'name': name, 'cat': cat, 'ph': 'X', 'ts': start_us,
+                   'dur': max(0.0, round(self._micros(end, clock) - start_us, 1)),
+                   'args': args}, tid, thread_name)
+
+    def instant(self, name, cat, **args):
+        self._add({'name': name, 'cat': cat, 'ph': 'i', 's': 't',
+                   'ts': self._micros(time.perf_counter(), 'perf'), 'args': args}, None, None)
+
+    @contextmanager
+    def span(self, name, cat='test', **args):
+        """Record the block as a span; a failing block gets an ``error`` arg."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            args['error'] = repr(e)
+            raise
+        finally:
+            self.complete(name, cat, start, time.perf_counter(), **args)
+
+    @property
+    def duration(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def summary(self):
+        return {
+            'session_id': self.session_id,
+            'test_type': self.test_type,
+            'started': datetime.fromtimestamp(self.started_at).strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': round(self.duration, 3),
+            'events': len(self.events),
+            'dropped_events': self.dropped,
+            'reason': self.reason,
+        }
+
+    def to_chrome(self):
+        """The trace as a Chrome trace-event JSON object (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                     'args': {'name': f'speedtest {self.test_type} {self.session_id}'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in threads.items()]
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': self.summary(),
+        }
+
+
+class _NullTrace:
+    """Stands in for a ``Trace`` when a test isn't traced."""
+
+    enabled = False
+
+    def complete(self, *args, **kwargs):
+        pass
+
+    def instant(self, *args, **kwargs):
+        pass
+
+    @contextmanager
+    def span(self, *args, **kwargs):
+        yield
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Tracer:
+    """Collects per-session traces and keeps the last ``capacity`` of them.
+
+    A test is traced when its session asked for it (``request``), when
+    ``trace_all`` is set, or, with ``slow_threshold`` seconds set, always,
+    with the trace only kept if the test took at least that long. Nested
+    ``begin`` calls for the same session (the single tests inside a
+    continuous run) share the outer trace.
+    """
+
+    def __init__(self, capacity=50, max_events=20000, trace_all=False, slow_threshold=None):
+        self.capacity = capacity
+        self.max_events = max_events
+        self.trace_all = trace_all
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._requested = set()
+        self._active = {}  # session_id -> Trace being recorded
+        self._finished = OrderedDict()  # session_id -> Trace, oldest first
+
+    def request(self, session_id):
+        """Trace the next test started for ``session_id``."""
+        with self._lock:
+            self._requested.add(session_id)
+
+    def active(self, session_id):
+        """The trace recording ``session_id`` right now, or ``NULL_TRACE``."""
+        return self._active.get(session_id, NULL_TRACE)
+
+    def begin(self, session_id, test_type):
+        """Start (or join) the session's trace; pair every call with ``end``."""
+        with self._lock:
+            trace = self._active.get(session_id)
+            if trace is None:
+                requested = session_id in self._requested
+                self._requested.discard(session_id)
+                if not (requested or self.trace_all or self.slow_threshold):
+                    return NULL_TRACE
+                trace = Trace(session_id, test_type, self.max_events)
+                trace.reason = 'requested' if requested else 'all' if self.trace_all else None
+                self._active[session_id] = trace
+        trace._stack.append((test_type, time.perf_counter()))
+        return trace
+
+    def end(self, trace):
+        if not trace.enabled:
+            return
+        test_type, start = trace._stack.pop()
+        trace.complete(f'{test_type} test', 'test', start, time.perf_counter())
+        if trace._stack:
+            return
+        trace.finished_at = time.time()
+        if trace.reason is None and self.slow_threshold and trace.duration >= self.slow_threshold:
+            trace.reason = 'slow'
+        with self._lock:
+            if self._active.get(trace.session_id) is trace:
+                del self._active[trace.session_id]
+            if trace.reason is None:
+                return
+            self._finished.pop(trace.session_id, None)
+            self._finished[trace.session_id] = trace
+            while len(self._finished) > self.capacity:
+                self._finished.popitem(last=False)
+
+    def get(self, session_id):
+        """The latest kept trace for ``session_id`` (finished or still running), or ``None``."""
+        with self._lock:
+            trace = self._active.get(session_id) or self._finished.get(session_id)
+        return trace
+
+    def traces(self):
+        """Summaries of the kept traces, most recent first."""
+        with self._lock:
+            traces = list(self._finished.values())
+        return [trace.summary() for trace in reversed(traces)]
@@ -0,0 +1,137 @@
+"""Opt-in compact encoding of a session's Socket.IO frames.
+
+Clients that start a test with ``'encoding': 'compact'`` get:
+
+* ``ping_sample``, ``download_progress`` and ``upload_progress`` frames as
+  small binary ``test_progress`` payloads instead of JSON dicts. Byte 0
+  is the frame code (``SAMPLE_FRAMES``) with ``KEY_FRAME`` and
+  ``COALESCED`` flag bits, followed by one zigzag varint per field, then
+  the ``coalesced`` count if flagged. Field values are fixed-point
+  (``value * scale``) deltas from the previous frame of the same type; a
+  key frame carries absolute values and is sent first and every
+  ``key_interval`` frames, so clients that join late resynchronise.
+* Every other frame without ``session_id`` (the room already identifies
+  it). Results carry ``server_id`` instead of the raw ``server`` dict,
+  and per-test result lists are replaced by a URL to page through them.
+
+A connection that follows several sessions should use the default JSON
+encoding, since compact frames don't say which session they belong to.
+"""
+
+KEY_FRAME = 0x80
+COALESCED = 0x40
+CODE_MASK = 0x3f
+
+# Frame type -> (code, ((field, scale), ...))
+SAMPLE_FRAMES = {
+    'ping_sample': (1, (('ping', 100), ('sample', 1))),
+    'download_progress': (2, (('download', 100), ('elapsed', 100))),
+    'upload_progress': (3, (('upload', 100), ('elapsed', 100))),
+}
+FRAME_TYPES = {code: (frame_type, fields) for frame_type, (code, fields) in SAMPLE_FRAMES.items()}
+
+# Result lists sent by reference: field -> test type of the stored results
+RESULT_LISTS = {'test_results': 'continuous', 'full_tests': 'monitor'}
+
+
+def _write_varint(out, value):
+    value = value * 2 if value >= 0 else -value * 2 - 1  # zigzag
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(frame, pos):
+    value = shift = 0
+    while True:
+        byte = frame[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), pos
+
+
+class CompactCodec:
+    """Encodes one session's outgoing frames; keeps the delta state per frame type.
+
+    ``results_url`` is where the session's stored results can be paged
+    through; it replaces the lists in ``RESULT_LISTS``.
+    """
+
+    def __init__(self, results_url, key_interval=32):
+        self.results_url = results_url
+        self.key_interval = key_interval
+        self._last = {}  # frame type -> fixed-point values last sent
+        self._since_key = {}  # frame type -> frames since the last key frame
+
+    def encode(self, event, data):
+        if event == 'test_progress' and data.get('type') in SAMPLE_FRAMES:
+            return self._encode_sample(data)
+        compact = {key: value for key, value in data.items() if key != 'session_id'}
+        if event == 'test_result' and isinstance(compact.get('server'), dict):
+            # The summary came with server_selected; the catalog has the rest
+            compact['server_id'] = compact.pop('server').get('id')
+        for field, test_type in RESULT_LISTS.items():
+            if isinstance(compact.get(field), list):
+                compact[f'{field}_count'] = len(compact.pop(field))
+                compact[f'{field}_url'] = f'{self.results_url}&test_type={test_type}'
+        return compact
+
+    def _encode_sample(self, data):
+        frame_type = data['type']
+        code, fields = SAMPLE_FRAMES[frame_type]
+        values = [round((data.get(name) or 0) * scale) for name, scale in fields]
+        since_key = self._since_key.get(frame_type, self.key_interval)
+        previous = self._last.get(frame_type)
+        if previous is None or since_key >= self.key_interval:
+            header, previous, since_key = code | KEY_FRAME, [0] * len(values), 0
+        else:
+            header = code
+        coalesced = data.get('coalesced')
+        if coalesced:
+            header |= COALESCED
+        out = bytearray([header])
+        for value, last in zip(values, previous):
+            _write_varint(out, value - last)
+        if coalesced:
+            _write_varint(out, coalesced)
+        self._last[frame_type] = values
+        self._since_key[frame_type] = since_key + 1
+        return bytes(out)
+
+
+class CompactDecoder:
+    """Client side of ``CompactCodec``'s binary sample frames."""
+
+    def __init__(self):
+        self._last = {}
+
+    def decode(self, frame):
+        """The frame as the dict the JSON encoding would have sent (minus ``session_id``).
+
+        Returns ``None`` for a delta frame that arrives before any key
+        frame of its type.
+        """
+        header = frame[0]
+        frame_type, fields = FRAME_TYPES[header & CODE_MASK]
+        previous = self._last.get(frame_type)
+        if header & KEY_FRAME:
+            previous = [0] * len(fields)
+        pos = 1
+        values = []
+        for _ in fields:
+            delta, pos = _read_varint(frame, pos)
+            values.append(delta)
+        if previous is None:
+            return None
+        values = [last + delta for last, delta in zip(previous, values)]
+        self._last[frame_type] = values
+        data = {'type': frame_type}
+        for (name, scale), value in zip(fields, values):
+            data[name] = value if scale == 1 else value / scale
+        if header & COALESCED:
+            data['coalesced'], pos = _read_varint(frame, pos)
+        return data
@@ -4,8 +4,11 @@ import { FaDownload, FaUpload, FaWifi, FaStop } from 'react-icons/fa';
 import Gauge from './Gauge';
 import LiveSpeedDisplay from './LiveSpeedDisplay';
 import StabilityReport from './StabilityReport';
+import { createCompactDecoder, isBinaryFrame } from './wireFormat';
 
 const socket = io('http://localhost:5000');
+// Tests are started with the compact encoding: sample frames arrive binary
+const decodeSample = createCompactDecoder();
 
 const SpeedTest = () => {
   const [results, setResults] = useState(null);
@@ -46,7 +49,9 @@ const SpeedTest = () => {
       }
     });
 
-    socket.on('test_progress', (data) => {
+    socket.on('test_progress', (frame) => {
+      const data = isBinaryFrame(frame) ? decodeSample(frame) : frame;
+      if (!data) return;
       setTestProgress(data.message || '');
       
       if (data.type === 'client_info') {
@@ -130,7 +135,8 @@ const SpeedTest = () => {
       session_id: sessionId,
       test_type: testType,
       duration: duration,
-      server_id: selectedServerId
+      server_id: selectedServerId,
+      encoding: 'compact'
     });
   };
 
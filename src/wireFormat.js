@@ -0,0 +1,70 @@
+// Client side of the backend's compact encoding (backend/wire_format.py).
+// ping_sample, download_progress and upload_progress frames arrive as binary
+// test_progress payloads: byte 0 is the frame code plus KEY_FRAME and
+// COALESCED flag bits, then one zigzag varint per field. Values are
+// fixed-point deltas from the previous frame of the same type; key frames
+// carry absolute values.
+
+const KEY_FRAME = 0x80;
+const COALESCED = 0x40;
+const CODE_MASK = 0x3f;
+
+// Frame code -> [frame type, [[field, scale], ...]], as SAMPLE_FRAMES in wire_format.py
+const FRAME_TYPES = {
+  1: ['ping_sample', [['ping', 100], ['sample', 1]]],
+  2: ['download_progress', [['download', 100], ['elapsed', 100]]],
+  3: ['upload_progress', [['upload', 100], ['elapsed', 100]]],
+};
+
+const readVarint = (frame, pos) => {
+  let value = 0;
+  let scale = 1;
+  let byte;
+  do {
+    byte = frame[pos++];
+    value += (byte & 0x7f) * scale;
+    scale *= 128;
+  } while (byte >= 0x80);
+  // Undo the zigzag mapping with arithmetic, as bitwise operators are 32-bit
+  return [value % 2 ? -(value + 1) / 2 : value / 2, pos];
+};
+
+export const isBinaryFrame = (frame) => frame instanceof ArrayBuffer || ArrayBuffer.isView(frame);
+
+// Returns a decoder that keeps the delta state for one session's frames. It
+// gives back each frame as the JSON encoding would have sent it (minus
+// session_id), or null for a delta frame that arrives before any key frame
+// of its type.
+export const createCompactDecoder = () => {
+  const last = {}; // frame type -> fixed-point values last decoded
+
+  return (buffer) => {
+    const frame = ArrayBuffer.isView(buffer)
+      ? new Uint8Array(buffer.buffer, buffer.byteOffset, buffer.byteLength)
+      : new Uint8Array(buffer);
+    const header = frame[0];
+    const frameType = FRAME_TYPES[header & CODE_MASK];
+    if (!frameType) return null;
+    const [type, fields] = frameType;
+    const previous = header & KEY_FRAME ? fields.map(() => 0) : last[type];
+
+    let pos = 1;
+    const deltas = fields.map(() => {
+      const [delta, next] = readVarint(frame, pos);
+      pos = next;
+      return delta;
+    });
+    if (!previous) return null;
+
+    const values = deltas.map((delta, i) => previous[i] + delta);
+    last[type] = values;
+    const data = { type };
+    fields.forEach(([name, scale], i) => {
+      data[name] = scale === 1 ? values[i] : values[i] / scale;
+    });
+    if (header & COALESCED) {
+      data.coalesced = readVarint(frame, pos)[0];
+    }
+    return data;
+  };
+};